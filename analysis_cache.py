@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import threading
+import time
+from pathlib import Path
+
+from shared_state import connect_shared
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_code(code: str) -> str:
+    """Normalize line endings and trailing whitespace so cosmetic diffs share a cache entry."""
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def make_cache_key(code: str, model: str, analytype: str) -> str:
+    """Build the content-addressed key for one analysis request."""
+    code_hash = hashlib.sha256(normalize_code(code).encode("utf-8")).hexdigest()
+    return f"{code_hash}:{model}:{analytype}"
+
+
+class AnalysisCache:
+    """基于SQLite的分析结果缓存，按(代码hash, 模型, 分析类型)寻址，支持按大小和时间淘汰"""
+
+    def __init__(self, db_path: Path, max_bytes: int = 200 * 1024 * 1024, max_age_seconds: float = 30 * 24 * 3600):
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 多个worker进程共用同一个缓存数据库
+        self._conn = connect_shared(self.db_path)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                analytype TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_last_access ON analyses(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_created_at ON analyses(created_at)")
+        # 缓存总大小由触发器维护，淘汰时不必每次 SUM(size)；所有worker进程的写入都会计入
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL);
+            INSERT OR IGNORE INTO cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM analyses;
+            CREATE TRIGGER IF NOT EXISTS analyses_size_insert AFTER INSERT ON analyses
+                BEGIN UPDATE cache_size SET total = total + NEW.size; END;
+            CREATE TRIGGER IF NOT EXISTS analyses_size_delete AFTER DELETE ON analyses
+                BEGIN UPDATE cache_size SET total = total - OLD.size; END;
+            CREATE TRIGGER IF NOT EXISTS analyses_size_update AFTER UPDATE OF size ON analyses
+                BEGIN UPDATE cache_size SET total = total + NEW.size - OLD.size; END;
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        """Return the cached analysis for key, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT content, created_at FROM analyses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE analyses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, analytype: str, content: str):
+        """Store an analysis and evict old entries if the cache grew too large."""
+        now = time.time()
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            # 用 upsert 而不是 INSERT OR REPLACE：REPLACE 删除旧行时不触发删除触发器
+            self._conn.execute(
+                "INSERT INTO analyses (key, model, analytype, content, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET model = excluded.model, "
+                "analytype = excluded.analytype, content = excluded.content, size = excluded.size, "
+                "created_at = excluded.created_at, last_access = excluded.last_access",
+                (key, model, analytype, content, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least recently used ones until under max_bytes."""
+        cursor = self._conn.execute("DELETE FROM analyses WHERE created_at < ?", (now - self.max_age_seconds,))
+        self.evictions += cursor.rowcount
+        total = self._conn.execute("SELECT total FROM cache_size").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        while total > self.max_bytes:
+            # 每次只取最久未访问的一小批，缓存满时每次写入也不必读出所有行
+            oldest = self._conn.execute("SELECT key, size FROM analyses ORDER BY last_access LIMIT 64").fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                total -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM analyses")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            total = self._conn.execute("SELECT total FROM cache_size").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
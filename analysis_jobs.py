@@ -0,0 +1,308 @@
+import asyncio
+import contextvars
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXCLUDES = [
+    ".git/*", "*/.git/*", "node_modules/*", "*/node_modules/*", "__pycache__/*", "*/__pycache__/*",
+    "*.ai", "*.ai.json", "*.ai.json.tmp", "*.min.js", "*.min.css", "*.map", "*.lock", "*.png", "*.jpg", "*.jpeg", "*.gif",
+    "*.ico", "*.pdf", "*.zip", "*.gz", "*.exe", "*.dll", "*.so", "*.pyc",
+]
+# 运行中的任务最多每隔这么久写一次进度文件；重启后未记录的已完成文件按 .ai 的修改时间跳过
+PERSIST_INTERVAL_SECONDS = 2.0
+
+
+def matches_any(rel_path: str, patterns: List[str]) -> bool:
+    """Match a relative posix path, or its basename, against glob patterns."""
+    name = rel_path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def analysis_is_fresh(path: str) -> bool:
+    """A sidecar is up to date when it exists and is not older than its source file."""
+    try:
+        return os.path.getmtime(path + ".ai") >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+def split_fresh(files: List[str], completed: set) -> Tuple[int, List[str]]:
+    """(number of files whose analysis is up to date, files still to analyze), leaving out completed ones."""
+    skipped, pending = 0, []
+    for path in files:
+        if path in completed:
+            continue
+        if analysis_is_fresh(path):
+            skipped += 1
+        else:
+            pending.append(path)
+    return skipped, pending
+
+
+def collect_files(root: str, include: List[str], exclude: List[str], max_file_bytes: int) -> List[str]:
+    """Walk root and return the files a job should consider, in a stable order."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in (".git", "node_modules", "__pycache__"))
+        for filename in sorted(filenames):
+            full_path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(full_path, root).replace(os.sep, "/")
+            if include and not matches_any(rel_path, include):
+                continue
+            if matches_any(rel_path, exclude):
+                continue
+            try:
+                if os.path.getsize(full_path) > max_file_bytes:
+                    continue
+            except OSError:
+                continue
+            files.append(full_path)
+    return files
+
+
+class RateLimiter:
+    """按provider限制每分钟请求数（均匀间隔发放）"""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# 当前批量任务的限流器：每次真正发往模型的调用前都要获取（一个文件可能对应多次调用）
+current_rate_limiter = contextvars.ContextVar("current_rate_limiter", default=None)
+
+
+async def acquire_rate_limit():
+    """Wait for the rate limiter of the batch job this call belongs to, if any."""
+    limiter = current_rate_limiter.get()
+    if limiter is not None:
+        await limiter.acquire()
+
+
+class AnalysisJobManager:
+    """整仓库批量分析任务：有界worker池并发分析、写入.ai文件，进度持久化以便重启后续跑"""
+
+    def __init__(self, jobs_dir: Path, analyze, resolve_provider, provider_rpm: dict = None, on_saved=None):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.analyze = analyze
+        self.resolve_provider = resolve_provider
+        self.provider_rpm = provider_rpm or {}
+        self.on_saved = on_saved  # 写入 .ai 文件后以其路径调用
+        self.jobs = {}
+        self._tasks = {}
+        self._cancel_requested = set()
+        self._rate_limiters = {}
+        self._persisted_at = {}
+        self._write_lock = threading.Lock()
+
+    def _rate_limiter(self, provider: str) -> RateLimiter:
+        if provider not in self._rate_limiters:
+            self._rate_limiters[provider] = RateLimiter(self.provider_rpm.get(provider, 0))
+        return self._rate_limiters[provider]
+
+    def _job_file(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _cancel_file(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.cancel"
+
+    def _load(self, job_file: Path) -> Optional[dict]:
+        try:
+            with open(job_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading job {job_file}: {e}")
+            return None
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """A job of this process, or the last persisted state of a job run by another worker."""
+        if job_id in self._tasks:
+            return self.jobs[job_id]
+        job_file = self._job_file(job_id)
+        return self._load(job_file) if job_file.exists() else None
+
+    def all_jobs(self) -> List[dict]:
+        return [job for job in (self.get(f.stem) for f in sorted(self.jobs_dir.glob("*.json"))) if job is not None]
+
+    def _write(self, job_id: str, data: str):
+        with self._write_lock:
+            tmp_path = self._job_file(job_id).with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self._job_file(job_id))
+
+    def _persist(self, job: dict):
+        self._persisted_at[job["id"]] = time.monotonic()
+        self._write(job["id"], json.dumps(job, ensure_ascii=False))
+
+    async def _persist_progress(self, job: dict):
+        """Persist a running job in a thread, at most once every PERSIST_INTERVAL_SECONDS."""
+        now = time.monotonic()
+        if now - self._persisted_at.get(job["id"], 0.0) < PERSIST_INTERVAL_SECONDS:
+            return
+        self._persisted_at[job["id"]] = now
+        # 在事件循环中序列化（其他worker还在修改job），只把写文件放到线程中
+        await asyncio.to_thread(self._write, job["id"], json.dumps(job, ensure_ascii=False))
+
+    def create_job(self, path: str, model: str, analytype: str, include: List[str],
+                   exclude: List[str], concurrency: int, max_file_bytes: int) -> dict:
+        if not os.path.isdir(path):
+            raise ValueError(f"Not a directory: {path}")
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "path": str(Path(path).resolve()),
+            "model": model,
+            "analytype": analytype,
+            "include": include,
+            "exclude": exclude if exclude is not None else DEFAULT_EXCLUDES,
+            "concurrency": max(1, concurrency),
+            "max_file_bytes": max_file_bytes,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "total": 0,
+            "completed": [],
+            "skipped": 0,
+            "failed": {},
+            "elapsed_analyzing": 0.0,
+        }
+        self.jobs[job["id"]] = job
+        self._persist(job)
+        self._start(job)
+        return job
+
+    def _start(self, job: dict):
+        self._tasks[job["id"]] = asyncio.ensure_future(self._run(job))
+
+    def resume_jobs(self):
+        """Reload persisted jobs and restart any that were queued or running."""
+        for job_file in self.jobs_dir.glob("*.json"):
+            job = self._load(job_file)
+            if job is None:
+                continue
+            self.jobs[job["id"]] = job
+            if job["status"] in ("queued", "running"):
+                logger.info(f"Resuming analysis job {job['id']} for {job['path']}")
+                self._start(job)
+
+    def cancel_job(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        if task is None:
+            # 任务在另一个worker进程中运行：留下取消标记，由该进程在处理下一个文件前检查
+            job = self.get(job_id)
+            if job is None or job["status"] not in ("queued", "running"):
+                return False
+            self._cancel_file(job_id).touch()
+            return True
+        if task.done():
+            return False
+        self._cancel_requested.add(job_id)
+        task.cancel()
+        return True
+
+    async def _run(self, job: dict):
+        job["status"] = "running"
+        job["started_at"] = job["started_at"] or time.time()
+        try:
+            files = await asyncio.to_thread(
+                collect_files, job["path"], job["include"], job["exclude"], job["max_file_bytes"]
+            )
+            completed = set(job["completed"])
+            skipped, pending = await asyncio.to_thread(split_fresh, files, completed)
+            job["total"] = len(completed) + skipped + len(pending)
+            job["skipped"] = skipped
+            await asyncio.to_thread(self._persist, job)
+
+            queue = asyncio.Queue()
+            for path in pending:
+                queue.put_nowait(path)
+            workers = [asyncio.ensure_future(self._worker(job, queue)) for _ in range(job["concurrency"])]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+            job["status"] = "finished"
+        except asyncio.CancelledError:
+            if job["id"] not in self._cancel_requested:
+                # 服务关闭导致的取消：保持running状态，重启后自动续跑
+                self._persist(job)
+                raise
+            job["status"] = "cancelled"
+        except Exception as e:
+            logger.error(f"Analysis job {job['id']} failed: {e}", exc_info=True)
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["finished_at"] = time.time()
+        self._persist(job)
+        self._persisted_at.pop(job["id"], None)
+        self._cancel_file(job["id"]).unlink(missing_ok=True)
+
+    async def _worker(self, job: dict, queue: asyncio.Queue):
+        # 每个worker是独立的任务，设置的上下文只作用于它发出的调用（缓存命中不计数）
+        current_rate_limiter.set(self._rate_limiter(self.resolve_provider(job["model"])))
+        while not queue.empty():
+            if self._cancel_file(job["id"]).exists():
+                self.cancel_job(job["id"])
+                return
+            path = queue.get_nowait()
+            try:
+                code = await asyncio.to_thread(Path(path).read_text, encoding="utf-8")
+            except UnicodeDecodeError:
+                job["skipped"] += 1
+                continue
+            except OSError as e:
+                job["failed"][path] = str(e)
+                continue
+            if not code.strip() or "\x00" in code:
+                job["skipped"] += 1
+                continue
+
+            start = time.monotonic()
+            try:
+                content = await self.analyze(code, job["model"], job["analytype"], path)
+                await asyncio.to_thread(Path(path + ".ai").write_text, content, encoding="utf-8")
+                if self.on_saved is not None:
+                    self.on_saved(path + ".ai")
+                job["completed"].append(path)
+                job["failed"].pop(path, None)
+            except Exception as e:
+                logger.error(f"Error analyzing {path} in job {job['id']}: {e}")
+                job["failed"][path] = str(e)
+            job["elapsed_analyzing"] += time.monotonic() - start
+            await self._persist_progress(job)
+
+    def progress(self, job: dict) -> dict:
+        """Summarize a job for the API, including an ETA from the average time per file."""
+        done = len(job["completed"])
+        processed = done + job["skipped"] + len(job["failed"])
+        remaining = max(0, job["total"] - processed)
+        eta = None
+        if job["status"] == "running" and done:
+            per_file = job["elapsed_analyzing"] / done / job["concurrency"]
+            eta = round(per_file * remaining, 1)
+        summary = {k: v for k, v in job.items() if k != "completed"}
+        summary.update({"done": done, "remaining": remaining, "eta_seconds": eta})
+        return summary
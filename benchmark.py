@@ -0,0 +1,465 @@
+"""服务端热点路径的基准测试
+
+Runs the FastAPI app in-process (uvicorn in a background thread) against generated
+repository trees and a fake OpenAI-compatible model server (fake_llm.py), drives
+concurrent load at the hot endpoints and writes the results as JSON.
+
+    python benchmark.py run --files 100000 --concurrency 32 --output results.json
+    python benchmark.py run --baseline results.json          # run and compare with an earlier run
+    python benchmark.py compare old.json new.json --threshold 0.1
+
+Generated trees are kept in --workdir and reused by later runs; server state
+(history, caches, indexes) starts empty in a fresh directory each run.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import httpx
+
+BENCH_MODEL = "ppinfra|bench-model"
+FILES_PER_DIR = 100
+ALL_SCENARIOS = ("files", "content", "content_large", "history", "analyze", "analyze_stream", "analyze_cached")
+# 比较时延迟的变化小于这个毫秒数视为噪声
+MIN_LATENCY_DELTA_MS = 1.0
+
+SAMPLE_MODULE = '''"""Generated module {index}."""
+import os
+from typing import List
+
+
+class Item{index}:
+    """A small class so the file looks like ordinary code."""
+
+    def __init__(self, name: str, values: List[int]):
+        self.name = name
+        self.values = values
+
+    def total(self) -> int:
+        return sum(v * {factor} for v in self.values)
+
+    def describe(self) -> str:
+        return f"{{self.name}}: {{self.total()}} ({{os.sep}})"
+
+
+def build_{index}(count: int = {factor}) -> List[Item{index}]:
+    items = []
+    for i in range(count):
+        items.append(Item{index}(f"item-{{i}}", list(range(i % 7))))
+    return items
+'''
+
+
+# ---------------------------------------------------------------- data sets
+
+def generate_tree(root: Path, files: int) -> Path:
+    """Create `files` small source files, at most FILES_PER_DIR per directory; reused if already complete."""
+    tree = root / f"tree-{files}"
+    marker = tree / ".bench-complete"
+    if marker.exists():
+        return tree
+    if tree.exists():
+        shutil.rmtree(tree)
+    leaf_dirs = max(1, math.ceil(files / FILES_PER_DIR))
+    levels = 1
+    while FILES_PER_DIR ** levels < leaf_dirs:
+        levels += 1
+    print(f"Generating {files} files under {tree} ...", flush=True)
+    for i in range(files):
+        leaf = i // FILES_PER_DIR
+        parts = []
+        for _ in range(levels):
+            parts.append(f"d{leaf % FILES_PER_DIR:02d}")
+            leaf //= FILES_PER_DIR
+        directory = tree.joinpath(*reversed(parts))
+        if i % FILES_PER_DIR == 0:
+            directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"mod_{i}.py").write_text(SAMPLE_MODULE.format(index=i, factor=i % 13 + 1), encoding="utf-8")
+    marker.write_text(str(files), encoding="utf-8")
+    return tree
+
+
+def generate_large_file(root: Path, size_mb: int) -> Path:
+    """One large source file of about size_mb megabytes."""
+    path = root / f"large-{size_mb}mb.py"
+    if path.exists():
+        return path
+    root.mkdir(parents=True, exist_ok=True)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        i = 0
+        while written < target:
+            block = SAMPLE_MODULE.format(index=i, factor=i % 13 + 1)
+            f.write(block)
+            written += len(block)
+            i += 1
+    return path
+
+
+def sample_paths(tree: Path, limit: int = 2000, seed: int = 0):
+    """(directories, files) to pick requests from; walks only as far as needed."""
+    directories, files = [str(tree)], []
+    for dirpath, dirnames, filenames in os.walk(tree):
+        dirnames.sort()
+        directories.append(dirpath)
+        files.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.endswith(".py"))
+        if len(files) >= limit * 5:
+            break
+    rng = random.Random(seed)
+    rng.shuffle(files)
+    return directories, files[:limit]
+
+
+# ---------------------------------------------------------------- servers
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class BackgroundServer:
+    """uvicorn running an ASGI app in a daemon thread of this process."""
+
+    def __init__(self, app, port: int):
+        import uvicorn
+        self.port = port
+        config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, name=f"bench-server-{port}", daemon=True)
+
+    def start(self, timeout: float = 30.0):
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError(f"Server on port {self.port} did not start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def start_app_in_process(state_dir: Path, llm_url: str, history_entries: int, log_level: str = "warning"):
+    """Import server.py with its data/ directory in state_dir and point its model clients at the fake LLM."""
+    os.chdir(state_dir)
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import server
+    from openai import AsyncOpenAI
+
+    # 服务端每个请求都会写INFO日志，默认调低以免输出淹没结果（也可用 --log-level info 计入日志开销）
+    logging.getLogger().setLevel(log_level.upper())
+
+    fake_client = AsyncOpenAI(base_url=llm_url, api_key="bench")
+    # 客户端出错重置后也不能连到真实服务商
+    server.AIClientSingleton.get_ppinfra_client = classmethod(lambda cls: fake_client)
+    for i in range(history_entries):
+        server.history_store.touch(str(state_dir / f"project-{i}"))
+    app_server = BackgroundServer(server.app, free_port())
+    app_server.start()
+    return app_server
+
+
+# ---------------------------------------------------------------- load
+
+class Scenario:
+    def __init__(self, name: str, make_request: Callable[[random.Random, int], tuple], stream: bool = False):
+        self.name = name
+        self.make_request = make_request  # (rng, request number) -> (method, url, kwargs)
+        self.stream = stream
+
+
+def build_scenarios(names: List[str], tree: Path, large_file: Path, llm_code: str) -> List[Scenario]:
+    directories, files = sample_paths(tree)
+    large_lines = sum(1 for _ in open(large_file, "rb"))
+
+    def analyze_body(code: str, stream: bool, use_cache: bool) -> dict:
+        return {"code": code, "model": BENCH_MODEL, "analytype": "detail", "stream": stream,
+                "use_cache": use_cache, "reduction": "none"}
+
+    # 每个请求的代码不同，避免被缓存或并发合并
+    factories = {
+        "files": lambda rng, n: ("GET", "/api/files", {"params": {"path": directories[0] if n == 0 else rng.choice(directories)}}),
+        "content": lambda rng, n: ("GET", "/api/content", {"params": {"path": rng.choice(files)}}),
+        "content_large": lambda rng, n: ("GET", "/api/content", {"params": {
+            "path": str(large_file), "offset": rng.randrange(max(1, large_lines - 500)), "limit": 500}}),
+        "history": lambda rng, n: ("GET", "/api/history", {}),
+        "analyze": lambda rng, n: ("POST", "/api/analyze", {"json": analyze_body(f"{llm_code}# run {rng.random()}\n", False, False)}),
+        "analyze_stream": lambda rng, n: ("POST", "/api/analyze", {"json": analyze_body(f"{llm_code}# run {rng.random()}\n", True, False)}),
+        "analyze_cached": lambda rng, n: ("POST", "/api/analyze", {"json": analyze_body(llm_code, False, True)}),
+    }
+    return [Scenario(name, factories[name], stream=name == "analyze_stream") for name in names]
+
+
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+async def timed_request(client: httpx.AsyncClient, scenario: Scenario, rng: random.Random, n: int):
+    """Returns (ok, seconds, bytes, seconds to first streamed delta or None)."""
+    method, url, kwargs = scenario.make_request(rng, n)
+    started = time.perf_counter()
+    first_delta = None
+    size = 0
+    if scenario.stream:
+        ok = True
+        async with client.stream(method, url, **kwargs) as response:
+            async for line in response.aiter_lines():
+                size += len(line) + 1
+                if first_delta is None and line.startswith("data:") and '"delta"' in line:
+                    first_delta = time.perf_counter() - started
+                if line.startswith('data: {"error"'):
+                    ok = False
+            ok = ok and response.status_code < 400
+    else:
+        response = await client.request(method, url, **kwargs)
+        size = len(response.content)
+        ok = response.status_code < 400
+    return ok, time.perf_counter() - started, size, first_delta
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, concurrency: int,
+                       duration: float, max_requests: Optional[int], seed: int) -> dict:
+    # 第一个请求单独计时：冷启动（建索引、打开文件、建立连接）的开销
+    ok, cold, _, _ = await timed_request(client, scenario, random.Random(seed), 0)
+    if not ok:
+        print(f"  warning: warm-up request for {scenario.name} failed", flush=True)
+
+    latencies, first_deltas = [], []
+    counters = {"started": 1, "errors": 0, "bytes": 0}
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id: int):
+        rng = random.Random(seed * 1000 + worker_id)
+        while time.perf_counter() < deadline and (max_requests is None or counters["started"] <= max_requests):
+            n = counters["started"]
+            counters["started"] += 1
+            try:
+                ok, seconds, size, first_delta = await timed_request(client, scenario, rng, n)
+            except httpx.HTTPError:
+                counters["errors"] += 1
+                continue
+            if not ok:
+                counters["errors"] += 1
+                continue
+            latencies.append(seconds)
+            counters["bytes"] += size
+            if first_delta is not None:
+                first_deltas.append(first_delta)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    def ms(samples, p):
+        value = percentile(samples, p)
+        return round(value * 1000, 2) if value is not None else None
+
+    total = len(latencies) + counters["errors"]
+    return {
+        "requests": total,
+        "errors": counters["errors"],
+        "error_rate": round(counters["errors"] / total, 4) if total else 0.0,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "bytes_per_request": round(counters["bytes"] / len(latencies)) if latencies else 0,
+        "cold_ms": round(cold * 1000, 2),
+        "latency_ms": {"mean": round(1000 * sum(latencies) / len(latencies), 2) if latencies else None,
+                       "p50": ms(latencies, 0.5), "p90": ms(latencies, 0.9), "p99": ms(latencies, 0.99),
+                       "max": ms(latencies, 1.0)},
+        "first_delta_ms": {"p50": ms(first_deltas, 0.5), "p99": ms(first_deltas, 0.99)} if scenario.stream else None,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+async def run_load(base_url: str, scenarios: List[Scenario], args) -> dict:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(300.0)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        for scenario in scenarios:
+            print(f"Running {scenario.name} (concurrency {args.concurrency}, {args.duration}s) ...", flush=True)
+            results[scenario.name] = await run_scenario(client, scenario, args.concurrency, args.duration,
+                                                        args.requests, args.seed)
+            result = results[scenario.name]
+            print(f"  {result['throughput_rps']} req/s, p50 {result['latency_ms']['p50']}ms, "
+                  f"p99 {result['latency_ms']['p99']}ms, errors {result['errors']}", flush=True)
+    return results
+
+
+def run(args) -> int:
+    workdir = Path(args.workdir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    names = args.scenarios.split(",")
+    unknown = set(names) - set(ALL_SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    tree = generate_tree(workdir / "trees", args.files)
+    large_file = generate_large_file(workdir / "large", args.large_file_mb)
+    llm_code = SAMPLE_MODULE.format(index=0, factor=3)
+    scenarios = build_scenarios(names, tree, large_file, llm_code)
+
+    llm_server = app_server = None
+    state_dir = None
+    cwd = os.getcwd()
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            from fake_llm import create_app
+            llm_server = BackgroundServer(create_app(args.llm_latency, args.llm_tokens_per_second,
+                                                     args.llm_completion_tokens), free_port())
+            llm_server.start()
+            state_dir = Path(tempfile.mkdtemp(prefix="server-", dir=workdir))
+            app_server = start_app_in_process(state_dir, f"http://127.0.0.1:{llm_server.port}/v1",
+                                              args.history_entries, args.log_level)
+            base_url = f"http://127.0.0.1:{app_server.port}"
+        results = asyncio.run(run_load(base_url, scenarios, args))
+    finally:
+        if app_server is not None:
+            app_server.stop()
+        if llm_server is not None:
+            llm_server.stop()
+        os.chdir(cwd)
+        if state_dir is not None:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "target": args.url or "in-process",
+            "config": {key: value for key, value in vars(args).items() if key not in ("func", "baseline", "output")},
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        return print_comparison(baseline, report, args.threshold)
+    return 0
+
+
+# ---------------------------------------------------------------- compare
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> List[dict]:
+    """Per scenario and metric: old value, new value, relative change and whether it is a regression."""
+    rows = []
+    for name, new in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        metrics = [("throughput_rps", old["throughput_rps"], new["throughput_rps"], True)]
+        for key in ("p50", "p90", "p99"):
+            metrics.append((f"latency_{key}_ms", old["latency_ms"][key], new["latency_ms"][key], False))
+        if new.get("first_delta_ms") and old.get("first_delta_ms"):
+            metrics.append(("first_delta_p50_ms", old["first_delta_ms"]["p50"], new["first_delta_ms"]["p50"], False))
+        metrics.append(("error_rate", old["error_rate"], new["error_rate"], False))
+        for metric, before, after, higher_is_better in metrics:
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else (0.0 if after == before else math.inf)
+            if metric == "error_rate":
+                regression = after > before + 0.01
+            elif higher_is_better:
+                regression = change < -threshold
+            else:
+                regression = change > threshold and after - before > MIN_LATENCY_DELTA_MS
+            rows.append({"scenario": name, "metric": metric, "baseline": before, "current": after,
+                         "change": change, "regression": regression})
+    return rows
+
+
+def print_comparison(baseline: dict, current: dict, threshold: float) -> int:
+    """Print a comparison table; returns 1 when any metric regressed by more than threshold."""
+    rows = compare_results(baseline, current, threshold)
+    print(f"\nBaseline {baseline['meta'].get('revision')} -> current {current['meta'].get('revision')} "
+          f"(threshold {threshold:.0%})")
+    print(f"{'scenario':<16}{'metric':<22}{'baseline':>12}{'current':>12}{'change':>10}")
+    for row in rows:
+        change = "n/a" if math.isinf(row["change"]) else f"{row['change']:+.1%}"
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['scenario']:<16}{row['metric']:<22}{row['baseline']:>12}{row['current']:>12}{change:>10}{flag}")
+    regressions = sum(row["regression"] for row in rows)
+    print(f"\n{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def compare(args) -> int:
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+    return print_comparison(baseline, current, args.threshold)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the code viewer server")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark")
+    run_parser.add_argument("--workdir", default="data/bench", help="where generated trees are kept")
+    run_parser.add_argument("--files", type=int, default=10000, help="number of files in the generated tree")
+    run_parser.add_argument("--large-file-mb", type=int, default=20)
+    run_parser.add_argument("--scenarios", default=",".join(ALL_SCENARIOS))
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    run_parser.add_argument("--requests", type=int, default=None, help="stop a scenario after this many requests")
+    run_parser.add_argument("--history-entries", type=int, default=200)
+    run_parser.add_argument("--llm-latency", type=float, default=0.5, help="fake model: seconds to first token")
+    run_parser.add_argument("--llm-tokens-per-second", type=float, default=50.0)
+    run_parser.add_argument("--llm-completion-tokens", type=int, default=100)
+    run_parser.add_argument("--log-level", default="warning", help="server log level during the run")
+    run_parser.add_argument("--url", help="benchmark an already running server instead of the in-process app")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--output", help="write JSON results here instead of stdout")
+    run_parser.add_argument("--baseline", help="compare with an earlier results file; exit 1 on regression")
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative change, default 10%%")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
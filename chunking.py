@@ -0,0 +1,322 @@
+import ast
+import asyncio
+import io
+import logging
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+# 各模型的上下文长度（tokens），未列出的模型使用 DEFAULT_CONTEXT_TOKENS
+MODEL_CONTEXT_TOKENS = {
+    "GLM-4-Flash": 128000,
+    "deepseek/deepseek-v3": 64000,
+    "deepseek/deepseek-r1": 64000,
+    "deepseek/deepseek-r1-distill-llama-70b": 32000,
+    "deepseek/deepseek-r1-distill-qwen-32b": 32000,
+    "qwen/qwen-2-72b-instruct": 32000,
+    "Qwen/Qwen2.5-Coder-32B-Instruct": 32000,
+    "doubao": 32000,
+    "wenxinspeed": 128000,
+    "wenxin35": 8000,
+    "glm4": 128000,
+    "deepseek": 64000,
+    "deepseekr1": 64000,
+    "qwen": 128000,
+}
+DEFAULT_CONTEXT_TOKENS = 32000
+# 为system prompt和模型输出预留的tokens
+RESERVED_TOKENS = 8192 + 1024
+# 超过这个大小的文件即使放得进上下文也拆分并行分析，缩短总耗时
+CHUNK_THRESHOLD_TOKENS = 12000
+CHUNK_TARGET_TOKENS = 6000
+# 内容定义分块：非空行内容的 crc32 能被它整除时可以在该行之后切分（平均每这么多行一个候选点）
+BOUNDARY_DIVISOR = 64
+
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one token per CJK character, about four characters per token otherwise."""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def chunk_budget(model: str) -> int:
+    """Largest prompt, in tokens, a single call to model should receive."""
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return max(1024, context - RESERVED_TOKENS)
+
+
+def source_lines(code: str) -> List[str]:
+    """Split code into lines the way the tokenizer does, so ast line numbers index into the result.
+
+    str.splitlines also breaks on form feeds, \\x1c-\\x1e, \\u2028 and similar characters
+    that Python does not treat as line ends.
+    """
+    return io.StringIO(code, newline="").readlines()
+
+
+def needs_chunking(code: str, model: str) -> bool:
+    return estimate_tokens(code) > min(chunk_budget(model), CHUNK_THRESHOLD_TOKENS)
+
+
+@dataclass
+class Chunk:
+    start_line: int  # 1-based, inclusive
+    end_line: int
+    text: str
+    symbols: List[str] = field(default_factory=list)
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+def split_long_line(line: str, max_tokens: int) -> List[str]:
+    """Cut one line longer than max_tokens (minified code, data) into pieces that fit, by characters.
+
+    Pieces end after a space, comma or semicolon when one is found in their second half.
+    """
+    max_tokens = max(1, max_tokens)
+    pieces = []
+    while estimate_tokens(line) > max_tokens:
+        size = max_tokens * 4
+        tokens = estimate_tokens(line[:size])
+        while tokens > max_tokens:
+            # CJK字符按一个token计，按比例缩小直到放得下
+            size = max(1, min(size - 1, size * max_tokens // tokens))
+            tokens = estimate_tokens(line[:size])
+        cut = max(line.rfind(sep, size // 2, size) for sep in (" ", ",", ";")) + 1
+        if cut <= 0:
+            cut = size
+        pieces.append(line[:cut])
+        line = line[cut:]
+    if line:
+        pieces.append(line)
+    return pieces
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """text cut to at most max_tokens, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    marker = "\n……（已截断）"
+    return split_long_line(text, max(1, max_tokens - estimate_tokens(marker) - 1))[0].rstrip() + marker
+
+
+async def reduce_until_fits(summaries: List[str], budget: int, merge: Callable[[str], Awaitable[str]]) -> str:
+    """Merge summaries level by level with merge(text) until they fit into budget tokens.
+
+    Summaries too large to be grouped with any other (each over half the budget) are truncated
+    so that the result never exceeds the budget.
+    """
+    while estimate_tokens("\n\n".join(summaries)) > budget:
+        if len(summaries) == 1:
+            logger.warning(f"Summary of {estimate_tokens(summaries[0])} tokens truncated to {budget}")
+            return truncate_tokens(summaries[0], budget)
+        groups, group, group_tokens = [], [], 0
+        for summary in summaries:
+            tokens = estimate_tokens(summary)
+            if group and group_tokens + tokens > budget:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(summary)
+            group_tokens += tokens
+        groups.append(group)
+        if len(groups) == len(summaries):
+            # 分组没有进展：每个摘要各截到平均份额（分隔符约占1个token）
+            share = max(1, budget // len(summaries) - 1)
+            logger.warning(f"{len(summaries)} summaries over budget, truncating each to {share} tokens")
+            return "\n\n".join(truncate_tokens(summary, share) for summary in summaries)
+        summaries = await asyncio.gather(*(merge("\n\n".join(g)) for g in groups))
+    return "\n\n".join(summaries)
+
+
+def _line_pieces(lines: List[str], start_line: int, max_tokens: int):
+    """(line number, text) of each line, lines that alone exceed max_tokens split into pieces."""
+    for offset, line in enumerate(lines):
+        if estimate_tokens(line) + 1 <= max_tokens:
+            yield start_line + offset, line
+        else:
+            for piece in split_long_line(line, max_tokens - 1):
+                yield start_line + offset, piece
+
+
+def split_lines(lines: List[str], start_line: int, max_tokens: int) -> List[Chunk]:
+    """Fallback splitter: consecutive line windows that stay under max_tokens."""
+    chunks = []
+    current, current_tokens, current_start, current_end = [], 0, start_line, start_line
+    for line_no, text in _line_pieces(lines, start_line, max_tokens):
+        line_tokens = estimate_tokens(text) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append(Chunk(current_start, current_end, "".join(current)))
+            current, current_tokens = [], 0
+        if not current:
+            current_start = line_no
+        current.append(text)
+        current_tokens += line_tokens
+        current_end = line_no
+    if current:
+        chunks.append(Chunk(current_start, current_end, "".join(current)))
+    return chunks
+
+
+def split_content_defined(lines: List[str], start_line: int, max_tokens: int) -> List[Chunk]:
+    """Split lines at boundaries chosen by line content, so an edit only changes the chunks around it.
+
+    Unlike fixed line windows, inserting or deleting a line does not shift the boundaries of the
+    following chunks. A chunk ends after a boundary line once it holds max_tokens // 4 tokens,
+    and is cut anyway at max_tokens.
+    """
+    min_tokens = max_tokens // 4
+    chunks = []
+    current, current_tokens, current_start, current_end = [], 0, start_line, start_line
+    for line_no, text in _line_pieces(lines, start_line, max_tokens):
+        line_tokens = estimate_tokens(text) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append(Chunk(current_start, current_end, "".join(current)))
+            current, current_tokens = [], 0
+        if not current:
+            current_start = line_no
+        current.append(text)
+        current_tokens += line_tokens
+        current_end = line_no
+        stripped = text.strip()
+        if current_tokens >= min_tokens and stripped and \
+                zlib.crc32(stripped.encode("utf-8", "surrogatepass")) % BOUNDARY_DIVISOR == 0:
+            chunks.append(Chunk(current_start, current_end, "".join(current)))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append(Chunk(current_start, current_end, "".join(current)))
+    return chunks
+
+
+def _node_symbol(node) -> str:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return node.name
+    return ""
+
+
+def _node_span(node):
+    start = node.lineno
+    if getattr(node, "decorator_list", None):
+        start = min(d.lineno for d in node.decorator_list)
+    return start, node.end_lineno
+
+
+def _split_nodes(nodes, lines: List[str], first_line: int, last_line: int, max_tokens: int, prefix: str = "") -> List[Chunk]:
+    """Group consecutive AST nodes into chunks, descending into classes that are too large on their own."""
+    # 每段代码的起止行：从上一个节点结束处到本节点结束，保留节点之间的注释和空行
+    spans = []
+    cursor = first_line
+    for node in nodes:
+        _, end = _node_span(node)
+        spans.append((node, cursor, end))
+        cursor = end + 1
+    if spans and cursor <= last_line:
+        node, start, _ = spans[-1]
+        spans[-1] = (node, start, last_line)
+
+    chunks = []
+    group, group_tokens = [], 0
+
+    def flush():
+        nonlocal group, group_tokens
+        if group:
+            start, end = group[0][1], group[-1][2]
+            symbols = [prefix + _node_symbol(n) for n, _, _ in group if _node_symbol(n)]
+            chunks.append(Chunk(start, end, "".join(lines[start - 1:end]), symbols))
+        group, group_tokens = [], 0
+
+    for node, start, end in spans:
+        text = "".join(lines[start - 1:end])
+        tokens = estimate_tokens(text)
+        if tokens > max_tokens:
+            flush()
+            if isinstance(node, ast.ClassDef) and node.body:
+                body_start = node.body[0].lineno
+                header = Chunk(start, body_start - 1, "".join(lines[start - 1:body_start - 1]), [prefix + node.name])
+                sub_chunks = _split_nodes(node.body, lines, body_start, end, max_tokens, prefix + node.name + ".")
+                if header.text.strip() and sub_chunks:
+                    # 类的声明行并入第一个子块，保留上下文
+                    first = sub_chunks[0]
+                    sub_chunks[0] = Chunk(header.start_line, first.end_line, header.text + first.text, header.symbols + first.symbols)
+                chunks.extend(sub_chunks)
+            else:
+                window_chunks = split_lines(lines[start - 1:end], start, max_tokens)
+                for chunk in window_chunks:
+                    chunk.symbols = [prefix + _node_symbol(node)] if _node_symbol(node) else []
+                chunks.extend(window_chunks)
+            continue
+        if group and group_tokens + tokens > max_tokens:
+            flush()
+        group.append((node, start, end))
+        group_tokens += tokens
+    flush()
+    return chunks
+
+
+def split_code(code: str, max_tokens: int, path: str = "") -> List[Chunk]:
+    """Split code along function/class boundaries for Python, or into line windows otherwise."""
+    lines = source_lines(code)
+    if not lines:
+        return []
+    if not path or path.endswith((".py", ".pyw", ".pyi")):
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is not None and tree.body:
+            return _split_nodes(tree.body, lines, 1, len(lines), max_tokens)
+    return split_lines(lines, 1, max_tokens)
+
+
+def extract_symbols(code: str, path: str = "") -> List[Chunk]:
+    """Split code into one chunk per function, method and class header for incremental analysis.
+
+    Module-level statements are collected into a single "<module>" chunk. Files that are not
+    Python are split at content-defined boundaries and named by their line range.
+    """
+    lines = source_lines(code)
+    if not lines:
+        return []
+    tree = None
+    if not path or path.endswith((".py", ".pyw", ".pyi")):
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            tree = None
+    if tree is None:
+        windows = split_content_defined(lines, 1, CHUNK_TARGET_TOKENS)
+        for chunk in windows:
+            chunk.symbols = [f"lines {chunk.start_line}-{chunk.end_line}"]
+        return windows
+
+    def text_of(start, end):
+        return "".join(lines[start - 1:end])
+
+    symbols = []
+    module_parts = []
+    for node in tree.body:
+        start, end = _node_span(node)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            symbols.append(Chunk(start, end, text_of(start, end), [node.name]))
+        elif isinstance(node, ast.ClassDef):
+            methods = [n for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            method_lines = set()
+            method_chunks = []
+            for method in methods:
+                m_start, m_end = _node_span(method)
+                method_lines.update(range(m_start, m_end + 1))
+                method_chunks.append(Chunk(m_start, m_end, text_of(m_start, m_end), [f"{node.name}.{method.name}"]))
+            header = "".join(lines[i - 1] for i in range(start, end + 1) if i not in method_lines)
+            symbols.append(Chunk(start, end, header, [node.name]))
+            symbols.extend(method_chunks)
+        else:
+            module_parts.append(text_of(start, end))
+    if module_parts:
+        symbols.insert(0, Chunk(1, len(lines), "".join(module_parts), ["<module>"]))
+    return symbols
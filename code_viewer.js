@@ -14,11 +14,22 @@ document.addEventListener('DOMContentLoaded', function() {
     const modelSelect = document.getElementById('modelSelect');
     const currentFile = document.getElementById('currentFile');
     const analysisTypeSelect = document.getElementById('analysisType');
+    const searchWrapper = document.getElementById('searchWrapper');
+    const searchInput = document.getElementById('searchInput');
+    const searchResults = document.getElementById('searchResults');
     
+    const TREE_DEPTH = 3;  // 每次请求目录树时预取的层数
     let currentFilePath = '';
+    let currentRootPath = '';
     let lastSavedAnalysis = '';
     let notificationTimeout;
 
+    // 读取文件、目录、分析时使用浏览器的HTTP缓存：每次都带 If-None-Match 向服务器确认，
+    // 内容没变时服务器只回 304，直接使用缓存里的响应
+    function fetchRevalidated(url) {
+        return fetch(url, { cache: 'no-cache' });
+    }
+
     // Load history function
     async function loadHistory() {
         try {
@@ -133,6 +144,85 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!selectWrapper.contains(e.target)) {
             selectWrapper.classList.remove('open');
         }
+        if (!searchWrapper.contains(e.target)) {
+            searchWrapper.classList.remove('open');
+        }
+    });
+
+    // Search across indexed repositories
+    let searchTimeout;
+    let searchSeq = 0;
+
+    function addSearchResult(label, detail, path, line) {
+        const div = document.createElement('div');
+        div.className = 'history-option';
+
+        const labelSpan = document.createElement('span');
+        labelSpan.textContent = label;
+        div.appendChild(labelSpan);
+
+        const detailSpan = document.createElement('span');
+        detailSpan.className = 'search-result-detail';
+        detailSpan.textContent = detail;
+        div.appendChild(detailSpan);
+
+        div.onclick = () => {
+            searchWrapper.classList.remove('open');
+            loadFile(path, line);
+        };
+        searchResults.appendChild(div);
+    }
+
+    function relativePath(path) {
+        return currentRootPath && path.startsWith(currentRootPath) ? path.slice(currentRootPath.length + 1) : path;
+    }
+
+    async function runSearch(query) {
+        const seq = ++searchSeq;
+        let url = `http://localhost:8000/api/search?q=${encodeURIComponent(query)}&limit=30`;
+        if (currentRootPath) {
+            url += `&root=${encodeURIComponent(currentRootPath)}`;
+        }
+        try {
+            const response = await fetch(url);
+            if (!response.ok) {
+                throw new Error('Search failed');
+            }
+            const data = await response.json();
+            // 忽略已经过时的查询结果
+            if (seq !== searchSeq) return;
+
+            searchResults.innerHTML = '';
+            data.symbols.forEach(symbol => {
+                addSearchResult(`ƒ ${symbol.name}`, `${relativePath(symbol.path)}:${symbol.line}`, symbol.path, symbol.line);
+            });
+            data.text.forEach(file => {
+                file.matches.forEach(match => {
+                    addSearchResult(`${relativePath(file.path)}:${match.line}`, match.text, file.path, match.line);
+                });
+            });
+            if (searchResults.children.length === 0) {
+                const emptyDiv = document.createElement('div');
+                emptyDiv.className = 'history-option';
+                emptyDiv.style.color = '#666';
+                emptyDiv.textContent = '没有找到结果';
+                searchResults.appendChild(emptyDiv);
+            }
+            searchWrapper.classList.add('open');
+        } catch (error) {
+            console.error('Error searching:', error);
+            showNotification('搜索失败', true);
+        }
+    }
+
+    searchInput.addEventListener('input', () => {
+        clearTimeout(searchTimeout);
+        const query = searchInput.value.trim();
+        if (!query) {
+            searchWrapper.classList.remove('open');
+            return;
+        }
+        searchTimeout = setTimeout(() => runSearch(query), 250);
     });
 
     // Update input placeholder based on selected type
@@ -198,15 +288,26 @@ document.addEventListener('DOMContentLoaded', function() {
 
                 const result = await response.json();
                 finalPath = result.path;
+                if (!result.ready) {
+                    // 新仓库要等克隆完成；已存在的仓库在后台 fetch，可以直接浏览
+                    await waitForCloneJob(result.job.id);
+                }
             }
 
-            // Load files using the local path
-            const filesResponse = await fetch(`http://localhost:8000/api/files?path=${encodeURIComponent(finalPath)}&should_save_history=true`);
-            if (!filesResponse.ok) {
+            // Load the first levels of the tree using the local path
+            const treeResponse = await fetchRevalidated(`http://localhost:8000/api/tree?path=${encodeURIComponent(finalPath)}&depth=${TREE_DEPTH}&should_save_history=true`);
+            if (!treeResponse.ok) {
                 throw new Error('Failed to load files');
             }
-            const files = await filesResponse.json();
-            displayFiles(files, fileList, 0);
+            const treeData = await treeResponse.json();
+            currentRootPath = treeData.tree.path;
+            dirViews.clear();
+            dirViews.set(currentRootPath, { container: fileList, level: 0 });
+            displayFiles(treeData.tree.children || [], fileList, 0);
+            watchRoot(currentRootPath);
+            if (treeData.truncated) {
+                console.warn(`File tree truncated after ${treeData.count} entries`);
+            }
             showNotification(inputType.value === 'git' ? '仓库克隆并加载成功' : '项目加载成功');
         } catch (error) {
             console.error('Error:', error);
@@ -214,16 +315,139 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Follow a clone job's progress events until it finishes
+    function waitForCloneJob(jobId) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`http://localhost:8000/api/clone-repo/${jobId}/events`);
+            source.onmessage = (event) => {
+                const job = JSON.parse(event.data);
+                if (job.status === 'completed') {
+                    source.close();
+                    resolve(job);
+                } else if (job.status === 'failed') {
+                    source.close();
+                    reject(new Error(job.error || 'Failed to clone repository'));
+                } else {
+                    showNotification(`克隆中：${job.phase} ${job.percent}%`);
+                }
+            };
+            source.onerror = () => {
+                source.close();
+                reject(new Error('Lost connection while cloning repository'));
+            };
+        });
+    }
+
+    // 已展开过的目录：路径 -> 显示其子项的元素，收到文件变化时只刷新这些目录
+    const dirViews = new Map();
+    let watchSource = null;
+    let watchStale = false;
+    let watchUpdates = Promise.resolve();
+
+    function isSameOrInside(path, dirPath) {
+        return path.startsWith(dirPath) && (path.length === dirPath.length || '/\\'.includes(path[dirPath.length]));
+    }
+
+    // 订阅当前根目录下的文件变化（/api/watch/events），断线时浏览器会自动重连
+    function watchRoot(rootPath) {
+        if (watchSource) {
+            watchSource.close();
+        }
+        watchStale = false;
+        watchSource = new EventSource(`http://localhost:8000/api/watch/events?root=${encodeURIComponent(rootPath)}`);
+        watchSource.onmessage = (event) => {
+            const batch = JSON.parse(event.data);
+            if (batch.watching !== undefined) {
+                // 重连成功：断开期间的变化已经丢失，全部重新验证
+                if (!watchStale) return;
+                watchStale = false;
+                batch.rescan = true;
+                batch.changes = [];
+                batch.dirs = [];
+            }
+            watchUpdates = watchUpdates.then(() => applyFileChanges(batch)).catch(error => {
+                console.error('Error applying file changes:', error);
+            });
+        };
+        watchSource.onerror = () => {
+            watchStale = true;
+        };
+    }
+
+    async function applyFileChanges(batch) {
+        const dirs = batch.rescan ? Array.from(dirViews.keys()) : batch.dirs.filter(dir => dirViews.has(dir));
+        for (const dir of dirs) {
+            await refreshDirectory(dir);
+        }
+        batch.changes.forEach(c => bundleCache.delete(c.path.endsWith('.ai') ? c.path.slice(0, -3) : c.path));
+        if (batch.rescan) {
+            bundleCache.clear();
+        }
+        if (!currentFilePath) return;
+        const change = batch.changes.find(c => c.path === currentFilePath);
+        if (change && change.type === 'deleted') {
+            showNotification('当前文件已被删除', true);
+        } else if (change || batch.rescan) {
+            await reloadCurrentFile();
+        }
+    }
+
+    // 重新获取一个目录的子项，保留仍然存在的条目（包括其展开状态），只增删变化的部分
+    async function refreshDirectory(dirPath) {
+        const view = dirViews.get(dirPath);
+        if (!view) {
+            return;
+        }
+        if (!view.container.isConnected) {
+            dirViews.delete(dirPath);
+            return;
+        }
+        const response = await fetchRevalidated(`http://localhost:8000/api/tree?path=${encodeURIComponent(dirPath)}&depth=1`);
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+        // 每个条目是一个 file-item，目录后面还跟着它的 directory-content
+        const existing = new Map();
+        let group = null;
+        Array.from(view.container.children).forEach(element => {
+            if (element.dataset.path) {
+                group = [element];
+                existing.set(element.dataset.path, group);
+            } else if (group) {
+                group.push(element);
+            }
+        });
+        const fragment = document.createDocumentFragment();
+        (data.tree.children || []).forEach(file => {
+            const kept = existing.get(file.path);
+            if (kept) {
+                existing.delete(file.path);
+                kept.forEach(element => fragment.appendChild(element));
+            } else {
+                displayFiles([file], fragment, view.level);
+            }
+        });
+        // 剩下的是已删除的条目
+        existing.forEach((_, path) => {
+            Array.from(dirViews.keys()).filter(dir => isSameOrInside(dir, path)).forEach(dir => dirViews.delete(dir));
+        });
+        view.container.innerHTML = '';
+        view.container.appendChild(fragment);
+    }
+
     // Display files in the file list
     function displayFiles(files, parentElement, level) {
         files.forEach(file => {
-            // Skip .ai files
-            if (!file.isDirectory && file.name.endsWith('.ai')) {
+            // Skip .ai files and their per-symbol records
+            if (!file.isDirectory && (file.name.endsWith('.ai') || file.name.endsWith('.ai.json'))) {
                 return;
             }
 
             const fileItem = document.createElement('div');
             fileItem.className = 'file-item';
+            fileItem.dataset.path = file.path;
+            fileItem.dataset.type = file.isDirectory ? 'dir' : 'file';
             fileItem.style.paddingLeft = `${level * 20}px`;
             
             if (file.isDirectory) {
@@ -241,7 +465,14 @@ document.addEventListener('DOMContentLoaded', function() {
                 contentDiv.className = 'directory-content';
                 contentDiv.style.display = 'none';
 
-                let isLoaded = false;
+                // 服务端树接口已经返回了子项时直接渲染，无需再请求
+                let isLoaded = Array.isArray(file.children) && !file.truncated;
+                if (Array.isArray(file.children)) {
+                    displayFiles(file.children, contentDiv, level + 1);
+                }
+                if (isLoaded) {
+                    dirViews.set(file.path, { container: contentDiv, level: level + 1 });
+                }
 
                 // 移除单独的toggleBtn点击事件，改为整行点击
                 fileItem.style.cursor = 'pointer';
@@ -252,13 +483,15 @@ document.addEventListener('DOMContentLoaded', function() {
 
                     if (!isLoaded && !isExpanded) {
                         try {
-                            const response = await fetch(`http://localhost:8000/api/files?path=${encodeURIComponent(file.path)}`);
+                            const response = await fetchRevalidated(`http://localhost:8000/api/tree?path=${encodeURIComponent(file.path)}&depth=${TREE_DEPTH}`);
                             if (!response.ok) {
                                 throw new Error('Failed to load subdirectory');
                             }
-                            const subFiles = await response.json();
-                            displayFiles(subFiles, contentDiv, level + 1);
+                            const subTree = await response.json();
+                            contentDiv.innerHTML = '';
+                            displayFiles(subTree.tree.children || [], contentDiv, level + 1);
                             isLoaded = true;
+                            dirViews.set(file.path, { container: contentDiv, level: level + 1 });
                         } catch (error) {
                             console.error('Error loading subdirectory:', error);
                             showNotification('加载子目录失败', true);
@@ -277,84 +510,357 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // 大文件按页加载：记录下一页的起始行，滚动到底部时继续加载
+    let nextContentOffset = null;
+    // 下一页在文件中的字节位置（/api/content 的 next_byte_offset），续读时不需要从头数行
+    let nextContentByteOffset = null;
+    let contentPageLoading = false;
+    // 当前文件是否使用服务端高亮好的HTML（/api/render），否则取原文由 highlight.js 高亮
+    let serverRendered = false;
+
+    async function fetchRenderedPage(filePath, offset) {
+        const response = await fetchRevalidated(`http://localhost:8000/api/render?path=${encodeURIComponent(filePath)}&offset=${offset}`);
+        if (!response.ok) {
+            throw new Error('Failed to render file');
+        }
+        return response.json();
+    }
+
+    function appendRenderedPage(renderedData) {
+        const pre = document.createElement('pre');
+        const code = document.createElement('code');
+        code.classList.add('hljs');
+        if (renderedData.language) {
+            code.classList.add(`language-${renderedData.language}`);
+        }
+        code.innerHTML = renderedData.lines.join('\n');
+        pre.appendChild(code);
+        fileContent.appendChild(pre);
+        nextContentOffset = renderedData.has_more ? renderedData.next_offset : null;
+        nextContentByteOffset = null;
+    }
+
+    async function fetchContentPage(filePath, offset, limit, byteOffset = null) {
+        let url = `http://localhost:8000/api/content?path=${encodeURIComponent(filePath)}&offset=${offset}`;
+        if (limit !== undefined) {
+            url += `&limit=${limit}`;
+        }
+        if (byteOffset !== null) {
+            url += `&byte_offset=${byteOffset}`;
+        }
+        const response = await fetchRevalidated(url);
+        if (!response.ok) {
+            throw new Error('Failed to load file content');
+        }
+        return response.json();
+    }
+
+    function appendContentPage(filePath, contentData) {
+        // 每页一个 pre/code，只对新加入的这一页做语法高亮
+        const pre = document.createElement('pre');
+        const code = document.createElement('code');
+
+        // 根据文件扩展名设置语言
+        const ext = filePath.split('.').pop().toLowerCase();
+        const languageMap = {
+            'js': 'javascript',
+            'py': 'python',
+            'html': 'html',
+            'css': 'css',
+            'json': 'json',
+            'md': 'markdown',
+            'txt': 'plaintext',
+            'go': 'go'
+        };
+
+        if (languageMap[ext]) {
+            code.classList.add(`language-${languageMap[ext]}`);
+        }
+
+        code.textContent = contentData.content;
+        pre.appendChild(code);
+        fileContent.appendChild(pre);
+        nextContentOffset = contentData.has_more ? contentData.next_offset : null;
+        nextContentByteOffset = contentData.has_more ? contentData.next_byte_offset : null;
+
+        // 等待 DOM 更新后应用高亮
+        setTimeout(() => {
+            hljs.highlightElement(code);
+        }, 0);
+    }
+
+    fileContent.addEventListener('scroll', async () => {
+        if (nextContentOffset === null || contentPageLoading) return;
+        if (fileContent.scrollTop + fileContent.clientHeight < fileContent.scrollHeight - 200) return;
+
+        const filePath = currentFilePath;
+        contentPageLoading = true;
+        try {
+            if (serverRendered) {
+                const renderedData = await fetchRenderedPage(filePath, nextContentOffset);
+                if (filePath === currentFilePath && renderedData.rendered) {
+                    appendRenderedPage(renderedData);
+                    return;
+                }
+                // 文件在两次翻页之间被修改，后续页改为原文
+                serverRendered = false;
+            }
+            const contentData = await fetchContentPage(filePath, nextContentOffset, undefined, nextContentByteOffset);
+            if (filePath === currentFilePath) {
+                appendContentPage(filePath, contentData);
+            }
+        } catch (error) {
+            console.error('Error loading file page:', error);
+            showNotification('加载文件失败', true);
+        } finally {
+            contentPageLoading = false;
+        }
+    });
+
+    // 滚动到指定行（按已渲染代码的平均行高估算位置）
+    function scrollToLine(line) {
+        const code = fileContent.querySelector('code');
+        if (!code || !line) return;
+        const lineCount = code.textContent.split('\n').length;
+        const lineHeight = code.scrollHeight / Math.max(lineCount, 1);
+        fileContent.scrollTop = Math.max(0, (line - 3) * lineHeight);
+    }
+
     // Load file content and its analysis if exists
-    async function loadFile(filePath) {
+    // /api/bundle 返回的记录（内容或高亮后的行 + 分析）按路径缓存在内存中，
+    // 打开时先显示缓存，再带上版本号向服务器确认，未变化的文件服务器只回 unchanged
+    const bundleCache = new Map();
+    const BUNDLE_CACHE_SIZE = 50;
+    const PREFETCH_COUNT = 8;
+    const PREFETCH_MAX_BYTES = 2 * 1024 * 1024;
+    let prefetchController = null;
+
+    function cacheBundleRecord(record) {
+        bundleCache.delete(record.path);
+        bundleCache.set(record.path, record);
+        while (bundleCache.size > BUNDLE_CACHE_SIZE) {
+            bundleCache.delete(bundleCache.keys().next().value);
+        }
+    }
+
+    // 读取 NDJSON 流，返回 path -> 记录（未变化的文件返回缓存中的同一个对象）
+    async function fetchBundle(paths, options = {}) {
+        const versions = {};
+        paths.forEach(path => {
+            const cached = bundleCache.get(path);
+            if (cached) {
+                versions[path] = cached.version;
+            }
+        });
+        const response = await fetch('http://localhost:8000/api/bundle', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ paths, versions, max_bytes: options.maxBytes }),
+            signal: options.signal
+        });
+        if (!response.ok) {
+            throw new Error('Failed to load files');
+        }
+        const records = new Map();
+        const handleLine = (line) => {
+            if (!line.trim()) return;
+            const record = JSON.parse(line);
+            if (!record.path) return;  // 最后一行是汇总
+            if (record.unchanged && bundleCache.has(record.path)) {
+                const cached = bundleCache.get(record.path);
+                cacheBundleRecord(cached);
+                records.set(record.path, cached);
+                return;
+            }
+            if (record.version) {
+                cacheBundleRecord(record);
+            }
+            records.set(record.path, record);
+        };
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let newline;
+            while ((newline = buffer.indexOf('\n')) >= 0) {
+                handleLine(buffer.slice(0, newline));
+                buffer = buffer.slice(newline + 1);
+            }
+        }
+        handleLine(buffer);
+        return records;
+    }
+
+    async function loadBundleRecord(filePath) {
+        const record = (await fetchBundle([filePath])).get(filePath);
+        if (!record || record.error) {
+            throw new Error(record ? record.error : 'Failed to load file');
+        }
+        return record;
+    }
+
+    // Show the first page of the file content
+    function showRecordContent(record, line) {
+        serverRendered = Boolean(record.rendered);
+        fileContent.innerHTML = '';
+        fileContent.scrollTop = 0;
+
+        if (serverRendered) {
+            appendRenderedPage(record.rendered);
+            if (line) {
+                setTimeout(() => scrollToLine(line), 0);
+            }
+        } else if (record.content.binary) {
+            nextContentOffset = null;
+            const info = document.createElement('div');
+            info.style.color = '#666';
+            info.textContent = `二进制文件（${record.content.mime}，${record.content.size} 字节），不显示内容`;
+            fileContent.appendChild(info);
+        } else {
+            appendContentPage(record.path, record.content);
+            if (line) {
+                setTimeout(() => scrollToLine(line), 0);
+            }
+        }
+    }
+
+    function showRecordAnalysis(record) {
+        const analysis = record.analysis || { content: '', html: null };
+        // 优先使用服务端缓存的HTML，否则用 marked 渲染 Markdown
+        aiResult.innerHTML = analysis.content ? (analysis.html ?? marked.parse(analysis.content)) : '';
+        lastSavedAnalysis = analysis.content;
+    }
+
+    // 当前文件在磁盘上变化后重新加载，尽量保持滚动位置
+    async function reloadCurrentFile() {
+        const filePath = currentFilePath;
+        const previous = bundleCache.get(filePath);
+        const scrollTop = fileContent.scrollTop;
+        try {
+            const record = await loadBundleRecord(filePath);
+            if (record === previous || filePath !== currentFilePath) return;
+            showRecordContent(record);
+            fileContent.scrollTop = scrollTop;
+        } catch (error) {
+            console.error('Error reloading file:', error);
+        }
+    }
+
+    // 后台预取同一目录中排在当前文件后面（不够时取前面）的文件，之后打开它们无需等待
+    function prefetchSiblings(filePath) {
+        if (prefetchController) {
+            prefetchController.abort();
+        }
+        const item = Array.from(fileList.querySelectorAll('.file-item[data-type="file"]'))
+            .find(element => element.dataset.path === filePath);
+        if (!item) return;
+        const siblings = Array.from(item.parentElement.children)
+            .filter(element => element.dataset.type === 'file');
+        const index = siblings.indexOf(item);
+        const paths = siblings.slice(index + 1).concat(siblings.slice(0, index).reverse())
+            .map(element => element.dataset.path)
+            .filter(path => !bundleCache.has(path))
+            .slice(0, PREFETCH_COUNT);
+        if (!paths.length) return;
+        const controller = new AbortController();
+        prefetchController = controller;
+        fetchBundle(paths, { maxBytes: PREFETCH_MAX_BYTES, signal: controller.signal }).catch(error => {
+            if (error.name !== 'AbortError') {
+                console.error('Error prefetching files:', error);
+            }
+        });
+    }
+
+    async function loadFile(filePath, line) {
         try {
             currentFilePath = filePath;
             currentFile.textContent = `当前文件：${filePath}`;
-            
-            // Load file content
-            const contentResponse = await fetch(`http://localhost:8000/api/content?path=${encodeURIComponent(filePath)}`);
-            if (!contentResponse.ok) {
-                throw new Error('Failed to load file content');
-            }
-            const contentData = await contentResponse.json();
-            
-            // 创建 pre 和 code 元素用于语法高亮
-            const pre = document.createElement('pre');
-            const code = document.createElement('code');
-            
-            // 根据文件扩展名设置语言
-            const ext = filePath.split('.').pop().toLowerCase();
-            const languageMap = {
-                'js': 'javascript',
-                'py': 'python',
-                'html': 'html',
-                'css': 'css',
-                'json': 'json',
-                'md': 'markdown',
-                'txt': 'plaintext',
-                'go': 'go'
-            };
-            
-            if (languageMap[ext]) {
-                code.classList.add(`language-${languageMap[ext]}`);
-            }
-            
-            // 设置代码内容
-            code.textContent = contentData.content;
-            pre.appendChild(code);
-            
-            // 清空并添加新内容
-            fileContent.innerHTML = '';
-            fileContent.appendChild(pre);
-            
-            // 等待 DOM 更新后应用高亮
-            setTimeout(() => {
-                hljs.highlightElement(code);
-            }, 0);
 
-            // Try to load existing analysis
-            try {
-                const analysisResponse = await fetch(`http://localhost:8000/api/load_analysis?path=${encodeURIComponent(filePath)}`);
-                if (analysisResponse.ok) {
-                    const analysisData = await analysisResponse.json();
-                    
-                    // 使用 marked 渲染 Markdown
-                    aiResult.innerHTML = marked.parse(analysisData.content);
-                    
-                    lastSavedAnalysis = analysisData.content;
-                    showNotification('文件及分析加载完成');
-                } else {
-                    aiResult.innerHTML = '';
-                    lastSavedAnalysis = '';
-                    showNotification('文件加载完成');
-                }
-            } catch (error) {
-                console.error('Error loading analysis:', error);
-                aiResult.textContent = '';
-                lastSavedAnalysis = '';
-                showNotification('加载分析失败', true);
+            // 内容和分析在一次请求中取回；缓存里有（例如预取过）时先显示
+            const cached = bundleCache.get(filePath);
+            if (cached) {
+                showRecordContent(cached, line);
+                showRecordAnalysis(cached);
             }
+            const record = await loadBundleRecord(filePath);
+            if (filePath !== currentFilePath) return;
+            if (record !== cached) {
+                showRecordContent(record, line);
+                showRecordAnalysis(record);
+            }
+            showNotification(record.analysis && record.analysis.content ? '文件及分析加载完成' : '文件加载完成');
+            prefetchSiblings(filePath);
         } catch (error) {
             console.error('Error loading file:', error);
             showNotification('加载文件失败', true);
         }
     }
 
+    // Stream analysis from /api/analyze (SSE) and render it incrementally
+    async function streamAnalysis(body, signal) {
+        const response = await fetch('http://localhost:8000/api/analyze', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ ...body, stream: true }),
+            signal
+        });
+
+        if (!response.ok) {
+            throw new Error('Analysis failed');
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+        let renderPending = false;
+
+        // 合并同一帧内的多次增量，避免每个token都重新解析整篇Markdown
+        const render = () => {
+            if (renderPending) return;
+            renderPending = true;
+            requestAnimationFrame(() => {
+                renderPending = false;
+                aiResult.innerHTML = marked.parse(text);
+            });
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const message = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                if (!message.startsWith('data:')) continue;
+
+                const event = JSON.parse(message.slice(5));
+                if (event.error) {
+                    throw new Error(event.error);
+                }
+                if (event.delta) {
+                    text += event.delta;
+                    render();
+                }
+            }
+        }
+
+        aiResult.innerHTML = marked.parse(text);
+        return text;
+    }
+
     // AI Analysis button click handler
     aiBtn.addEventListener('click', async () => {
-        const content = fileContent.textContent;
+        let content = fileContent.textContent;
         const selectedModel = modelSelect.value;
         const analysisType = analysisTypeSelect.value;
         
@@ -368,41 +874,31 @@ document.addEventListener('DOMContentLoaded', function() {
             aiBtn.textContent = '分析中...';
             aiResult.innerHTML = '正在分析代码，请稍候...';
 
+            // 大文件只加载了前几页时，分析前取完整内容
+            if (nextContentOffset !== null) {
+                const fullData = await fetchContentPage(currentFilePath, 0, 0);
+                content = fullData.content;
+            }
+
             const timeout = 180000; // 3分钟超时
             const controller = new AbortController();
             const timeoutId = setTimeout(() => controller.abort(), timeout);
 
             try {
-                const response = await Promise.race([
-                    fetch('http://localhost:8000/api/analyze', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            code: content,
-                            model: selectedModel,
-                            analytype: analysisType
-                        }),
-                        signal: controller.signal
-                    }),
-                    new Promise((_, reject) => 
-                        setTimeout(() => reject(new Error('请求超时')), timeout)
-                    )
-                ]);
+                const analysis = await streamAnalysis({
+                    code: content,
+                    model: selectedModel,
+                    analytype: analysisType,
+                    path: currentFilePath
+                }, controller.signal);
 
                 clearTimeout(timeoutId); // 清除超时计时器
 
-                if (!response.ok) {
-                    throw new Error('Analysis failed');
-                }
-
-                const data = await response.json();
-                lastSavedAnalysis = data.content;
-                aiResult.innerHTML = marked.parse(data.content);
+                lastSavedAnalysis = analysis;
                 showNotification('分析完成');
+                await saveAnalysis();
             } catch (error) {
-                if (error.name === 'AbortError' || error.message === '请求超时') {
+                if (error.name === 'AbortError') {
                     showNotification('分析请求超时，请重试', true);
                     aiResult.textContent = '分析超时，请重试';
                 } else {
@@ -452,6 +948,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error('Failed to save analysis');
             }
 
+            bundleCache.delete(currentFilePath);
             showNotification('分析保存成功');
         } catch (error) {
             console.error('Error saving analysis:', error);
@@ -490,35 +987,17 @@ document.addEventListener('DOMContentLoaded', function() {
             const timeoutId = setTimeout(() => controller.abort(), timeout);
 
             try {
-                const response = await Promise.race([
-                    fetch('http://localhost:8000/api/analyze', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            code: selectedText,
-                            model: modelSelect.value
-                        }),
-                        signal: controller.signal
-                    }),
-                    new Promise((_, reject) => 
-                        setTimeout(() => reject(new Error('请求超时')), timeout)
-                    )
-                ]);
+                const analysis = await streamAnalysis({
+                    code: selectedText,
+                    model: modelSelect.value
+                }, controller.signal);
 
                 clearTimeout(timeoutId);
 
-                if (!response.ok) {
-                    throw new Error('Analysis failed');
-                }
-
-                const data = await response.json();
-                lastSavedAnalysis = data.content;
-                aiResult.innerHTML = marked.parse(data.content);
+                lastSavedAnalysis = analysis;
                 showNotification('分析完成');
             } catch (error) {
-                if (error.name === 'AbortError' || error.message === '请求超时') {
+                if (error.name === 'AbortError') {
                     showNotification('分析请求超时，请重试', true);
                     aiResult.textContent = '分析超时，请重试';
                 } else {
@@ -39,6 +39,7 @@ a = Analysis(
         'openai',
         'typing',
         'email_validator',
+        'server',  # 多进程模式下worker按 "server:app" 导入
     ],
     hookspath=[],
     hooksconfig={},
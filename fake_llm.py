@@ -0,0 +1,88 @@
+"""本地的 OpenAI 兼容假模型服务，用于基准测试和离线调试
+
+    python fake_llm.py --port 9001 --latency 0.5 --tokens-per-second 50
+
+Only /v1/chat/completions is implemented (streaming and non-streaming). The reply
+waits `latency` seconds before the first token, then produces `completion_tokens`
+tokens at `tokens_per_second`.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(latency: float = 0.5, tokens_per_second: float = 50.0, completion_tokens: int = 200,
+               error_rate: float = 0.0, seed: int = 0) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+    ids = itertools.count(1)
+    app.state.calls = 0
+
+    def usage(body: dict) -> dict:
+        prompt = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": completion_tokens,
+                "total_tokens": prompt + completion_tokens}
+
+    def chunk(call_id: str, model: str, delta: dict, finish_reason=None, **extra) -> str:
+        data = {"id": call_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+        return f"data: {json.dumps(data)}\n\n"
+
+    @app.get("/calls")
+    async def calls():
+        return {"calls": app.state.calls}
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        call_id = f"fake-{next(ids)}"
+        model = body.get("model", "fake")
+        if error_rate and rng.random() < error_rate:
+            return JSONResponse({"error": {"message": "fake overload"}}, status_code=503)
+        token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+        if body.get("stream"):
+            async def events():
+                await asyncio.sleep(latency)
+                yield chunk(call_id, model, {"role": "assistant", "content": ""})
+                for i in range(completion_tokens):
+                    yield chunk(call_id, model, {"content": f"token{i} "})
+                    if token_interval:
+                        await asyncio.sleep(token_interval)
+                yield chunk(call_id, model, {}, "stop", usage=usage(body))
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency + completion_tokens * token_interval)
+        content = " ".join(f"token{i}" for i in range(completion_tokens))
+        return {"id": call_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage(body)}
+
+    return app
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completion server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+    app = create_app(args.latency, args.tokens_per_second, args.completion_tokens, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# 超过这个大小的文件默认只返回第一页，前端再按需翻页
+LARGE_FILE_BYTES = 1024 * 1024
+DEFAULT_PAGE_LINES = 2000
+# 每页的字节上限，单行的压缩代码也按这个大小分页
+MAX_PAGE_BYTES = 512 * 1024
+# 稀疏行索引：每隔 LINE_INDEX_STEP 行记录一次字节偏移
+LINE_INDEX_STEP = 1000
+BINARY_SNIFF_BYTES = 8192
+READ_BLOCK_BYTES = 1024 * 1024
+
+
+def is_binary_file(path: str) -> bool:
+    """Guess whether a file is binary from its first bytes (NUL bytes or invalid UTF-8)."""
+    with open(path, "rb") as f:
+        head = f.read(BINARY_SNIFF_BYTES)
+    if b"\x00" in head:
+        return True
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # 截断处的不完整多字节字符不算
+        return e.start < len(head) - 3
+    return False
+
+
+class LineIndexCache:
+    """按(path, mtime, size)缓存文件的稀疏行索引，避免每次翻页都从头扫描"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, stat: os.stat_result) -> list:
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        index = self._build(path)
+        with self._lock:
+            self._entries[key] = index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    @staticmethod
+    def _build(path: str) -> list:
+        """Byte offsets of lines 0, STEP, 2*STEP, ..."""
+        offsets = [0]
+        line = 0
+        position = 0
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(READ_BLOCK_BYTES)
+                if not block:
+                    break
+                start = 0
+                while True:
+                    newline = block.find(b"\n", start)
+                    if newline == -1:
+                        break
+                    line += 1
+                    if line % LINE_INDEX_STEP == 0:
+                        offsets.append(position + newline + 1)
+                    start = newline + 1
+                position += len(block)
+        return offsets
+
+
+line_index_cache = LineIndexCache()
+
+
+def _char_boundary(data: bytes) -> int:
+    """Length of the longest prefix of data that does not end inside a UTF-8 character."""
+    end = len(data)
+    while end > 0 and data[end - 1] & 0xC0 == 0x80:
+        end -= 1
+    if end > 0 and data[end - 1] >= 0xC0:
+        # 被截断的多字节字符的首字节
+        lead = data[end - 1]
+        width = 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+        if len(data) - (end - 1) < width:
+            return end - 1
+    return len(data)
+
+
+def read_content_window(path: str, offset: int = 0, limit: Optional[int] = None,
+                        byte_offset: Optional[int] = None) -> dict:
+    """Read `limit` lines starting at line `offset` (0-based).
+
+    limit=None returns the whole file when it is small and the first page otherwise;
+    limit=0 always returns the rest of the file. Binary files only return metadata.
+
+    Pages are also capped at MAX_PAGE_BYTES; a single line longer than that is split and the
+    next page continues inside it. `next_byte_offset` is where the next page starts: passing it
+    back as `byte_offset` (with `offset=next_offset`) continues without scanning the file.
+    Only a jump to line LINE_INDEX_STEP or later builds the sparse line index.
+    """
+    stat = os.stat(path)
+    result = {"size": stat.st_size, "mtime": stat.st_mtime, "offset": offset}
+    if is_binary_file(path):
+        mime, _ = mimetypes.guess_type(path)
+        result.update({"binary": True, "mime": mime or "application/octet-stream", "content": "",
+                       "lines": 0, "has_more": False, "next_offset": None, "next_byte_offset": None})
+        return result
+
+    if limit is None:
+        limit = 0 if stat.st_size <= LARGE_FILE_BYTES else DEFAULT_PAGE_LINES
+
+    if offset == 0 and limit == 0 and not byte_offset:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            content = f.read()
+        result.update({"binary": False, "content": content, "lines": len(content.splitlines()),
+                       "has_more": False, "next_offset": None, "next_byte_offset": None})
+        return result
+
+    if byte_offset is not None:
+        position, current = byte_offset, offset
+    elif offset < LINE_INDEX_STEP:
+        # 开头的几页直接从头读，不用为打开大文件扫描整个文件
+        position, current = 0, 0
+    else:
+        index = line_index_cache.get(path, stat)
+        slot = min(offset // LINE_INDEX_STEP, len(index) - 1)
+        position, current = index[slot], slot * LINE_INDEX_STEP
+
+    parts = []
+    size = 0
+    complete = 0
+    has_more = False
+    with open(path, "rb") as f:
+        f.seek(position)
+        while current < offset:
+            raw_line = f.readline(READ_BLOCK_BYTES)
+            if not raw_line:
+                break
+            if raw_line.endswith(b"\n"):
+                current += 1
+        while True:
+            if limit and (complete >= limit or size >= MAX_PAGE_BYTES):
+                has_more = bool(f.peek(1))
+                break
+            raw_line = f.readline(MAX_PAGE_BYTES - size) if limit else f.readline()
+            if not raw_line:
+                break
+            if limit and not raw_line.endswith(b"\n") and size + len(raw_line) >= MAX_PAGE_BYTES and f.peek(1):
+                # 这一行放不进本页：有其他行时留到下一页，否则在字符边界处截断
+                keep = _char_boundary(raw_line) if not parts else 0
+                f.seek(keep - len(raw_line), os.SEEK_CUR)
+                if keep:
+                    parts.append(raw_line[:keep])
+                has_more = True
+                break
+            parts.append(raw_line)
+            size += len(raw_line)
+            if raw_line.endswith(b"\n"):
+                complete += 1
+        next_byte_offset = f.tell() if has_more else None
+    content = b"".join(parts).decode("utf-8", errors="replace")
+    result.update({"binary": False, "content": content, "lines": len(parts), "has_more": has_more,
+                   "next_offset": offset + complete if has_more else None,
+                   "next_byte_offset": next_byte_offset})
+    return result
+
+
+def parse_range_header(range_header: str, size: int):
+    """Parse a single "bytes=start-end" range; returns (start, end) inclusive or None if unsatisfiable."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            length = int(end_text)
+            if length <= 0:
+                return None
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def iter_file_range(path: str, start: int, end: int, block_size: int = 64 * 1024):
+    """Yield the bytes start..end (inclusive) of a file in blocks."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
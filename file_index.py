@@ -0,0 +1,265 @@
+import fnmatch
+import logging
+import os
+import threading
+from collections import deque
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 这些目录无论 .gitignore 如何都不进入树
+ALWAYS_IGNORED_DIRS = {".git"}
+
+
+def parse_gitignore(path: str) -> list:
+    """Parse a .gitignore into (negate, dir_only, anchored, pattern) rules."""
+    rules = []
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return rules
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if line:
+            rules.append((negate, dir_only, anchored, line))
+    return rules
+
+
+def is_ignored(rules_chain: list, rel_parts: List[str], is_dir: bool) -> bool:
+    """Apply gitignore rules from the root down; the last matching rule wins.
+
+    rules_chain holds (depth, rules) pairs, depth being how many path parts the
+    .gitignore's directory is below the indexed root.
+    """
+    ignored = False
+    for depth, rules in rules_chain:
+        rel_path = "/".join(rel_parts[depth:])
+        name = rel_parts[-1]
+        for negate, dir_only, anchored, pattern in rules:
+            if dir_only and not is_dir:
+                continue
+            target = rel_path if anchored else name
+            if fnmatch.fnmatchcase(target, pattern) or (not anchored and fnmatch.fnmatchcase(rel_path, pattern)):
+                ignored = not negate
+    return ignored
+
+
+class DirNode:
+    __slots__ = ("mtime_ns", "gitignore_mtime_ns", "entries", "rules")
+
+    def __init__(self, mtime_ns, gitignore_mtime_ns, entries, rules):
+        self.mtime_ns = mtime_ns
+        self.gitignore_mtime_ns = gitignore_mtime_ns
+        self.entries = entries  # [(name, is_dir, ignored)]
+        self.rules = rules
+
+
+class FileIndex:
+    """一个已打开根目录的目录树索引：os.scandir 建立，按目录 mtime 增量刷新"""
+
+    def __init__(self, root: str):
+        self.root = os.path.normpath(os.path.abspath(root))
+        self._nodes = {}
+        self._lock = threading.RLock()
+        self.scans = 0
+
+    def _rel_parts(self, path: str) -> List[str]:
+        rel = os.path.relpath(path, self.root)
+        return [] if rel == "." else rel.replace(os.sep, "/").split("/")
+
+    def _rules_chain(self, directory: str) -> list:
+        chain = []
+        parts = self._rel_parts(directory)
+        current = self.root
+        for depth in range(len(parts) + 1):
+            node = self._nodes.get(current)
+            if node is not None and node.rules:
+                chain.append((depth, node.rules))
+            if depth < len(parts):
+                current = os.path.join(current, parts[depth])
+        return chain
+
+    @staticmethod
+    def _gitignore_mtime(directory: str) -> int:
+        try:
+            return os.stat(os.path.join(directory, ".gitignore")).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _scan(self, directory: str, stat_result: os.stat_result) -> DirNode:
+        self.scans += 1
+        gitignore_mtime = self._gitignore_mtime(directory)
+        rules = parse_gitignore(os.path.join(directory, ".gitignore")) if gitignore_mtime else []
+        # 先放入不含条目的节点，使本目录的 .gitignore 参与本目录条目的匹配
+        node = DirNode(stat_result.st_mtime_ns, gitignore_mtime, [], rules)
+        self._nodes[directory] = node
+        chain = self._rules_chain(directory)
+        base_parts = self._rel_parts(directory)
+        entries = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                ignored = (is_dir and entry.name in ALWAYS_IGNORED_DIRS) or \
+                    is_ignored(chain, base_parts + [entry.name], is_dir)
+                entries.append((entry.name, is_dir, ignored))
+        entries.sort(key=lambda e: (not e[1], e[0].lower()))
+        node.entries = entries
+        return node
+
+    def get_dir(self, directory: str) -> DirNode:
+        """Return the node for a directory, rescanning it only if its mtime or .gitignore changed."""
+        directory = os.path.normpath(os.path.abspath(directory))
+        with self._lock:
+            # 确保祖先目录已索引，才能拿到它们的 .gitignore 规则
+            if directory != self.root:
+                parent = os.path.dirname(directory)
+                if (parent == self.root or parent.startswith(self.root.rstrip(os.sep) + os.sep)) and \
+                        parent not in self._nodes:
+                    self.get_dir(parent)
+            stat_result = os.stat(directory)
+            node = self._nodes.get(directory)
+            if node is None or node.mtime_ns != stat_result.st_mtime_ns or \
+                    node.gitignore_mtime_ns != self._gitignore_mtime(directory):
+                node = self._scan(directory, stat_result)
+            return node
+
+    def invalidate(self, directory: str = None, recursive: bool = True):
+        """Forget one directory (and, unless recursive is False, its subtree), or the whole index."""
+        with self._lock:
+            if directory is None:
+                self._nodes.clear()
+                return
+            directory = os.path.normpath(os.path.abspath(directory))
+            if not recursive:
+                self._nodes.pop(directory, None)
+                return
+            prefix = directory + os.sep
+            for key in [k for k in self._nodes if k == directory or k.startswith(prefix)]:
+                del self._nodes[key]
+
+    def is_path_ignored(self, path: str, is_dir: bool) -> bool:
+        """Whether .gitignore excludes path or one of its parent directories.
+
+        Uses the rules already indexed for each directory; unlike list_dir this does not rescan a
+        changed directory, so it stays cheap for bursts of events.
+        """
+        path = os.path.normpath(os.path.abspath(path))
+        parts = self._rel_parts(path)
+        if not parts or parts[0] == "..":
+            return False
+        # 任何一级上层目录被忽略时，其中的文件也被忽略
+        parent = self.root
+        with self._lock:
+            for depth, name in enumerate(parts):
+                last = depth == len(parts) - 1
+                if (is_dir or not last) and name in ALWAYS_IGNORED_DIRS:
+                    return True
+                if parent not in self._nodes:
+                    try:
+                        self.get_dir(parent)
+                    except OSError:
+                        pass
+                if is_ignored(self._rules_chain(parent), parts[:depth + 1], is_dir or not last):
+                    return True
+                parent = os.path.join(parent, name)
+        return False
+
+    def list_dir(self, directory: str, include_ignored: bool = True) -> List[dict]:
+        node = self.get_dir(directory)
+        return [
+            {"name": name, "path": os.path.join(directory, name), "isDirectory": is_dir}
+            for name, is_dir, ignored in node.entries
+            if include_ignored or not ignored
+        ]
+
+    def tree(self, directory: str, depth: int = 2, limit: int = 5000, include_ignored: bool = False) -> dict:
+        """Recursive listing down to `depth` levels, capped at `limit` entries in breadth-first order.
+
+        Directories that were not expanded carry no "children" key so the client can fetch them lazily;
+        the directory where the limit was hit is marked "truncated".
+        """
+        directory = os.path.normpath(os.path.abspath(directory))
+        root_item = {"name": os.path.basename(directory) or directory, "path": directory, "isDirectory": True}
+        count = 0
+        truncated = False
+        queue = deque([(root_item, 0)])
+        while queue:
+            item, level = queue.popleft()
+            if level >= depth:
+                continue
+            children = []
+            for child in self.list_dir(item["path"], include_ignored):
+                if count >= limit:
+                    truncated = True
+                    break
+                count += 1
+                children.append(child)
+                if child["isDirectory"]:
+                    queue.append((child, level + 1))
+            item["children"] = children
+            if truncated:
+                # 只列出了一部分子项的目录，客户端展开时应重新获取
+                item["truncated"] = True
+                break
+        return {"root": self.root, "tree": root_item, "count": count, "truncated": truncated}
+
+
+class FileIndexManager:
+    """管理每个已打开根目录的 FileIndex；路径落在已知根目录下时复用该索引"""
+
+    def __init__(self, max_roots: int = 32):
+        self.max_roots = max_roots
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index_for(self, path: str, root: Optional[str] = None) -> FileIndex:
+        path = os.path.normpath(os.path.abspath(path))
+        with self._lock:
+            if root is not None:
+                root = os.path.normpath(os.path.abspath(root))
+                if root not in self._indexes:
+                    self._add(root)
+                return self._indexes[root]
+            best = None
+            for known_root in self._indexes:
+                if path == known_root or path.startswith(known_root + os.sep):
+                    if best is None or len(known_root) > len(best):
+                        best = known_root
+            if best is None:
+                best = path if os.path.isdir(path) else os.path.dirname(path)
+                self._add(best)
+            return self._indexes[best]
+
+    def _add(self, root: str):
+        if len(self._indexes) >= self.max_roots:
+            self._indexes.pop(next(iter(self._indexes)))
+        logger.info(f"Creating file index for {root}")
+        self._indexes[root] = FileIndex(root)
+
+    def roots(self) -> List[str]:
+        with self._lock:
+            return list(self._indexes)
+
+    def invalidate(self, path: str, recursive: bool = True):
+        """Drop cached listings for path in every index that contains it."""
+        path = os.path.normpath(os.path.abspath(path))
+        with self._lock:
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            if path == index.root or path.startswith(index.root + os.sep):
+                index.invalidate(path, recursive)
+            elif recursive and index.root.startswith(path + os.sep):
+                index.invalidate()
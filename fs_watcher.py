@@ -0,0 +1,594 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+from file_index import FileIndex
+
+logger = logging.getLogger(__name__)
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+# 只关心写完（而不是每次 write）、创建、删除和移动，编辑器的“写临时文件再改名”也会报成 MOVED_TO
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | \
+    _IN_ONLYDIR
+_EVENT_HEADER = struct.Struct("iIII")
+
+# ReadDirectoryChangesW（Windows）
+_FILE_LIST_DIRECTORY = 0x0001
+_FILE_SHARE_ALL = 0x00000001 | 0x00000002 | 0x00000004  # READ | WRITE | DELETE
+_OPEN_EXISTING = 3
+_FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+_FILE_FLAG_OVERLAPPED = 0x40000000
+_INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+_NOTIFY_FILTER = 0x00000001 | 0x00000002 | 0x00000008 | 0x00000010  # FILE_NAME | DIR_NAME | SIZE | LAST_WRITE
+_FILE_ACTION_ADDED = 1
+_FILE_ACTION_REMOVED = 2
+_FILE_ACTION_MODIFIED = 3
+_FILE_ACTION_RENAMED_OLD_NAME = 4
+_FILE_ACTION_RENAMED_NEW_NAME = 5
+_NOTIFY_HEADER = struct.Struct("III")  # NextEntryOffset, Action, FileNameLength
+# 网络共享上 ReadDirectoryChangesW 的缓冲区不能超过 64KB
+_NOTIFY_BUFFER_BYTES = 64 * 1024
+_MAXIMUM_WAIT_OBJECTS = 64
+_WAIT_OBJECT_0 = 0
+
+
+class _Overlapped(ctypes.Structure):
+    _fields_ = [("Internal", ctypes.c_void_p), ("InternalHigh", ctypes.c_void_p),
+                ("Offset", ctypes.c_uint32), ("OffsetHigh", ctypes.c_uint32), ("hEvent", ctypes.c_void_p)]
+
+
+def _load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _load_kernel32():
+    if sys.platform != "win32":
+        return None
+    try:
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle, dword, pointer = ctypes.c_void_p, ctypes.c_uint32, ctypes.c_void_p
+        kernel32.CreateFileW.argtypes = [ctypes.c_wchar_p, dword, dword, pointer, dword, dword, handle]
+        kernel32.CreateFileW.restype = handle
+        kernel32.CreateEventW.argtypes = [pointer, ctypes.c_int, ctypes.c_int, ctypes.c_wchar_p]
+        kernel32.CreateEventW.restype = handle
+        kernel32.ResetEvent.argtypes = [handle]
+        kernel32.ReadDirectoryChangesW.argtypes = [handle, pointer, dword, ctypes.c_int, dword,
+                                                   ctypes.POINTER(dword), ctypes.POINTER(_Overlapped), pointer]
+        kernel32.GetOverlappedResult.argtypes = [handle, ctypes.POINTER(_Overlapped), ctypes.POINTER(dword),
+                                                 ctypes.c_int]
+        kernel32.WaitForMultipleObjects.argtypes = [dword, ctypes.POINTER(handle), ctypes.c_int, dword]
+        kernel32.WaitForMultipleObjects.restype = dword
+        kernel32.WaitForSingleObject.argtypes = [handle, dword]
+        kernel32.WaitForSingleObject.restype = dword
+        kernel32.CancelIoEx.argtypes = [handle, ctypes.POINTER(_Overlapped)]
+        kernel32.CloseHandle.argtypes = [handle]
+    except (OSError, AttributeError):
+        return None
+    return kernel32
+
+
+class _InotifyBackend:
+    """每个（未被 .gitignore 忽略的）目录一个 inotify watch"""
+
+    name = "inotify"
+
+    def __init__(self, libc, watcher: "FileWatcher"):
+        self._libc = libc
+        self._watcher = watcher
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths = {}  # wd -> directory
+        self._wds = {}  # directory -> wd
+        self._buffer = b""
+
+    @property
+    def watches(self) -> int:
+        return len(self._wds)
+
+    def add_root(self, root: str):
+        self.add_tree(root, root)
+
+    def add_tree(self, root: str, directory: str, report: bool = False):
+        """Watch directory and the directories below it; with report, record their files as created."""
+        for path, is_dir in self._watcher.walk(root, directory):
+            if is_dir:
+                self._add_watch(path)
+            if report and path != directory:
+                self._watcher.record(root, path, "created", is_dir)
+
+    def _add_watch(self, directory: str):
+        if directory in self._wds:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (28,):  # ENOSPC: 超过 fs.inotify.max_user_watches
+                raise OSError(error, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return  # 目录已被删除或无权限
+        self._paths[wd] = directory
+        self._wds[directory] = wd
+
+    def remove_tree(self, directory: str):
+        prefix = directory + os.sep
+        for path in [p for p in self._wds if p == directory or p.startswith(prefix)]:
+            wd = self._wds.pop(path)
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def remove_root(self, root: str):
+        self.remove_tree(root)
+
+    def read(self, timeout: float):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            self._buffer += os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(self._buffer):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(self._buffer, offset)
+            end = offset + _EVENT_HEADER.size + length
+            if end > len(self._buffer):
+                break
+            name = self._buffer[offset + _EVENT_HEADER.size:end].rstrip(b"\0")
+            offset = end
+            self._handle(wd, mask, os.fsdecode(name))
+        self._buffer = self._buffer[offset:]
+
+    def _handle(self, wd: int, mask: int, name: str):
+        if mask & _IN_Q_OVERFLOW:
+            # 内核队列溢出，丢了事件：每个根目录都要重新扫描
+            for root in self._watcher.roots:
+                self._watcher.record_rescan(root)
+                self.remove_root(root)
+                self.add_root(root)
+            return
+        directory = self._paths.get(wd)
+        if mask & _IN_IGNORED:
+            self._paths.pop(wd, None)
+            if directory is not None and self._wds.get(directory) == wd:
+                del self._wds[directory]
+            return
+        if directory is None or not name:
+            return
+        root = self._watcher.root_of(directory)
+        if root is None:
+            return
+        path = os.path.join(directory, name)
+        is_dir = bool(mask & _IN_ISDIR)
+        if mask & (_IN_DELETE | _IN_MOVED_FROM):
+            if is_dir:
+                self.remove_tree(path)
+            self._watcher.record(root, path, "deleted", is_dir)
+        elif mask & (_IN_CREATE | _IN_MOVED_TO):
+            if self._watcher.record(root, path, "created", is_dir) and is_dir:
+                # 在加上 watch 之前新目录里可能已经有文件了
+                self.add_tree(root, path, report=True)
+        elif mask & _IN_CLOSE_WRITE:
+            self._watcher.record(root, path, "modified", False)
+        if name == ".gitignore":
+            # 规则变了，原来被忽略的目录可能需要监视
+            self.add_tree(root, directory)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _WindowsBackend:
+    """每个根目录一个递归的 ReadDirectoryChangesW（重叠I/O），由系统报告变化，不再定期扫描"""
+
+    name = "ReadDirectoryChangesW"
+
+    def __init__(self, kernel32, watcher: "FileWatcher"):
+        self._kernel32 = kernel32
+        self._watcher = watcher
+        self._watches = {}  # root -> {"handle", "event", "overlapped", "buffer"}
+        # 删除事件不说明被删的是不是目录，由这里记住已知的目录
+        self._dirs = {}  # root -> set of directories
+
+    @property
+    def watches(self) -> int:
+        return len(self._watches)
+
+    def add_root(self, root: str):
+        k = self._kernel32
+        handle = k.CreateFileW(root, _FILE_LIST_DIRECTORY, _FILE_SHARE_ALL, None, _OPEN_EXISTING,
+                               _FILE_FLAG_BACKUP_SEMANTICS | _FILE_FLAG_OVERLAPPED, None)
+        if handle is None or handle == _INVALID_HANDLE_VALUE:
+            raise ctypes.WinError(ctypes.get_last_error())
+        event = k.CreateEventW(None, True, False, None)
+        if not event:
+            k.CloseHandle(handle)
+            raise ctypes.WinError(ctypes.get_last_error())
+        watch = {"handle": handle, "event": event, "overlapped": _Overlapped(hEvent=event),
+                 "buffer": ctypes.create_string_buffer(_NOTIFY_BUFFER_BYTES), "pending": False}
+        if not self._issue(watch):
+            error = ctypes.get_last_error()
+            self._close_watch(watch)
+            raise ctypes.WinError(error)
+        self._watches[root] = watch
+        self._dirs[root] = {path for path, is_dir in self._watcher.walk(root, root) if is_dir}
+
+    def _issue(self, watch: dict) -> bool:
+        self._kernel32.ResetEvent(watch["event"])
+        watch["pending"] = bool(self._kernel32.ReadDirectoryChangesW(
+            watch["handle"], watch["buffer"], len(watch["buffer"]), True, _NOTIFY_FILTER, None,
+            ctypes.byref(watch["overlapped"]), None
+        ))
+        return watch["pending"]
+
+    def _close_watch(self, watch: dict):
+        if watch["pending"]:
+            # 等取消完成，之后系统不会再写入缓冲区
+            self._kernel32.CancelIoEx(watch["handle"], None)
+            self._kernel32.GetOverlappedResult(watch["handle"], ctypes.byref(watch["overlapped"]),
+                                               ctypes.byref(ctypes.c_uint32()), True)
+            watch["pending"] = False
+        self._kernel32.CloseHandle(watch["handle"])
+        self._kernel32.CloseHandle(watch["event"])
+
+    def remove_root(self, root: str):
+        watch = self._watches.pop(root, None)
+        self._dirs.pop(root, None)
+        if watch is not None:
+            self._close_watch(watch)
+
+    def read(self, timeout: float):
+        if not self._watches:
+            time.sleep(timeout)
+            return
+        # 最多等待64个事件；其余根目录的事件是手动重置的，等待结束后逐个检查
+        events = [watch["event"] for watch in self._watches.values()][:_MAXIMUM_WAIT_OBJECTS]
+        self._kernel32.WaitForMultipleObjects(len(events), (ctypes.c_void_p * len(events))(*events), False,
+                                              int(timeout * 1000))
+        for root, watch in list(self._watches.items()):
+            if self._kernel32.WaitForSingleObject(watch["event"], 0) != _WAIT_OBJECT_0:
+                continue
+            transferred = ctypes.c_uint32()
+            completed = self._kernel32.GetOverlappedResult(watch["handle"], ctypes.byref(watch["overlapped"]),
+                                                           ctypes.byref(transferred), False)
+            watch["pending"] = False
+            if not completed:
+                # 根目录被删除或移走
+                logger.warning(f"Stopped watching {root}: {ctypes.WinError(ctypes.get_last_error())}")
+                self.remove_root(root)
+                self._watcher.record_rescan(root)
+                continue
+            data = watch["buffer"].raw[:transferred.value]
+            # 先重新提交读取，处理期间发生的变化不会丢
+            if not self._issue(watch):
+                self.remove_root(root)
+                self._watcher.record_rescan(root)
+            if not data:
+                # 缓冲区溢出，丢了事件
+                self._watcher.record_rescan(root)
+                continue
+            self._handle(root, data)
+
+    def _handle(self, root: str, data: bytes):
+        offset = 0
+        while offset + _NOTIFY_HEADER.size <= len(data):
+            next_offset, action, length = _NOTIFY_HEADER.unpack_from(data, offset)
+            start = offset + _NOTIFY_HEADER.size
+            name = data[start:start + length].decode("utf-16-le", errors="replace")
+            self._handle_action(root, os.path.join(root, name), action)
+            if not next_offset:
+                break
+            offset += next_offset
+
+    def _handle_action(self, root: str, path: str, action: int):
+        dirs = self._dirs.get(root)
+        if dirs is None:
+            return
+        if action in (_FILE_ACTION_REMOVED, _FILE_ACTION_RENAMED_OLD_NAME):
+            is_dir = path in dirs
+            if is_dir:
+                prefix = path + os.sep
+                dirs.difference_update([d for d in dirs if d == path or d.startswith(prefix)])
+            self._watcher.record(root, path, "deleted", is_dir)
+        elif action in (_FILE_ACTION_ADDED, _FILE_ACTION_RENAMED_NEW_NAME):
+            is_dir = os.path.isdir(path)
+            if self._watcher.record(root, path, "created", is_dir) and is_dir:
+                # 改名或从外面移进来的目录，其中的文件不会单独报告
+                for child, child_is_dir in self._watcher.walk(root, path):
+                    if child_is_dir:
+                        dirs.add(child)
+                    if child != path:
+                        self._watcher.record(root, child, "created", child_is_dir)
+        elif action == _FILE_ACTION_MODIFIED and path not in dirs:
+            # 目录的 MODIFIED 只是其中内容变了，内容的变化会单独报告
+            self._watcher.record(root, path, "modified", False)
+
+    def close(self):
+        for root in list(self._watches):
+            self.remove_root(root)
+
+
+class _PollingBackend:
+    """没有系统通知接口时定期比较文件的 (mtime, size) 快照"""
+
+    name = "polling"
+
+    def __init__(self, watcher: "FileWatcher", interval: float):
+        self._watcher = watcher
+        self.interval = interval
+        self._snapshots = {}  # root -> {path: (mtime_ns, size, is_dir)}
+        self._next_poll = time.monotonic() + interval
+
+    @property
+    def watches(self) -> int:
+        return sum(len(snapshot) for snapshot in self._snapshots.values())
+
+    def _snapshot(self, root: str) -> dict:
+        snapshot = {}
+        for path, is_dir in self._watcher.walk(root, root):
+            if path == root:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (0 if is_dir else stat.st_mtime_ns, 0 if is_dir else stat.st_size, is_dir)
+        return snapshot
+
+    def add_root(self, root: str):
+        self._snapshots[root] = self._snapshot(root)
+
+    def remove_root(self, root: str):
+        self._snapshots.pop(root, None)
+
+    def read(self, timeout: float):
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return
+        time.sleep(max(0.0, wait))
+        self._next_poll = time.monotonic() + self.interval
+        for root, old in list(self._snapshots.items()):
+            new = self._snapshot(root)
+            for path, (mtime, size, is_dir) in new.items():
+                previous = old.get(path)
+                if previous is None or previous[2] != is_dir:
+                    self._watcher.record(root, path, "created", is_dir)
+                elif previous != (mtime, size, is_dir):
+                    self._watcher.record(root, path, "modified", is_dir)
+            for path, (_, _, is_dir) in old.items():
+                if path not in new:
+                    self._watcher.record(root, path, "deleted", is_dir)
+            self._snapshots[root] = new
+
+    def close(self):
+        pass
+
+
+class FileWatcher:
+    """监视打开过的根目录中的文件变化，去抖合并后按根目录分批交给 on_changes
+
+    Linux uses inotify and Windows ReadDirectoryChangesW; other platforms (or when the native
+    API is unavailable or out of watches) poll (mtime, size) snapshots every `poll_interval`
+    seconds. Like the search indexer, paths ignored by .gitignore are not reported.
+
+    A batch is {"root", "changes": [{"path", "type": created/modified/deleted, "isDirectory"}],
+    "dirs": directories whose listing changed, "rescan": bool}. "rescan" means events were
+    lost and everything under root should be treated as changed.
+    """
+
+    def __init__(self, roots_provider: Callable[[], List[str]], on_changes: Callable[[dict], None],
+                 exclude: Callable[[str], bool] = None, debounce: float = 0.3, max_delay: float = 2.0,
+                 poll_interval: float = 5.0, roots_interval: float = 30.0, native: bool = True):
+        self.roots_provider = roots_provider
+        self.on_changes = on_changes
+        self.exclude = exclude or (lambda path: False)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.roots_interval = roots_interval
+        self.native = native
+        self.roots = []
+        self.events = 0
+        self.batches = 0
+        self._indexes = {}
+        self._pending = {}  # root -> {path: (type, is_dir)}
+        self._rescan = set()
+        self._first_event = None
+        self._last_event = None
+        self._backend = None
+        self._roots_due = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def backend(self) -> Optional[str]:
+        return self._backend.name if self._backend is not None else None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def request_refresh(self, paths=None):
+        """Re-read the root list soon (e.g. after a folder was opened for the first time)."""
+        self._roots_due = 0.0
+
+    # ---- 供后端调用 ----
+
+    def walk(self, root: str, directory: str):
+        """Yield (path, is_dir) for directory itself and everything below it that is not ignored."""
+        index = self._indexes[root]
+        stack = [directory]
+        yield directory, True
+        while stack:
+            current = stack.pop()
+            try:
+                entries = index.list_dir(current, include_ignored=False)
+            except OSError:
+                continue
+            for entry in entries:
+                if self.exclude(entry["path"]):
+                    continue
+                yield entry["path"], entry["isDirectory"]
+                if entry["isDirectory"]:
+                    stack.append(entry["path"])
+
+    def root_of(self, path: str) -> Optional[str]:
+        for root in self.roots:
+            if path == root or path.startswith(root + os.sep):
+                return root
+        return None
+
+    def record(self, root: str, path: str, kind: str, is_dir: bool) -> bool:
+        """Queue a change; False if the path is ignored."""
+        if self.exclude(path) or self._indexes[root].is_path_ignored(path, is_dir):
+            return False
+        self.events += 1
+        if os.path.basename(path) == ".gitignore":
+            # 忽略规则变了，这个目录以下缓存的忽略标记都要重新计算
+            self._indexes[root].invalidate(os.path.dirname(path))
+        pending = self._pending.setdefault(root, {})
+        previous = pending.get(path)
+        # 合并同一路径的连续事件
+        if previous is None:
+            merged = kind
+        elif previous[0] == "created":
+            merged = None if kind == "deleted" else "created"
+        elif previous[0] == "deleted":
+            merged = "created" if is_dir else "modified"
+        else:
+            merged = "deleted" if kind == "deleted" else "modified"
+        if merged is None:
+            del pending[path]
+        else:
+            pending[path] = (merged, is_dir)
+        self._touch()
+        return True
+
+    def record_rescan(self, root: str):
+        self._indexes[root].invalidate()
+        self._rescan.add(root)
+        self._touch()
+
+    def _touch(self):
+        now = time.monotonic()
+        if self._first_event is None:
+            self._first_event = now
+        self._last_event = now
+
+    # ---- 后台线程 ----
+
+    def _create_backend(self):
+        libc = _load_inotify() if self.native else None
+        if libc is not None:
+            try:
+                return _InotifyBackend(libc, self)
+            except OSError as e:
+                logger.warning(f"inotify unavailable ({e}), polling for file changes instead")
+        kernel32 = _load_kernel32() if self.native else None
+        if kernel32 is not None:
+            return _WindowsBackend(kernel32, self)
+        return _PollingBackend(self, self.poll_interval)
+
+    def _sync_roots(self):
+        self._roots_due = time.monotonic() + self.roots_interval
+        try:
+            roots = sorted({os.path.abspath(r) for r in self.roots_provider() if os.path.isdir(r)})
+        except Exception as e:
+            logger.error(f"Error listing roots to watch: {e}")
+            return
+        removed = [r for r in self.roots if r not in roots]
+        added = [r for r in roots if r not in self.roots]
+        for root in removed:
+            self._backend.remove_root(root)
+            self._indexes.pop(root, None)
+            self._pending.pop(root, None)
+        self.roots = [r for r in self.roots if r in roots]
+        for root in added:
+            self._indexes[root] = FileIndex(root)
+            self.roots = self.roots + [root]
+            try:
+                self._backend.add_root(root)
+            except OSError as e:
+                if self._backend.name == "polling":
+                    raise
+                if self._backend.name != "inotify":
+                    # ReadDirectoryChangesW 的错误只涉及这一个根目录（如无权限）
+                    logger.warning(f"Cannot watch {root}: {e}")
+                    continue
+                logger.warning(f"{e}; polling for file changes instead")
+                self._backend.close()
+                self._backend = _PollingBackend(self, self.poll_interval)
+                for known in self.roots:
+                    self._backend.add_root(known)
+        if added or removed:
+            logger.info(f"Watching {len(self.roots)} roots for file changes ({self._backend.name}, "
+                        f"{self._backend.watches} watches)")
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        rescan, self._rescan = self._rescan, set()
+        self._first_event = self._last_event = None
+        for root in sorted(set(pending) | rescan):
+            items = sorted(pending.get(root, {}).items())
+            changes = [{"path": path, "type": kind, "isDirectory": is_dir} for path, (kind, is_dir) in items]
+            dirs = {os.path.dirname(c["path"]) for c in changes if c["type"] != "modified"}
+            dirs.update(c["path"] for c in changes if c["type"] == "created" and c["isDirectory"])
+            if not changes and root not in rescan:
+                continue
+            self.batches += 1
+            try:
+                self.on_changes({"root": root, "changes": changes, "dirs": sorted(dirs), "rescan": root in rescan})
+            except Exception as e:
+                logger.error(f"Error handling file changes: {e}", exc_info=True)
+
+    def _run(self):
+        self._backend = self._create_backend()
+        while not self._stopped.is_set():
+            try:
+                if time.monotonic() >= self._roots_due:
+                    self._sync_roots()
+                self._backend.read(0.2 if self._first_event is not None else 1.0)
+                now = time.monotonic()
+                if self._first_event is not None and (now - self._last_event >= self.debounce or
+                                                      now - self._first_event >= self.max_delay):
+                    self._flush()
+            except Exception as e:
+                logger.error(f"File watcher error: {e}", exc_info=True)
+                time.sleep(1.0)
+        self._backend.close()
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "roots": list(self.roots),
+                "watches": self._backend.watches if self._backend is not None else 0,
+                "events": self.events, "batches": self.batches}
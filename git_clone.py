@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# git --progress 输出形如 "Receiving objects:  45% (450/1000), 1.2 MiB | 2.0 MiB/s"
+_PROGRESS_RE = re.compile(r"^(?:remote: )?([A-Za-z][A-Za-z ]+):\s+(\d+)%")
+# 克隆先写入临时目录，成功后再改名，半途失败不会留下看似可用的仓库
+PARTIAL_SUFFIX = ".cloning"
+MAX_LOG_LINES = 50
+# 任务状态文件保留的时间；其他worker进程通过这些文件查询进度
+STATE_MAX_AGE_SECONDS = 24 * 3600
+# 未指定深度：新克隆只取最近一次提交，已有仓库的 fetch 保持原来的深度（完整克隆不会变浅）
+DEFAULT_DEPTH = "default"
+DEFAULT_CLONE_DEPTH = 1
+
+
+class GitCloneManager:
+    """后台执行 git clone / fetch：在线程中运行git子进程，解析进度并推送给订阅者"""
+
+    def __init__(self, on_complete: Callable[[str], None] = None, state_dir: Optional[Path] = None):
+        self.on_complete = on_complete
+        self.state_dir = Path(state_dir) if state_dir else None
+        self.jobs = {}
+        self._active = {}
+        self._subscribers = {}
+        self._tasks = {}
+        self._persisted_at = {}
+        if self.state_dir:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            for state_file in self.state_dir.glob("*.json"):
+                if time.time() - state_file.stat().st_mtime > STATE_MAX_AGE_SECONDS:
+                    state_file.unlink(missing_ok=True)
+
+    def start(self, url: str, repo_path: Path, depth: Union[int, None, str] = DEFAULT_DEPTH,
+              filter_blobs: bool = False, sparse_paths: Optional[List[str]] = None,
+              branch: Optional[str] = None) -> dict:
+        """Clone url into repo_path, or fetch it if it is already a repository.
+
+        depth None asks for the full history (a fetch unshallows a shallow repository).
+        Returns the job; a job already running for the same path is reused.
+        """
+        repo_path = Path(repo_path).resolve()
+        key = str(repo_path)
+        if key in self._active:
+            return self.jobs[self._active[key]]
+        action = "fetch" if (repo_path / ".git").exists() else "clone"
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "url": url,
+            "path": key,
+            "action": action,
+            "status": "running",
+            "phase": "starting",
+            "percent": 0,
+            "log": [],
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        self.jobs[job["id"]] = job
+        self._active[key] = job["id"]
+        self._subscribers[job["id"]] = []
+        options = {"depth": depth, "filter_blobs": filter_blobs, "sparse_paths": sparse_paths or [], "branch": branch}
+        self._tasks[job["id"]] = asyncio.ensure_future(self._run(job, options))
+        self._persist(job, force=True)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """A job of this process, or the last persisted state of a job run by another worker."""
+        job = self.jobs.get(job_id)
+        if job is None and self.state_dir and len(job_id) == 12 and job_id.isalnum():
+            try:
+                with open(self.state_dir / f"{job_id}.json", "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                return None
+        return job
+
+    def _persist(self, job: dict, force: bool = False):
+        if not self.state_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._persisted_at.get(job["id"], 0) < 0.2:
+            return
+        self._persisted_at[job["id"]] = now
+        state_file = self.state_dir / f"{job['id']}.json"
+        tmp_path = state_file.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.public(job), f, ensure_ascii=False)
+        os.replace(tmp_path, state_file)
+
+    def public(self, job: dict) -> dict:
+        return dict(job, log=job["log"][-10:])
+
+    async def events(self, job_id: str):
+        """Yield job snapshots as progress arrives, ending with the finished job."""
+        if job_id not in self.jobs:
+            # 另一个worker进程中的任务，轮询其状态文件
+            job = self.get(job_id)
+            yield job
+            while job is not None and job["status"] == "running":
+                await asyncio.sleep(0.3)
+                latest = self.get(job_id)
+                if latest is not None and latest != job:
+                    job = latest
+                    yield job
+            return
+        job = self.jobs[job_id]
+        queue = asyncio.Queue()
+        self._subscribers[job_id].append(queue)
+        try:
+            yield self.public(job)
+            while job["status"] == "running":
+                await queue.get()
+                # 进度更新很频繁，最多每 0.2 秒发送一次最新状态
+                if job["status"] == "running":
+                    await asyncio.sleep(0.2)
+                while not queue.empty():
+                    queue.get_nowait()
+                yield self.public(job)
+        finally:
+            self._subscribers[job_id].remove(queue)
+
+    def _notify(self, job: dict):
+        self._persist(job, force=job["status"] != "running")
+        for queue in self._subscribers.get(job["id"], []):
+            queue.put_nowait(None)
+
+    async def _git(self, job: dict, *args: str, cwd: str = None) -> str:
+        """Run one git command, turning --progress output into job updates; returns stdout.
+
+        git runs in a worker thread rather than as an asyncio subprocess: with several workers
+        uvicorn uses the selector event loop on Windows, which cannot start subprocesses.
+        """
+        loop = asyncio.get_running_loop()
+
+        def on_line(line: str):
+            loop.call_soon_threadsafe(self._on_output, job, line)
+
+        returncode, stdout = await asyncio.to_thread(self._run_git, args, cwd, on_line)
+        if returncode != 0:
+            message = next((line for line in reversed(job["log"]) if line.startswith(("fatal:", "error:"))),
+                           job["log"][-1] if job["log"] else f"exit code {returncode}")
+            raise RuntimeError(f"git {args[0]} failed: {message}")
+        return stdout
+
+    @staticmethod
+    def _run_git(args, cwd: Optional[str], on_line: Callable[[str], None]):
+        env = dict(os.environ, GIT_TERMINAL_PROMPT="0", LC_ALL="C")
+        process = subprocess.Popen(["git", *args], cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout = []
+        reader = threading.Thread(target=lambda: stdout.append(process.stdout.read()), daemon=True)
+        reader.start()
+        buffer = b""
+        while True:
+            block = process.stderr.read1(4096)
+            if not block:
+                break
+            buffer += block
+            # 进度行以 \r 结尾，普通消息以 \n 结尾
+            *lines, buffer = re.split(rb"[\r\n]", buffer)
+            for raw in lines:
+                on_line(raw.decode("utf-8", errors="replace").strip())
+        if buffer:
+            on_line(buffer.decode("utf-8", errors="replace").strip())
+        reader.join()
+        returncode = process.wait()
+        return returncode, b"".join(stdout).decode("utf-8", errors="replace")
+
+    def _on_output(self, job: dict, line: str):
+        if not line:
+            return
+        match = _PROGRESS_RE.match(line)
+        if match:
+            job["phase"] = match.group(1).strip()
+            job["percent"] = int(match.group(2))
+        elif not job["log"] or job["log"][-1] != line:
+            job["log"].append(line)
+            del job["log"][:-MAX_LOG_LINES]
+        self._notify(job)
+
+    async def _run(self, job: dict, options: dict):
+        try:
+            if job["action"] == "clone":
+                await self._clone(job, options)
+            else:
+                await self._fetch(job, options)
+            job["status"] = "completed"
+            job["phase"] = "done"
+            job["percent"] = 100
+            logger.info(f"git {job['action']} of {job['url']} finished in {time.time() - job['created_at']:.1f}s")
+            if self.on_complete:
+                self.on_complete(job["path"])
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            logger.error(f"git {job['action']} of {job['url']} failed: {e}")
+        finally:
+            job["finished_at"] = time.time()
+            self._active.pop(job["path"], None)
+            self._tasks.pop(job["id"], None)
+            self._notify(job)
+
+    async def _clone(self, job: dict, options: dict):
+        partial_path = job["path"] + PARTIAL_SUFFIX
+        if os.path.exists(partial_path):
+            # 上次被中断的临时目录
+            shutil.rmtree(partial_path)
+        if os.path.isdir(job["path"]):
+            if os.listdir(job["path"]):
+                raise RuntimeError(f"{job['path']} exists and is not a git repository")
+            os.rmdir(job["path"])
+        args = ["clone", "--progress"]
+        depth = DEFAULT_CLONE_DEPTH if options["depth"] == DEFAULT_DEPTH else options["depth"]
+        if depth:
+            args += ["--depth", str(depth)]
+        if options["filter_blobs"]:
+            args.append("--filter=blob:none")
+        if options["branch"]:
+            args += ["--branch", options["branch"]]
+        if options["sparse_paths"]:
+            args.append("--sparse")
+        await self._git(job, *args, job["url"], partial_path)
+        if options["sparse_paths"]:
+            job["phase"] = "Sparse checkout"
+            self._notify(job)
+            await self._git(job, "sparse-checkout", "set", *options["sparse_paths"], cwd=partial_path)
+        os.replace(partial_path, job["path"])
+
+    async def _fetch(self, job: dict, options: dict):
+        path = job["path"]
+        args = ["fetch", "--progress", "--prune"]
+        if options["depth"] is None:
+            if os.path.exists(os.path.join(path, ".git", "shallow")):
+                args.append("--unshallow")
+        elif options["depth"] != DEFAULT_DEPTH:
+            args += ["--depth", str(options["depth"])]
+        await self._git(job, *args, "origin", cwd=path)
+        try:
+            upstream = (await self._git(job, "rev-parse", "--abbrev-ref", "@{u}", cwd=path)).strip()
+        except RuntimeError:
+            # 分离的HEAD或没有上游分支：只更新远程引用
+            return
+        # 只快进：本地有超前或分叉的提交、或有冲突的未提交修改时报错，不丢弃本地内容；未跟踪的 .ai 文件不受影响
+        try:
+            await self._git(job, "merge", "--ff-only", upstream, cwd=path)
+        except RuntimeError as e:
+            raise RuntimeError(f"Fetched {upstream}, but the local branch cannot be fast-forwarded: {e}") from e
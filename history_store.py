@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from shared_state import connect_shared
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStore:
+    """内存中的历史记录（按最近访问排序），通过追加日志持久化，定期压缩为快照
+
+    snapshot_path holds the compacted entries; journal_path gets one JSON line per
+    change, so a write is a single append and a crash loses at most the line being written.
+    """
+
+    def __init__(self, snapshot_path: Path, journal_path: Path, legacy_path: Optional[Path] = None,
+                 compact_after: int = 500):
+        self.snapshot_path = Path(snapshot_path)
+        self.journal_path = Path(journal_path)
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        self.compact_after = compact_after
+        self._entries = OrderedDict()  # path -> {"count", "last_access"}，最近访问的在末尾
+        self._lock = threading.Lock()
+        self._journal_lines = 0
+        self._load(legacy_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _load(self, legacy_path: Optional[Path]):
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                for entry in json.load(f):
+                    self._entries[entry["path"]] = {"count": entry["count"], "last_access": entry["last_access"]}
+        elif legacy_path is not None and Path(legacy_path).exists():
+            # 旧版 history.log 是按加入顺序保存的路径列表
+            try:
+                with open(legacy_path, "r", encoding="utf-8") as f:
+                    for path in json.load(f):
+                        self._entries[path] = {"count": 1, "last_access": 0}
+                logger.info(f"Imported {len(self._entries)} history entries from {legacy_path}")
+            except (OSError, ValueError) as e:
+                logger.error(f"Error importing history from {legacy_path}: {e}")
+
+        if self.journal_path.exists():
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的最后一行
+                        continue
+                    self._apply(record)
+                    self._journal_lines += 1
+
+    def _apply(self, record: dict):
+        path = record["path"]
+        if record["op"] == "touch":
+            entry = self._entries.pop(path, {"count": 0, "last_access": 0})
+            entry["count"] += 1
+            entry["last_access"] = record["ts"]
+            self._entries[path] = entry
+        elif record["op"] == "delete":
+            self._entries.pop(path, None)
+
+    def _append(self, record: dict):
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        self._journal_lines += 1
+        if self._journal_lines >= self.compact_after:
+            self._compact()
+
+    def touch(self, path: str):
+        """Record an access to path, moving it to the front of the history."""
+        with self._lock:
+            record = {"op": "touch", "path": path, "ts": time.time()}
+            self._apply(record)
+            self._append(record)
+
+    def remove(self, path: str) -> bool:
+        with self._lock:
+            if path not in self._entries:
+                return False
+            record = {"op": "delete", "path": path}
+            self._apply(record)
+            self._append(record)
+            return True
+
+    def paths(self) -> List[str]:
+        """Paths, most recently used first."""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def entries(self) -> List[dict]:
+        with self._lock:
+            return [{"path": path, **entry} for path, entry in reversed(self._entries.items())]
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def close(self):
+        with self._lock:
+            self._journal.close()
+
+    def _compact(self):
+        """Write a snapshot atomically, then start an empty journal."""
+        tmp_path = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([{"path": path, **entry} for path, entry in self._entries.items()], f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self._journal.close()
+        self._journal = open(self.journal_path, "w", encoding="utf-8")
+        self._journal_lines = 0
+
+
+class SharedHistoryStore:
+    """多worker进程共享的历史记录，存放在SQLite(WAL)中，接口与 HistoryStore 相同
+
+    seed() returns initial entries (e.g. from the single-process store) and is only
+    called when the database is created.
+    """
+
+    def __init__(self, db_path: Path, seed: Callable[[], List[dict]] = None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = connect_shared(self.db_path)
+        self._lock = threading.Lock()
+        with self._lock:
+            # 几个worker同时启动时只有一个导入初始数据
+            self._conn.execute("BEGIN IMMEDIATE")
+            exists = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history'").fetchone()
+            if not exists:
+                self._conn.execute("CREATE TABLE history (path TEXT PRIMARY KEY, count INTEGER NOT NULL, "
+                                   "last_access REAL NOT NULL)")
+                self._conn.execute("CREATE INDEX idx_history_last_access ON history(last_access)")
+                entries = seed() if seed else []
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO history (path, count, last_access) VALUES (?, ?, ?)",
+                    [(e["path"], e["count"], e["last_access"]) for e in reversed(entries)])
+                if entries:
+                    logger.info(f"Imported {len(entries)} history entries into {self.db_path}")
+            self._conn.commit()
+
+    def touch(self, path: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO history (path, count, last_access) VALUES (?, 1, ?) "
+                "ON CONFLICT(path) DO UPDATE SET count = count + 1, last_access = excluded.last_access",
+                (path, time.time()))
+            self._conn.commit()
+
+    def remove(self, path: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM history WHERE path = ?", (path,))
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def paths(self) -> List[str]:
+        return [entry["path"] for entry in self.entries()]
+
+    def entries(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, count, last_access FROM history ORDER BY last_access DESC, rowid DESC").fetchall()
+        return [{"path": path, "count": count, "last_access": last_access} for path, count, last_access in rows]
+
+    def compact(self):
+        pass
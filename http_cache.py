@@ -0,0 +1,230 @@
+import gzip
+import hashlib
+import json
+import os
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+from tracing import span
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只用 gzip
+    brotli = None
+
+# 响应格式变化时加一，客户端缓存的旧响应不再匹配
+API_VERSION = 1
+# 小于这个大小的响应压缩不划算
+MIN_COMPRESS_BYTES = 1024
+_COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "text/css", "text/javascript",
+                       "application/javascript", "text/markdown")
+# 逐条输出的流也压缩，每块之后 flush；SSE 不压缩，避免代理和浏览器缓冲事件
+_STREAM_COMPRESSIBLE_TYPES = ("application/x-ndjson",)
+# 浏览器每次使用缓存前都重新验证
+REVALIDATE = "no-cache"
+
+
+def stat_version(stat: Optional[os.stat_result]) -> str:
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}" if stat is not None else "none"
+
+
+def stat_etag(stat: Optional[os.stat_result], *parts) -> str:
+    """Weak ETag for a representation derived from a file version (None: the file does not exist) and parts."""
+    extra = "".join(f"-{part}" for part in parts)
+    return f'W/"{API_VERSION}-{stat_version(stat)}{extra}"'
+
+
+def body_etag(body: bytes) -> str:
+    return f'W/"{API_VERSION}-{hashlib.sha1(body).hexdigest()[:20]}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # 弱比较：忽略 W/ 前缀（压缩后的响应也算同一版本）
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_fresh(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """Whether the client's cached copy (If-None-Match, else If-Modified-Since) is still current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[float] = None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def not_modified(etag: str, last_modified: Optional[float] = None) -> Response:
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+
+def render_json(content) -> bytes:
+    with span("serialize"):
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(request: Request, content, etag: Optional[str] = None,
+                  last_modified: Optional[float] = None) -> Response:
+    """JSON response with validators, or 304 when the client already has it.
+
+    Without `etag` the validator is a hash of the serialized body, which still saves the
+    transfer but not the work of building the response.
+    """
+    body = None
+    if etag is None:
+        body = render_json(content)
+        etag = body_etag(body)
+    if is_fresh(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    if body is None:
+        body = render_json(content)
+    return Response(body, media_type="application/json", headers=validator_headers(etag, last_modified))
+
+
+def _accepted_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    with span("compress"):
+        if encoding == "br":
+            # 质量4的压缩率接近 gzip -9，速度快得多
+            return brotli.compress(body, quality=4)
+        return gzip.compress(body, compresslevel=5)
+
+
+class _StreamCompressor:
+    """Compress a streamed body chunk by chunk, flushing so each chunk can be decoded on arrival."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=4)
+        else:
+            self._compressor = zlib.compressobj(5, zlib.DEFLATED, 31)  # wbits 31: gzip 格式
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        with span("compress"):
+            if self.encoding == "br":
+                out = self._compressor.process(data)
+                return out + (self._compressor.finish() if finish else self._compressor.flush())
+            out = self._compressor.compress(data)
+            return out + self._compressor.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+
+def _encoded_start(start: dict, encoding: str, length: Optional[int]) -> dict:
+    headers = [(k, v) for k, v in start.get("headers", []) if k.lower() != b"content-length"]
+    headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding")]
+    if length is not None:
+        headers.append((b"content-length", str(length).encode()))
+    return {**start, "headers": headers}
+
+
+def _content_type(headers: dict) -> str:
+    return headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing text/JSON responses with brotli or gzip (Accept-Encoding).
+
+    Responses sent as a single body message are compressed whole. Of streamed responses only
+    NDJSON is compressed (flushed per chunk); SSE, byte ranges and large files pass through
+    untouched so they are never delayed by buffering.
+    """
+
+    def __init__(self, app, minimum_size: int = MIN_COMPRESS_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = _accepted_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        stream = None
+
+        async def compressing_send(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is not None:
+                await send({**message, "body": stream.compress(body, not more_body)})
+                return
+            if start is None:
+                await send(message)
+                return
+            response_start, start = start, None
+            if not more_body and self._should_compress(response_start, body):
+                body = compress(body, encoding)
+                response_start = _encoded_start(response_start, encoding, len(body))
+                message = {**message, "body": body}
+            elif more_body and self._should_stream(response_start):
+                stream = _StreamCompressor(encoding)
+                response_start = _encoded_start(response_start, encoding, None)
+                message = {**message, "body": stream.compress(body, False)}
+            await send(response_start)
+            await send(message)
+
+        await self.app(scope, receive, compressing_send)
+
+    def _should_compress(self, start: dict, body: bytes) -> bool:
+        if start["status"] != 200 or len(body) < self.minimum_size:
+            return False
+        headers = {k.lower(): v for k, v in start.get("headers", [])}
+        if b"content-encoding" in headers or b"content-range" in headers:
+            return False
+        return _content_type(headers) in _COMPRESSIBLE_TYPES
+
+    def _should_stream(self, start: dict) -> bool:
+        headers = {k.lower(): v for k, v in start.get("headers", [])}
+        return start["status"] == 200 and b"content-encoding" not in headers and \
+            _content_type(headers) in _STREAM_COMPRESSIBLE_TYPES
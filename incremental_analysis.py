@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from analysis_cache import normalize_code
+from chunking import extract_symbols
+
+logger = logging.getLogger(__name__)
+
+# 每个文件的符号级分析记录，和 .ai 文件放在一起
+SYMBOL_RECORD_SUFFIX = ".ai.json"
+RECORD_VERSION = 1
+
+
+def symbol_hash(text: str) -> str:
+    return hashlib.sha256(normalize_code(text).encode("utf-8")).hexdigest()
+
+
+def load_symbol_record(path: str) -> dict:
+    """Load the per-symbol analysis record of a file, or an empty record."""
+    record_path = path + SYMBOL_RECORD_SUFFIX
+    try:
+        with open(record_path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        if record.get("version") == RECORD_VERSION:
+            return record
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading symbol record {record_path}: {e}")
+    return {"version": RECORD_VERSION, "symbols": []}
+
+
+def has_symbol_record(path: str, model: str, analytype: str) -> bool:
+    """Whether a previous per-symbol analysis with the same settings exists for the file."""
+    record = load_symbol_record(path)
+    return bool(record["symbols"]) and record.get("model") == model and record.get("analytype") == analytype
+
+
+def save_symbol_record(path: str, record: dict):
+    record_path = path + SYMBOL_RECORD_SUFFIX
+    tmp_path = record_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp_path, record_path)
+
+
+async def analyze_incrementally(path: str, code: str, model: str, analytype: str, analyze_symbols, merge):
+    """Re-analyze only the symbols whose content changed and rebuild the file summary.
+
+    analyze_symbols(chunks) returns one analysis per chunk; merge(parts) turns the ordered
+    (symbol name, analysis) pairs into the file document. Returns (content, stats).
+    """
+    record = load_symbol_record(path)
+    same_settings = record.get("model") == model and record.get("analytype") == analytype
+    previous = {s["hash"]: s["analysis"] for s in record["symbols"]} if same_settings else {}
+
+    chunks = extract_symbols(code, path)
+    hashes = [symbol_hash(chunk.text) for chunk in chunks]
+    changed = [(chunk, h) for chunk, h in zip(chunks, hashes) if h not in previous]
+    removed = set(previous) - set(hashes)
+
+    sidecar = Path(path + ".ai")
+    stats = {
+        "symbols": len(chunks),
+        "reanalyzed": [chunk.symbols[0] for chunk, _ in changed],
+        "reused": len(chunks) - len(changed),
+        "removed": len(removed),
+    }
+    if not changed and not removed and record.get("summary_hash") == symbol_hash("".join(hashes)) and sidecar.exists():
+        logger.info(f"No symbol changed in {path}, reusing existing analysis")
+        return sidecar.read_text(encoding="utf-8"), stats
+
+    fresh = await analyze_symbols([chunk for chunk, _ in changed]) if changed else []
+    analyses = dict(previous)
+    analyses.update({h: analysis for (_, h), analysis in zip(changed, fresh)})
+
+    parts = [(chunk.symbols[0], analyses[h]) for chunk, h in zip(chunks, hashes)]
+    content = await merge(parts)
+
+    save_symbol_record(path, {
+        "version": RECORD_VERSION,
+        "model": model,
+        "analytype": analytype,
+        "summary_hash": symbol_hash("".join(hashes)),
+        "symbols": [
+            {"name": chunk.symbols[0], "hash": h, "start_line": chunk.start_line,
+             "end_line": chunk.end_line, "analysis": analyses[h]}
+            for chunk, h in zip(chunks, hashes)
+        ],
+    })
+    logger.info(f"Incremental analysis of {path}: {len(changed)} of {len(chunks)} symbols re-analyzed")
+    return content, stats
@@ -0,0 +1,298 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+from chunking import estimate_tokens
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+PERCENTILE_WINDOW = 1000
+
+# 每百万tokens的价格（输入, 输出），单位元；按服务商价格表填写，也可用环境变量 CODE_VIEW_MODEL_PRICES 覆盖。
+# 没有价格的模型费用记为未知（统计中为 null），而不是 0
+MODEL_PRICES = {
+    "GLM-4-Flash": (0.0, 0.0),
+}
+MODEL_PRICES.update({k: tuple(v) for k, v in json.loads(os.environ.get("CODE_VIEW_MODEL_PRICES", "{}")).items()})
+
+
+
+def unpriced_models(models) -> list:
+    """The models in models (upstream names) that have no entry in MODEL_PRICES, in order, without duplicates."""
+    return [m for m in dict.fromkeys(models) if m not in MODEL_PRICES]
+
+
+_current_call = contextvars.ContextVar("current_llm_call", default=None)
+
+
+def report_usage(usage) -> None:
+    """Called by provider functions with the `usage` object of a response, if the API returned one."""
+    call = _current_call.get()
+    if call is None or usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    if isinstance(usage, dict):
+        prompt, completion = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    if prompt is not None and completion is not None:
+        call.usage = (int(prompt), int(completion))
+
+
+class CallRecord:
+    """一次模型调用的计时和用量"""
+
+    def __init__(self, provider: str, model: str, analytype: str, prompt: str):
+        self.provider = provider
+        self.model = model
+        self.analytype = analytype
+        self.prompt = prompt
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.completion_parts = []
+        self.usage = None
+
+    def set_result(self, text: str):
+        self.completion_parts = [text or ""]
+
+    def on_delta(self, delta: str):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.completion_parts.append(delta)
+
+
+class _Series:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated_requests = 0
+        self.unpriced_requests = 0
+        self.cost = 0.0
+        self.latency = deque(maxlen=PERCENTILE_WINDOW)
+        self.ttft = deque(maxlen=PERCENTILE_WINDOW)
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.ttft_buckets = [0] * len(LATENCY_BUCKETS)
+        self.ttft_count = 0
+        self.latency_sum = 0.0
+        self.ttft_sum = 0.0
+
+
+def _observe(buckets: list, value: float):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if value <= bound:
+            buckets[i] += 1
+
+
+def _percentile(samples, p: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3)
+
+
+def _label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """按 (provider, model, analytype) 统计调用次数、tokens、费用和延迟"""
+
+    def __init__(self):
+        self._series = {}
+        self._cache = {"hit": 0, "miss": 0, "bypass": 0}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    @contextmanager
+    def track(self, provider: str, model: str, analytype: str, prompt: str):
+        """Time one non-streaming provider call; the body passes the result to record.set_result."""
+        record = CallRecord(provider, model, analytype, prompt)
+        token = _current_call.set(record)
+        try:
+            yield record
+        except asyncio.CancelledError:
+            # 被对冲请求取消的调用不计入统计
+            raise
+        except Exception:
+            self._finish(record, ok=False)
+            raise
+        else:
+            self._finish(record, ok=True)
+        finally:
+            _current_call.reset(token)
+
+    async def track_stream(self, provider: str, model: str, analytype: str, prompt: str, deltas):
+        """Wrap a delta stream so its time to first token, duration and size are recorded.
+
+        The call record is current while the provider stream runs (not across yields, since the
+        first delta may be read in another task), so it can report_usage from its last chunk.
+        """
+        record = CallRecord(provider, model, analytype, prompt)
+        iterator = deltas.__aiter__()
+        try:
+            while True:
+                token = _current_call.set(record)
+                try:
+                    delta = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    _current_call.reset(token)
+                record.on_delta(delta)
+                yield delta
+        except Exception:
+            self._finish(record, ok=False)
+            raise
+        self._finish(record, ok=True)
+
+    def _finish(self, record: CallRecord, ok: bool):
+        elapsed = time.monotonic() - record.started
+        if record.usage is not None:
+            prompt_tokens, completion_tokens = record.usage
+            estimated = False
+        else:
+            prompt_tokens = estimate_tokens(record.prompt)
+            completion_tokens = estimate_tokens("".join(record.completion_parts))
+            estimated = True
+        price = MODEL_PRICES.get(record.model)
+        with self._lock:
+            key = (record.provider, record.model, record.analytype)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.requests += 1
+            if not ok:
+                series.errors += 1
+                return
+            series.prompt_tokens += prompt_tokens
+            series.completion_tokens += completion_tokens
+            series.estimated_requests += estimated
+            if price is None:
+                series.unpriced_requests += 1
+            else:
+                series.cost += (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+            series.latency.append(elapsed)
+            series.latency_sum += elapsed
+            _observe(series.latency_buckets, elapsed)
+            if record.first_token_at is not None:
+                ttft = record.first_token_at - record.started
+                series.ttft.append(ttft)
+                series.ttft_sum += ttft
+                series.ttft_count += 1
+                _observe(series.ttft_buckets, ttft)
+
+    def record_cache(self, result: str):
+        with self._lock:
+            self._cache[result] += 1
+
+    def export(self) -> dict:
+        """JSON-serializable snapshot of all counters, for merging the metrics of several workers."""
+        with self._lock:
+            series = [[list(key), {**vars(s), "latency": list(s.latency), "ttft": list(s.ttft)}]
+                      for key, s in self._series.items()]
+            return {"since": self.started_at, "series": series, "cache": dict(self._cache)}
+
+    @classmethod
+    def merged(cls, states: list) -> "Metrics":
+        """Metrics holding the sum of several exported snapshots (one per worker process)."""
+        merged = cls()
+        if states:
+            merged.started_at = min(state["since"] for state in states)
+        for state in states:
+            for result, value in state["cache"].items():
+                merged._cache[result] = merged._cache.get(result, 0) + value
+            for key, data in state["series"]:
+                series = merged._series.setdefault(tuple(key), _Series())
+                for name, value in data.items():
+                    current = getattr(series, name)
+                    if isinstance(current, deque):
+                        current.extend(value)
+                    elif isinstance(current, list):
+                        setattr(series, name, [a + b for a, b in zip(current, value)])
+                    else:
+                        setattr(series, name, current + value)
+        return merged
+
+    def summary(self) -> dict:
+        with self._lock:
+            models = []
+            for (provider, model, analytype), s in sorted(self._series.items()):
+                succeeded = s.requests - s.errors
+                models.append({
+                    "provider": provider,
+                    "model": model,
+                    "analytype": analytype,
+                    "requests": s.requests,
+                    "errors": s.errors,
+                    "error_rate": round(s.errors / s.requests, 3) if s.requests else 0.0,
+                    "prompt_tokens": s.prompt_tokens,
+                    "completion_tokens": s.completion_tokens,
+                    "estimated_requests": s.estimated_requests,
+                    "cost": None if s.unpriced_requests else round(s.cost, 4),
+                    "avg_cost": round(s.cost / succeeded, 6) if succeeded and not s.unpriced_requests else None,
+                    "latency_seconds": {"p50": _percentile(s.latency, 0.5), "p95": _percentile(s.latency, 0.95),
+                                        "p99": _percentile(s.latency, 0.99)},
+                    "ttft_seconds": {"p50": _percentile(s.ttft, 0.5), "p95": _percentile(s.ttft, 0.95),
+                                     "p99": _percentile(s.ttft, 0.99)},
+                    "completion_tokens_per_second": round(s.completion_tokens / s.latency_sum, 1) if s.latency_sum else None,
+                })
+            cache = dict(self._cache)
+        lookups = cache["hit"] + cache["miss"]
+        cache["hit_rate"] = round(cache["hit"] / lookups, 3) if lookups else 0.0
+        return {"since": self.started_at, "models": models, "cache": cache}
+
+    def prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, labels, buckets, count, total):
+            for bound, value in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+
+        with self._lock:
+            series = sorted(self._series.items())
+            cache = dict(self._cache)
+
+        def labels_of(key):
+            provider, model, analytype = key
+            return (f'provider="{_label_value(provider)}",model="{_label_value(model)}",'
+                    f'analytype="{_label_value(analytype)}"')
+
+        header("code_view_llm_requests_total", "counter", "Model calls by outcome.")
+        for key, s in series:
+            lines.append(f'code_view_llm_requests_total{{{labels_of(key)},status="ok"}} {s.requests - s.errors}')
+            lines.append(f'code_view_llm_requests_total{{{labels_of(key)},status="error"}} {s.errors}')
+        header("code_view_llm_tokens_total", "counter", "Prompt and completion tokens (from usage, or estimated).")
+        for key, s in series:
+            lines.append(f'code_view_llm_tokens_total{{{labels_of(key)},kind="prompt"}} {s.prompt_tokens}')
+            lines.append(f'code_view_llm_tokens_total{{{labels_of(key)},kind="completion"}} {s.completion_tokens}')
+        header("code_view_llm_cost_total", "counter", "Cost in CNY according to MODEL_PRICES (models without a price are left out).")
+        for key, s in series:
+            if s.unpriced_requests:
+                continue
+            lines.append(f"code_view_llm_cost_total{{{labels_of(key)}}} {s.cost:.6f}")
+        header("code_view_llm_request_duration_seconds", "histogram", "Wall time of successful model calls.")
+        for key, s in series:
+            histogram("code_view_llm_request_duration_seconds", labels_of(key), s.latency_buckets,
+                      s.requests - s.errors, s.latency_sum)
+        header("code_view_llm_time_to_first_token_seconds", "histogram", "Time to the first streamed token.")
+        for key, s in series:
+            histogram("code_view_llm_time_to_first_token_seconds", labels_of(key), s.ttft_buckets,
+                      s.ttft_count, s.ttft_sum)
+        header("code_view_analysis_cache_total", "counter", "Analysis cache lookups.")
+        for result, value in cache.items():
+            lines.append(f'code_view_analysis_cache_total{{result="{result}"}} {value}')
+        return "\n".join(lines) + "\n"
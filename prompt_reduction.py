@@ -0,0 +1,250 @@
+import ast
+import re
+from typing import List, Optional, Tuple
+
+from chunking import estimate_tokens, source_lines
+
+# 各分析类型默认的压缩级别：none 不处理；light 去掉低价值内容；outline 在 light 基础上只保留签名和文档字符串
+REDUCTION_LEVELS = ("none", "light", "outline")
+DEFAULT_REDUCTION = {"simple": "outline", "detail": "light"}
+
+LITERAL_MAX_LINES = 15
+LITERAL_MAX_CHARS = 1500
+LONG_LINE_CHARS = 500
+LONG_LINE_KEEP = 200
+DATA_RUN_MIN_LINES = 15
+
+_LICENSE_RE = re.compile(r"copyright|licen[cs]e|spdx-license|permission is hereby granted|all rights reserved", re.I)
+_COMMENT_LINE_RE = re.compile(r"^\s*(#|//|/\*|\*|\*/|--|<!--|-->)")
+_BANNER_RE = re.compile(r"^\s*(?:#+|//+|/\*+|\*+|<!--)?\s*([-=*#~_+/])\1{4,}\s*(?:\*+/|-->)?\s*$")
+_DATA_LINE_RE = re.compile(
+    r"""^\s*[\[\]{}(),]*\s*(?:(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|-?(?:0[xX][0-9a-fA-F]+|\d[\d_]*\.?\d*(?:[eE][-+]?\d+)?)"""
+    r"""|true|false|null|None|True|False)\s*[:,]?\s*)+[\]}),;]*\s*$"""
+)
+
+
+def is_python(path: str) -> bool:
+    # 没有路径时不知道语言，只做与语言无关的压缩
+    return path.endswith((".py", ".pyw", ".pyi"))
+
+
+def strip_license_header(code: str) -> str:
+    """Drop a leading comment block that is a license or copyright notice."""
+    lines = code.splitlines(keepends=True)
+    start = 0
+    # 保留 shebang 和编码声明
+    while start < len(lines) and (lines[start].startswith("#!") or "coding" in lines[start][:40] and lines[start].startswith("#")):
+        start += 1
+    end = start
+    in_block = False
+    while end < len(lines):
+        stripped = lines[end].strip()
+        if in_block:
+            if "*/" in stripped:
+                in_block = False
+            end += 1
+        elif stripped.startswith("/*"):
+            in_block = "*/" not in stripped[2:]
+            end += 1
+        elif stripped and _COMMENT_LINE_RE.match(lines[end]):
+            end += 1
+        else:
+            break
+    header = "".join(lines[start:end])
+    if end - start >= 3 and _LICENSE_RE.search(header):
+        return "".join(lines[:start] + lines[end:]).lstrip("\n")
+    return code
+
+
+def _line_offsets(lines: List[str]) -> List[int]:
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+def _char_offset(lines: List[str], offsets: List[int], lineno: int, col_bytes: int) -> int:
+    """Convert an ast (1-based line, UTF-8 byte column) position into a string offset."""
+    line = lines[lineno - 1]
+    return offsets[lineno - 1] + len(line.encode("utf-8")[:col_bytes].decode("utf-8", errors="ignore"))
+
+
+def _docstring_nodes(tree) -> set:
+    ids = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+                ids.add(id(first.value))
+    return ids
+
+
+def collapse_python_literals(code: str) -> Tuple[str, int]:
+    """Replace large list/dict/set/tuple/string literals with a short placeholder; returns (code, count)."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return collapse_data_runs(code)
+    docstrings = _docstring_nodes(tree)
+    lines = source_lines(code)
+    offsets = _line_offsets(lines)
+    spans = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set, ast.Dict)):
+            brackets = {ast.List: "[]", ast.Tuple: "()", ast.Set: "{}", ast.Dict: "{}"}[type(node)]
+        elif isinstance(node, ast.Constant) and isinstance(node.value, (str, bytes)) and id(node) not in docstrings:
+            brackets = '""'
+        else:
+            continue
+        start = _char_offset(lines, offsets, node.lineno, node.col_offset)
+        end = _char_offset(lines, offsets, node.end_lineno, node.end_col_offset)
+        n_lines = node.end_lineno - node.lineno + 1
+        if n_lines > LITERAL_MAX_LINES or end - start > LITERAL_MAX_CHARS:
+            spans.append((start, end, n_lines, brackets))
+    # 只替换最外层的字面量
+    spans.sort(key=lambda s: (s[0], -s[1]))
+    selected = []
+    for span in spans:
+        if not selected or span[0] >= selected[-1][1]:
+            selected.append(span)
+    for start, end, n_lines, brackets in reversed(selected):
+        opener, closer = brackets[0], brackets[1]
+        if brackets == "()" and code[start] != "(":
+            opener = closer = ""
+        line_end = code.find("\n", end)
+        if line_end == -1:
+            line_end = len(code)
+        if line_end > end and code[line_end - 1] == "\r":
+            line_end -= 1
+        rest_of_line = code[end:line_end]
+        note = ""
+        if not rest_of_line.strip(" ,)]};"):
+            # 说明放在行尾，不能注释掉字面量后面的右括号
+            note = f"  # 省略了 {n_lines} 行 / {end - start} 字符的数据"
+        code = code[:start] + f"{opener}...{closer}" + rest_of_line + note + code[line_end:]
+    return code, len(selected)
+
+
+def collapse_data_runs(code: str) -> Tuple[str, int]:
+    """Language-agnostic fallback: shorten long runs of lines that only hold literals."""
+    lines = code.splitlines(keepends=True)
+    result = []
+    collapsed = 0
+    i = 0
+    while i < len(lines):
+        j = i
+        while j < len(lines) and lines[j].strip() and _DATA_LINE_RE.match(lines[j]):
+            j += 1
+        if j - i >= DATA_RUN_MIN_LINES:
+            indent = lines[i][:len(lines[i]) - len(lines[i].lstrip())]
+            result.extend(lines[i:i + 3])
+            result.append(f"{indent}... <省略了 {j - i - 3} 行数据>\n")
+            collapsed += 1
+            i = j
+        elif j > i:
+            result.extend(lines[i:j])
+            i = j
+        else:
+            result.append(lines[i])
+            i += 1
+    return "".join(result), collapsed
+
+
+def shorten_long_lines(code: str) -> Tuple[str, int]:
+    """Truncate very long lines, which are usually minified code or embedded data."""
+    lines = code.splitlines(keepends=True)
+    count = 0
+    for i, line in enumerate(lines):
+        body = line.rstrip("\n")
+        if len(body) > LONG_LINE_CHARS:
+            lines[i] = f"{body[:LONG_LINE_KEEP]} ... <省略了 {len(body) - LONG_LINE_KEEP} 字符>\n"
+            count += 1
+    return "".join(lines), count
+
+
+def drop_banners_and_whitespace(code: str) -> str:
+    """Remove comment banners, trailing whitespace and runs of blank lines."""
+    result = []
+    blank = False
+    for line in code.splitlines():
+        if _BANNER_RE.match(line):
+            continue
+        line = line.rstrip()
+        if not line:
+            if blank:
+                continue
+            blank = True
+        else:
+            blank = False
+        result.append(line)
+    return "\n".join(result).strip("\n") + "\n"
+
+
+def python_outline(code: str) -> Tuple[str, int]:
+    """Keep module-level code, class bodies, signatures and docstrings; replace function bodies with '...'."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return code, 0
+    lines = source_lines(code)
+    spans = []
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        body = node.body
+        first = body[0]
+        if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+            body = body[1:]
+        if not body or body[0].lineno <= node.lineno:
+            continue
+        start, end = body[0].lineno, node.end_lineno
+        indent = lines[start - 1][:len(lines[start - 1]) - len(lines[start - 1].lstrip())]
+        spans.append((start, end, indent))
+    # 外层函数的函数体已经包含了内层函数
+    spans.sort(key=lambda s: (s[0], -s[1]))
+    selected = []
+    for span in spans:
+        if not selected or span[0] > selected[-1][1]:
+            selected.append(span)
+    for start, end, indent in reversed(selected):
+        lines[start - 1:end] = [f"{indent}...\n"]
+    return "".join(lines), len(selected)
+
+
+def reduce_prompt(code: str, path: str = "", analytype: str = "detail", level: Optional[str] = None) -> Tuple[str, dict]:
+    """Shrink code before it is sent to a model; returns (reduced code, report of the savings)."""
+    level = level or DEFAULT_REDUCTION.get(analytype, "light")
+    if level not in REDUCTION_LEVELS:
+        raise ValueError(f"Unknown reduction level: {level}")
+    original_tokens = estimate_tokens(code)
+    steps = []
+    reduced = code
+    if level != "none":
+        stripped = strip_license_header(reduced)
+        if stripped != reduced:
+            steps.append("license_header")
+            reduced = stripped
+        if level == "outline" and is_python(path):
+            reduced, count = python_outline(reduced)
+            if count:
+                steps.append(f"outline({count})")
+        if is_python(path):
+            reduced, count = collapse_python_literals(reduced)
+        else:
+            reduced, count = collapse_data_runs(reduced)
+        if count:
+            steps.append(f"literals({count})")
+        reduced, count = shorten_long_lines(reduced)
+        if count:
+            steps.append(f"long_lines({count})")
+        reduced = drop_banners_and_whitespace(reduced)
+    sent_tokens = estimate_tokens(reduced)
+    report = {
+        "level": level,
+        "original_tokens": original_tokens,
+        "sent_tokens": sent_tokens,
+        "saved_tokens": original_tokens - sent_tokens,
+        "saved_percent": round(100 * (original_tokens - sent_tokens) / original_tokens, 1) if original_tokens else 0.0,
+        "steps": steps,
+    }
+    return reduced, report
@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 这些状态码说明换个时间或换个服务商可能成功
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+# 连续失败这么多次后，服务商进入冷却期，排到候选列表最后
+FAILURES_BEFORE_COOLDOWN = 3
+MAX_COOLDOWN_SECONDS = 60.0
+
+Target = Tuple[str, str]  # (provider, upstream model)
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """HTTP status carried by an SDK/requests exception, if any."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # 没有状态码的多是超时和连接错误；参数错误重试也没用
+    return not isinstance(exc, (ValueError, TypeError, KeyError))
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderStats:
+    """一个服务商最近的延迟（总耗时、首个token）和成功率"""
+
+    def __init__(self, window: int = 200):
+        self.latency = deque(maxlen=window)
+        self.first_token = deque(maxlen=window)
+        self.outcomes = deque(maxlen=50)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.hedges = 0
+
+    @staticmethod
+    def percentile(samples, p: float) -> Optional[float]:
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def error_rate(self) -> float:
+        return 1 - sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def record_success(self, latency: float = None, first_token: float = None):
+        self.requests += 1
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if latency is not None:
+            self.latency.append(latency)
+        if first_token is not None:
+            self.first_token.append(first_token)
+
+    def record_failure(self, exc: BaseException):
+        self.requests += 1
+        self.failures += 1
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        cooldown = retry_after_seconds(exc)
+        if cooldown is None and (error_status(exc) == 429 or self.consecutive_failures >= FAILURES_BEFORE_COOLDOWN):
+            cooldown = min(MAX_COOLDOWN_SECONDS, 2.0 ** self.consecutive_failures)
+        if cooldown:
+            self.cooldown_until = time.monotonic() + cooldown
+
+    def snapshot(self) -> dict:
+        def ms(value):
+            return round(value * 1000) if value is not None else None
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "error_rate": round(self.error_rate(), 3),
+            "hedges": self.hedges,
+            "latency_p50_ms": ms(self.percentile(self.latency, 0.5)),
+            "latency_p95_ms": ms(self.percentile(self.latency, 0.95)),
+            "first_token_p50_ms": ms(self.percentile(self.first_token, 0.5)),
+            "first_token_p95_ms": ms(self.percentile(self.first_token, 0.95)),
+            "cooling_down": not self.available(),
+        }
+
+
+class _Attempts:
+    """Decides which target to try next: retry with backoff, then fail over down the list."""
+
+    def __init__(self, targets: List[Target], max_retries: int, base_backoff: float):
+        self.targets = targets
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.index = -1
+        self.tries = {}
+
+    def _backoff(self, target: Target) -> float:
+        delay = self.base_backoff * 2 ** (self.tries[target] - 1)
+        return delay * random.uniform(0.8, 1.2)
+
+    def next(self, failed: Optional[Target] = None, error: BaseException = None):
+        """Return (target, delay) for the next attempt, or None when everything was tried."""
+        if failed is not None and is_retryable(error) and self.tries[failed] <= self.max_retries:
+            # 限流时先换服务商，没有可换的才在原服务商上退避重试
+            if error_status(error) != 429 or self.index >= len(self.targets) - 1:
+                self.tries[failed] += 1
+                return failed, self._backoff(failed)
+        if self.index + 1 >= len(self.targets):
+            return None
+        self.index += 1
+        target = self.targets[self.index]
+        self.tries[target] = 1
+        return target, 0.0
+
+    def has_more(self) -> bool:
+        return self.index + 1 < len(self.targets)
+
+
+class ProviderRouter:
+    """在等价的模型/服务商之间路由：按延迟和错误率排序、失败重试与切换、可选的对冲请求
+
+    on_failure(provider, exc) is called for every failed attempt, e.g. to reset that
+    provider's client.
+    """
+
+    def __init__(self, max_retries: int = 1, base_backoff: float = 0.5, hedge: bool = False,
+                 hedge_min_delay: float = 1.0, hedge_min_samples: int = 5,
+                 on_failure: Callable[[str, BaseException], None] = None):
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.on_failure = on_failure
+        self.stats = {}
+
+    def stats_for(self, provider: str) -> ProviderStats:
+        if provider not in self.stats:
+            self.stats[provider] = ProviderStats()
+        return self.stats[provider]
+
+    def order(self, targets: List[Target]) -> List[Target]:
+        """Keep the requested target first while it is healthy; put cooling-down or failing providers last."""
+        def unhealthy(target):
+            stats = self.stats_for(target[0])
+            return not stats.available() or stats.error_rate() > 0.5
+
+        def median_latency(target):
+            stats = self.stats_for(target[0])
+            # 没有样本的排在有样本的后面，同等情况下保持配置顺序
+            median = stats.percentile(stats.latency, 0.5)
+            return median if median is not None else float("inf")
+
+        primary = targets[0]
+        rest = [t for t in dict.fromkeys(targets[1:]) if t != primary]
+        rest.sort(key=lambda t: (unhealthy(t), median_latency(t)))
+        if unhealthy(primary) and rest and not unhealthy(rest[0]):
+            return rest + [primary]
+        return [primary] + rest
+
+    def hedge_delay(self, provider: str, streaming: bool) -> Optional[float]:
+        """How long to wait for the first result before starting a hedged request (p95 of past requests)."""
+        if not self.hedge:
+            return None
+        stats = self.stats_for(provider)
+        samples = stats.first_token if streaming else stats.latency
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, stats.percentile(samples, 0.95))
+
+    def _failed(self, target: Target, exc: BaseException):
+        provider, model = target
+        self.stats_for(provider).record_failure(exc)
+        logger.warning(f"{provider} model {model} failed: {exc!r}")
+        if self.on_failure:
+            self.on_failure(provider, exc)
+
+    async def _race(self, targets: List[Target], open_stream, streaming: bool):
+        """Start attempts until one produces its first item; returns (target, iterator, first item, start time)."""
+        attempts = _Attempts(self.order(targets), self.max_retries, self.base_backoff)
+
+        async def attempt(target: Target, delay: float):
+            if delay:
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            iterator = open_stream(*target).__aiter__()
+            try:
+                first = await iterator.__anext__()
+            except StopAsyncIteration:
+                first = None
+            return iterator, first, started
+
+        pending = {}
+
+        def launch(next_attempt):
+            target, delay = next_attempt
+            pending[asyncio.ensure_future(attempt(target, delay))] = target
+
+        launch(attempts.next())
+        last_error = None
+        hedged = False
+        try:
+            while pending:
+                timeout = None
+                if not hedged and len(pending) == 1 and attempts.has_more():
+                    timeout = self.hedge_delay(next(iter(pending.values()))[0], streaming)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 主请求迟迟没有结果，同时向下一个候选发起请求，谁先返回用谁
+                    hedged = True
+                    slow = next(iter(pending.values()))
+                    self.stats_for(slow[0]).hedges += 1
+                    logger.info(f"Hedging slow {slow[0]} request")
+                    launch(attempts.next())
+                    continue
+                winner = None
+                for task in done:
+                    target = pending.pop(task)
+                    if task.exception() is None:
+                        if winner is None:
+                            winner = (target,) + task.result()
+                        else:
+                            # 两个请求同时返回，关闭多余的那个
+                            asyncio.ensure_future(task.result()[0].aclose())
+                        continue
+                    last_error = task.exception()
+                    self._failed(target, last_error)
+                    if not pending:
+                        next_attempt = attempts.next(target, last_error)
+                        if next_attempt is not None:
+                            launch(next_attempt)
+                if winner is not None:
+                    return winner
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call(self, targets: List[Target], invoke) -> Tuple[str, Target]:
+        """Run invoke(provider, model) with failover and hedging; returns (result, target used)."""
+        async def single(provider, model):
+            yield await invoke(provider, model)
+
+        target, _, result, started = await self._race(targets, single, streaming=False)
+        self.stats_for(target[0]).record_success(latency=time.monotonic() - started)
+        return result, target
+
+    async def stream(self, targets: List[Target], open_stream) -> AsyncIterator[str]:
+        """Yield deltas from open_stream(provider, model).
+
+        Failover and hedging only happen before the first delta; after that the stream is
+        committed to one provider and errors are raised to the caller.
+        """
+        target, iterator, first, started = await self._race(targets, open_stream, streaming=True)
+        stats = self.stats_for(target[0])
+        first_token = time.monotonic() - started
+        if first is None:
+            stats.record_success(latency=first_token, first_token=first_token)
+            return
+        try:
+            yield first
+            async for delta in iterator:
+                yield delta
+        except Exception as e:
+            self._failed(target, e)
+            raise
+        finally:
+            await iterator.aclose()
+        stats.record_success(latency=time.monotonic() - started, first_token=first_token)
+
+    def snapshot(self) -> dict:
+        return {provider: stats.snapshot() for provider, stats in sorted(self.stats.items())}
@@ -0,0 +1,309 @@
+import functools
+import html
+import json
+import os
+import re
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from file_content import is_binary_file
+from shared_state import connect_shared
+
+try:
+    from pygments.lexers import find_lexer_class_for_filename, get_lexer_by_name, get_lexer_for_filename
+    from pygments.token import Comment, Keyword, Literal, Name, Number, Operator, String, Generic
+    from pygments.util import ClassNotFound
+except ImportError:  # 未安装 pygments 时由浏览器端高亮
+    get_lexer_for_filename = None
+
+try:
+    import markdown
+except ImportError:  # 未安装 markdown 时由浏览器端用 marked 渲染
+    markdown = None
+
+# 渲染结果格式变化时加一，旧缓存自动失效
+RENDER_VERSION = 1
+# 渲染后的行按块存储，读取一个行窗口只需取出覆盖它的几个块
+CHUNK_LINES = 1000
+
+# Pygments 记号类型 -> highlight.js 的 CSS 类名，这样页面现有的 highlight.js 主题可以直接使用
+_HLJS_CLASSES = []
+if get_lexer_for_filename is not None:
+    _HLJS_CLASSES = [
+        (String.Doc, "hljs-string"),
+        (String.Interpol, "hljs-subst"),
+        (String, "hljs-string"),
+        (Number, "hljs-number"),
+        (Keyword.Constant, "hljs-literal"),
+        (Keyword.Type, "hljs-type"),
+        (Keyword, "hljs-keyword"),
+        (Operator.Word, "hljs-keyword"),
+        (Comment.Preproc, "hljs-meta"),
+        (Comment, "hljs-comment"),
+        (Name.Builtin, "hljs-built_in"),
+        (Name.Decorator, "hljs-meta"),
+        (Name.Function, "hljs-title"),
+        (Name.Class, "hljs-title"),
+        (Name.Tag, "hljs-name"),
+        (Name.Attribute, "hljs-attr"),
+        (Name.Variable, "hljs-variable"),
+        (Literal, "hljs-literal"),
+        (Generic.Heading, "hljs-section"),
+        (Generic.Subheading, "hljs-section"),
+        (Generic.Inserted, "hljs-addition"),
+        (Generic.Deleted, "hljs-deletion"),
+        (Generic.Emph, "hljs-emphasis"),
+        (Generic.Strong, "hljs-strong"),
+    ]
+_class_cache = {}
+
+
+def _css_class(token_type) -> Optional[str]:
+    if token_type not in _class_cache:
+        _class_cache[token_type] = next((css for base, css in _HLJS_CLASSES if token_type in base), None)
+    return _class_cache[token_type]
+
+
+def highlight_lines(text: str, lexer) -> List[str]:
+    """Highlight text into one HTML string per line; spans never cross line boundaries."""
+    lines = []
+    current = []
+    for token_type, value in lexer.get_tokens(text):
+        css = _css_class(token_type)
+        parts = value.split("\n")
+        for i, part in enumerate(parts):
+            if i:
+                lines.append("".join(current))
+                current = []
+            if part:
+                escaped = html.escape(part, quote=False)
+                current.append(f'<span class="{css}">{escaped}</span>' if css else escaped)
+    if current:
+        lines.append("".join(current))
+    return lines
+
+
+def can_highlight() -> bool:
+    return get_lexer_for_filename is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def _has_lexer(name: str) -> bool:
+    return find_lexer_class_for_filename(name) is not None
+
+
+def has_lexer(path: str) -> bool:
+    """Whether Pygments knows the file type (decided by extension, or file name when there is none)."""
+    if not can_highlight():
+        return False
+    name = os.path.basename(path)
+    extension = os.path.splitext(name)[1]
+    return _has_lexer("x" + extension if extension else name)
+
+
+def can_render_markdown() -> bool:
+    return markdown is not None
+
+
+def init_render_worker():
+    """Initializer of the render worker processes: Ctrl+C is handled by the server process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def render_file(path: str) -> Tuple[tuple, Optional[str], Optional[List[str]]]:
+    """Highlight a source file; runs in the render worker pool.
+
+    Returns ((mtime_ns, size) of the version rendered, language, lines), with lines None
+    for binary files and files without a known lexer.
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if is_binary_file(path):
+        return version, None, None
+    try:
+        lexer = get_lexer_for_filename(path, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return version, None, None
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    return version, lexer.aliases[0] if lexer.aliases else lexer.name, highlight_lines(text, lexer)
+
+
+_CODE_BLOCK_RE = re.compile(r'<pre><code class="language-([\w+#.-]+)">(.*?)</code></pre>', re.S)
+
+
+def _highlight_code_block(match) -> str:
+    language, code = match.group(1), html.unescape(match.group(2))
+    try:
+        lexer = get_lexer_by_name(language, stripnl=False)
+    except ClassNotFound:
+        return match.group(0)
+    body = "\n".join(highlight_lines(code, lexer))
+    return f'<pre><code class="hljs language-{language}">{body}</code></pre>'
+
+
+def render_markdown(path: str) -> Tuple[tuple, Optional[str]]:
+    """Render an analysis (.ai, Markdown) to HTML; runs in the render worker pool."""
+    stat = os.stat(path)
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    rendered = markdown.markdown(text, extensions=["fenced_code", "tables", "sane_lists"])
+    if get_lexer_for_filename is not None:
+        rendered = _CODE_BLOCK_RE.sub(_highlight_code_block, rendered)
+    return (stat.st_mtime_ns, stat.st_size), rendered
+
+
+class RenderCache:
+    """渲染结果（高亮后的代码行、分析的HTML）的SQLite缓存，按 (path, mtime, size) 寻址，按最近访问淘汰"""
+
+    def __init__(self, db_path: Path, max_bytes: int = 500 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = connect_shared(self.db_path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS renders (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                language TEXT,
+                total_lines INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_renders_path ON renders(path);
+            CREATE INDEX IF NOT EXISTS idx_renders_last_access ON renders(last_access);
+            CREATE TABLE IF NOT EXISTS render_chunks (
+                key TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                body TEXT NOT NULL,
+                PRIMARY KEY (key, chunk)
+            );
+            -- 缓存总大小由触发器维护，淘汰时不必每次 SUM(size)；所有worker进程的写入都会计入
+            CREATE TABLE IF NOT EXISTS render_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL);
+            INSERT OR IGNORE INTO render_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM renders;
+            CREATE TRIGGER IF NOT EXISTS renders_size_insert AFTER INSERT ON renders
+                BEGIN UPDATE render_size SET total = total + NEW.size; END;
+            CREATE TRIGGER IF NOT EXISTS renders_size_delete AFTER DELETE ON renders
+                BEGIN UPDATE render_size SET total = total - OLD.size; END;
+            CREATE TRIGGER IF NOT EXISTS renders_size_update AFTER UPDATE OF size ON renders
+                BEGIN UPDATE render_size SET total = total + NEW.size - OLD.size; END;
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(kind: str, path: str, version: tuple) -> str:
+        mtime_ns, size = version
+        return f"{kind}:{RENDER_VERSION}:{mtime_ns}:{size}:{path}"
+
+    def _touch(self, key: str, last_access: float):
+        now = time.time()
+        # 访问时间只用于淘汰，一分钟内不重复写
+        if now - last_access > 60:
+            self._conn.execute("UPDATE renders SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+
+    def get_lines(self, path: str, version: tuple, offset: int, limit: int) -> Optional[dict]:
+        """Cached highlighted lines [offset, offset + limit) (limit 0: to the end), or None on a miss."""
+        key = self.make_key("file", path, version)
+        with self._lock:
+            row = self._conn.execute("SELECT language, total_lines, last_access FROM renders WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            language, total_lines, last_access = row
+            end = total_lines if not limit else min(total_lines, offset + limit)
+            lines = []
+            if offset < end:
+                chunks = self._conn.execute(
+                    "SELECT chunk, body FROM render_chunks WHERE key = ? AND chunk BETWEEN ? AND ? ORDER BY chunk",
+                    (key, offset // CHUNK_LINES, (end - 1) // CHUNK_LINES)).fetchall()
+                for chunk, body in chunks:
+                    chunk_lines = json.loads(body)
+                    start = chunk * CHUNK_LINES
+                    lines.extend(chunk_lines[max(0, offset - start):end - start])
+            self._touch(key, last_access)
+            self.hits += 1
+        return {"language": language, "lines": lines, "total_lines": total_lines,
+                "has_more": end < total_lines, "next_offset": end if end < total_lines else None}
+
+    def put_lines(self, path: str, version: tuple, language: str, lines: List[str]):
+        key = self.make_key("file", path, version)
+        chunks = [(key, i // CHUNK_LINES, json.dumps(lines[i:i + CHUNK_LINES], ensure_ascii=False))
+                  for i in range(0, len(lines), CHUNK_LINES)]
+        self._put(key, path, "file", language, len(lines), chunks)
+
+    def get_html(self, path: str, version: tuple) -> Optional[str]:
+        key = self.make_key("markdown", path, version)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT c.body, r.last_access FROM renders r JOIN render_chunks c ON c.key = r.key WHERE r.key = ?",
+                (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._touch(key, row[1])
+            self.hits += 1
+        return row[0]
+
+    def put_html(self, path: str, version: tuple, rendered: str):
+        key = self.make_key("markdown", path, version)
+        self._put(key, path, "markdown", None, 0, [(key, 0, rendered)])
+
+    def _put(self, key: str, path: str, kind: str, language: Optional[str], total_lines: int, chunks: list):
+        size = sum(len(body) for _, _, body in chunks)
+        with self._lock:
+            # 同一文件的旧版本不会再被访问
+            self._delete(path, kind)
+            # 用 upsert 而不是 INSERT OR REPLACE：REPLACE 删除旧行时不触发删除触发器
+            self._conn.execute(
+                "INSERT INTO renders (key, path, kind, language, total_lines, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET path = excluded.path, "
+                "kind = excluded.kind, language = excluded.language, total_lines = excluded.total_lines, "
+                "size = excluded.size, last_access = excluded.last_access",
+                (key, path, kind, language, total_lines, size, time.time()))
+            self._conn.executemany("INSERT OR REPLACE INTO render_chunks (key, chunk, body) VALUES (?, ?, ?)", chunks)
+            self._evict()
+            self._conn.commit()
+
+    def _delete(self, path: str, kind: Optional[str] = None):
+        query = "SELECT key FROM renders WHERE path = ?" + (" AND kind = ?" if kind else "")
+        keys = [(k,) for (k,) in self._conn.execute(query, (path, kind) if kind else (path,))]
+        self._conn.executemany("DELETE FROM render_chunks WHERE key = ?", keys)
+        self._conn.executemany("DELETE FROM renders WHERE key = ?", keys)
+
+    def _evict(self):
+        total = self._conn.execute("SELECT total FROM render_size").fetchone()[0]
+        while total > self.max_bytes:
+            # 每次只取最久未访问的一小批，缓存满时每次写入也不必读出所有行
+            oldest = self._conn.execute("SELECT key, size FROM renders ORDER BY last_access LIMIT 64").fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM render_chunks WHERE key = ?", (key,))
+                self._conn.execute("DELETE FROM renders WHERE key = ?", (key,))
+                total -= size
+
+    def invalidate(self, path: str):
+        """Drop every cached render of path."""
+        with self._lock:
+            self._delete(path)
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM renders").fetchone()[0]
+            total = self._conn.execute("SELECT total FROM render_size").fetchone()[0]
+        return {"entries": entries, "bytes": total, "max_bytes": self.max_bytes, "hits": self.hits,
+                "misses": self.misses, "highlighting": can_highlight(), "markdown": can_render_markdown()}
@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from chunking import estimate_tokens
+from search_index import iter_indexable_files
+from shared_state import connect_shared
+
+logger = logging.getLogger(__name__)
+
+# 提示词或输入格式变化时加一，已缓存的目录总结全部重新生成
+SUMMARY_VERSION = 1
+# 每个文件的 .ai 分析只取开头这么多字符（开头通常是整个文件的功能概述）
+FILE_EXCERPT_CHARS = 1200
+
+
+def excerpt(text: str, limit: int = FILE_EXCERPT_CHARS) -> str:
+    """Leading part of an analysis, cut at a paragraph boundary when possible."""
+    text = text.strip()
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n\n", 0, limit)
+    return text[:cut if cut > limit // 2 else limit].rstrip() + "\n……"
+
+
+def collect_analyses(root: str) -> Dict[str, dict]:
+    """Map each directory under root holding analyzed files (directly or below) to its children.
+
+    Each value is {"files": [(name, excerpt)], "dirs": [child directory paths]}; directories
+    without any .ai sidecar below them are left out.
+    """
+    tree = {}
+    for path in iter_indexable_files(root):
+        try:
+            analysis = Path(path + ".ai").read_text(encoding="utf-8")
+        except (OSError, UnicodeDecodeError):
+            continue
+        if not analysis.strip():
+            continue
+        directory = os.path.dirname(path)
+        node = tree.setdefault(directory, {"files": [], "dirs": []})
+        node["files"].append((os.path.basename(path), excerpt(analysis)))
+        # 把目录链一直挂到根目录
+        while directory != root:
+            parent = os.path.dirname(directory)
+            parent_node = tree.get(parent)
+            if parent_node is None:
+                parent_node = tree[parent] = {"files": [], "dirs": []}
+            elif directory in parent_node["dirs"]:
+                break
+            parent_node["dirs"].append(directory)
+            directory = parent
+    for node in tree.values():
+        node["files"].sort()
+        node["dirs"].sort()
+    return tree
+
+
+class SummaryStore:
+    """按目录缓存的总结，记录生成时输入的指纹；多个worker进程共用"""
+
+    def __init__(self, db_path: Path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = connect_shared(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS directory_summaries (
+                path TEXT NOT NULL,
+                model TEXT NOT NULL,
+                parent TEXT,
+                fingerprint TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                files INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (path, model)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_parent ON directory_summaries(parent, model)")
+        self._conn.commit()
+
+    def _under(self, root: str, model: str, columns: str) -> list:
+        prefix = root.rstrip(os.sep) + os.sep
+        return self._conn.execute(
+            f"SELECT {columns} FROM directory_summaries "
+            "WHERE model = ? AND (path = ? OR substr(path, 1, ?) = ?)",
+            (model, root, len(prefix), prefix)
+        ).fetchall()
+
+    def fingerprints(self, root: str, model: str) -> Dict[str, Tuple[str, str]]:
+        """path -> (fingerprint, summary) of the cached directories under root."""
+        with self._lock:
+            rows = self._under(root, model, "path, fingerprint, summary")
+        return {path: (fingerprint, summary) for path, fingerprint, summary in rows}
+
+    def put_many(self, model: str, rows: List[Tuple[str, Optional[str], str, str, int]]):
+        """Store (path, parent, fingerprint, summary, files) rows of one build."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO directory_summaries "
+                "(path, model, parent, fingerprint, summary, files, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(path, model, parent, fingerprint, summary, files, now)
+                 for path, parent, fingerprint, summary, files in rows]
+            )
+            self._conn.commit()
+
+    def prune(self, root: str, model: str, keep: List[str]) -> int:
+        """Drop summaries of directories under root that no longer hold analyzed files."""
+        with self._lock:
+            keep = set(keep)
+            paths = [row[0] for row in self._under(root, model, "path")]
+            stale = [(path, model) for path in paths if path not in keep]
+            self._conn.executemany("DELETE FROM directory_summaries WHERE path = ? AND model = ?", stale)
+            self._conn.commit()
+        return len(stale)
+
+    def get(self, path: str, model: Optional[str] = None) -> Optional[dict]:
+        """Cached summary of a directory and of its direct subdirectories (latest model if none given)."""
+        columns = "path, model, summary, files, updated_at"
+        with self._lock:
+            if model is None:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM directory_summaries WHERE path = ? ORDER BY updated_at DESC LIMIT 1",
+                    (path,)
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM directory_summaries WHERE path = ? AND model = ?", (path, model)
+                ).fetchone()
+            if row is None:
+                return None
+            children = self._conn.execute(
+                f"SELECT {columns} FROM directory_summaries WHERE parent = ? AND model = ? ORDER BY path",
+                (path, row[1])
+            ).fetchall()
+
+        def record(r):
+            return {"path": r[0], "model": r[1], "summary": r[2], "files": r[3], "updated_at": r[4]}
+
+        return {**record(row), "children": [record(child) for child in children]}
+
+
+class RepoSummarizer:
+    """把各文件的 .ai 分析沿目录树逐层汇总成目录总结，最后得到整个项目的概览
+
+    Directories are summarized bottom-up, one depth level at a time with the directories of a
+    level running in parallel. A directory's input is the excerpts of its analyzed files plus
+    its subdirectories' summaries; a summary is reused while that input is unchanged, so after
+    a file changes only the directories on its path up to the root are summarized again.
+
+    `summarize(text, model, is_root)` makes one model call; `budget(model)` is the largest
+    prompt in tokens, larger inputs are summarized in groups first.
+    """
+
+    def __init__(self, store: SummaryStore, summarize: Callable[[str, str, bool], Awaitable[str]],
+                 budget: Callable[[str], int]):
+        self.store = store
+        self.summarize = summarize
+        self.budget = budget
+
+    async def build(self, root: str, model: str, concurrency: int = 4) -> dict:
+        started = time.monotonic()
+        root = os.path.abspath(root)
+        tree = await asyncio.to_thread(collect_analyses, root)
+        if not tree:
+            return {"path": root, "model": model, "summary": None, "files": 0, "directories": 0,
+                    "summarized": 0, "reused": 0, "llm_calls": 0, "seconds": 0.0}
+
+        cached = await asyncio.to_thread(self.store.fingerprints, root, model)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        budget = self.budget(model)
+        summaries: Dict[str, str] = {}
+        file_counts: Dict[str, int] = {}
+        stats = {"summarized": 0, "reused": 0, "llm_calls": 0}
+        rows = []
+
+        async def call(text: str, is_root: bool) -> str:
+            async with semaphore:
+                stats["llm_calls"] += 1
+                return await self.summarize(text, model, is_root)
+
+        async def summarize_directory(directory: str):
+            node = tree[directory]
+            is_root = directory == root
+            entries = list(node["files"])
+            entries += [(os.path.basename(child) + "/", summaries[child]) for child in node["dirs"]]
+            file_counts[directory] = len(node["files"]) + sum(file_counts[child] for child in node["dirs"])
+            fingerprint = hashlib.sha256(
+                json.dumps([SUMMARY_VERSION, model, is_root, entries], ensure_ascii=False).encode("utf-8")
+            ).hexdigest()
+            previous = cached.get(directory)
+            if previous is not None and previous[0] == fingerprint:
+                summaries[directory] = previous[1]
+                stats["reused"] += 1
+                return
+            if len(entries) == 1 and not is_root:
+                # 只有一个子项的目录（如 src/main/java）直接沿用子项的内容，不调用模型
+                summary = entries[0][1]
+            else:
+                summary = await self._summarize_entries(os.path.relpath(directory, os.path.dirname(root)),
+                                                        entries, is_root, budget, call)
+                stats["summarized"] += 1
+            summaries[directory] = summary
+            rows.append((directory, os.path.dirname(directory), fingerprint, summary, file_counts[directory]))
+
+        depth = lambda path: path.count(os.sep)
+        for level in sorted({depth(directory) for directory in tree}, reverse=True):
+            await asyncio.gather(*(summarize_directory(d) for d in tree if depth(d) == level))
+            # 每层完成后立即保存，中途失败或取消时已生成的总结下次可以复用
+            if rows:
+                await asyncio.to_thread(self.store.put_many, model, rows)
+                rows.clear()
+
+        await asyncio.to_thread(self.store.prune, root, model, list(tree))
+        seconds = round(time.monotonic() - started, 2)
+        logger.info(f"Repo summary of {root}: {len(tree)} directories, {stats['summarized']} summarized, "
+                    f"{stats['reused']} reused, {stats['llm_calls']} model calls in {seconds}s")
+        return {"path": root, "model": model, "summary": summaries[root], "files": file_counts[root],
+                "directories": len(tree), **stats, "seconds": seconds}
+
+    async def _summarize_entries(self, name: str, entries: List[Tuple[str, str]], is_root: bool,
+                                 budget: int, call) -> str:
+        sections = [f"### {title}\n{body}" for title, body in entries]
+        # 一次调用放不下时先分组总结，再总结各组的结果
+        while len(sections) > 1 and estimate_tokens("\n\n".join(sections)) > budget:
+            groups, group, group_tokens = [], [], 0
+            for section in sections:
+                tokens = estimate_tokens(section)
+                if group and group_tokens + tokens > budget:
+                    groups.append(group)
+                    group, group_tokens = [], 0
+                group.append(section)
+                group_tokens += tokens
+            groups.append(group)
+            if len(groups) == len(sections):
+                break
+            partial = await asyncio.gather(*(
+                call(f"目录：{name}（部分内容）\n\n" + "\n\n".join(g), False) for g in groups
+            ))
+            sections = [f"### 第 {i + 1} 组\n{summary}" for i, summary in enumerate(partial)]
+        return await call(f"目录：{name}\n\n" + "\n\n".join(sections), is_root)
@@ -0,0 +1,316 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List
+
+from file_content import is_binary_file
+from file_index import FileIndex
+
+logger = logging.getLogger(__name__)
+
+MAX_INDEXED_FILE_BYTES = 1024 * 1024
+MAX_LINES_PER_FILE = 5
+
+# 各语言的函数/类定义，按行匹配
+SYMBOL_PATTERNS = [
+    ("function", re.compile(r"^\s*(?:async\s+)?def\s+([A-Za-z_]\w*)")),
+    ("class", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)")),
+    ("function", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)")),
+    ("function", re.compile(r"^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*=\s*(?:async\s*)?(?:function\b|\([^)]*\)\s*=>|[A-Za-z_$][\w$]*\s*=>)")),
+    ("function", re.compile(r"^func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)")),
+    ("type", re.compile(r"^type\s+([A-Za-z_]\w*)\s+(?:struct|interface)\b")),
+    ("function", re.compile(r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?fn\s+([A-Za-z_]\w*)")),
+    ("type", re.compile(r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait)\s+([A-Za-z_]\w*)")),
+]
+
+
+def extract_definitions(text: str) -> List[tuple]:
+    """Return (name, kind, line) for every definition found in text (line is 1-based)."""
+    definitions = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        if len(line) > 500:
+            continue
+        for kind, pattern in SYMBOL_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                definitions.append((match.group(1), kind, line_no))
+                break
+    return definitions
+
+
+# 服务端写在源文件旁边的分析文件（.ai 分析、.ai.json 符号记录及其临时文件），不当作代码索引
+SIDECAR_SUFFIXES = (".ai", ".ai.json", ".ai.json.tmp")
+
+
+def is_sidecar(path: str) -> bool:
+    return path.endswith(SIDECAR_SUFFIXES)
+
+
+def is_indexable_path(path: str, index: FileIndex) -> bool:
+    """The filter iter_indexable_files applies, for a single file under index.root."""
+    return not is_sidecar(path) and not index.is_path_ignored(path, False)
+
+
+def like_prefix(prefix: str) -> str:
+    """LIKE pattern (with ESCAPE '\\') matching strings that start with prefix."""
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def iter_indexable_files(root: str) -> Iterable[str]:
+    """Walk a root through FileIndex so .gitignore'd paths are skipped."""
+    index = FileIndex(root)
+    stack = [index.root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = index.list_dir(directory, include_ignored=False)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry["isDirectory"]:
+                stack.append(entry["path"])
+            elif not is_sidecar(entry["name"]):
+                yield entry["path"]
+
+
+class SearchIndex:
+    """基于SQLite FTS5(trigram)的全文索引和符号表，在后台线程中增量更新"""
+
+    def __init__(self, db_path: Path, roots_provider: Callable[[], List[str]], refresh_interval: float = 60.0):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.roots_provider = roots_provider
+        self.refresh_interval = refresh_interval
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending_paths = set()
+        self._pending_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self._local = threading.local()
+        self.indexing = False
+        self.last_refresh = None
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                root TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_root ON files(root);
+            CREATE VIRTUAL TABLE IF NOT EXISTS contents USING fts5(path UNINDEXED, body, tokenize='trigram');
+            CREATE TABLE IF NOT EXISTS symbols (
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                path TEXT NOT NULL,
+                line INTEGER NOT NULL,
+                root TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_symbols_name ON symbols(name COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_symbols_path ON symbols(path);
+            """
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets queries run while the indexer writes."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- indexing ----
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="search-indexer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def request_refresh(self, paths: Iterable[str] = None):
+        """Ask the background worker to re-index some paths, or every root when paths is None."""
+        if paths is not None:
+            with self._pending_lock:
+                self._pending_paths.update(os.path.abspath(p) for p in paths)
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped:
+            with self._pending_lock:
+                pending, self._pending_paths = self._pending_paths, set()
+            try:
+                if pending:
+                    self.update_paths(pending)
+                else:
+                    self.refresh_all()
+            except Exception as e:
+                logger.error(f"Search indexer error: {e}", exc_info=True)
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+    def refresh_all(self):
+        self.indexing = True
+        try:
+            roots = [os.path.abspath(r) for r in self.roots_provider() if os.path.isdir(r)]
+            for root in roots:
+                self.refresh_root(root)
+            self._drop_stale_roots(roots)
+            self.last_refresh = time.time()
+        finally:
+            self.indexing = False
+
+    def refresh_root(self, root: str):
+        """Re-index files whose mtime or size changed and drop files that disappeared."""
+        start = time.monotonic()
+        conn = self._conn()
+        known = {path: (mtime, size) for path, mtime, size in
+                 conn.execute("SELECT path, mtime_ns, size FROM files WHERE root = ?", (root,))}
+        seen = set()
+        changed = 0
+        for path in iter_indexable_files(root):
+            seen.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            self._index_file(conn, root, path, stat)
+            changed += 1
+            if changed % 200 == 0:
+                conn.commit()
+        removed = [path for path in known if path not in seen]
+        for path in removed:
+            self._remove_file(conn, path)
+        conn.commit()
+        if changed or removed:
+            logger.info(f"Search index for {root}: {changed} updated, {len(removed)} removed "
+                        f"in {time.monotonic() - start:.2f}s")
+
+    def update_paths(self, paths: Iterable[str]):
+        """Re-index individual files (or remove them if they no longer exist or are no longer indexable)."""
+        roots = [os.path.abspath(r) for r in self.roots_provider()]
+        conn = self._conn()
+        indexes = {}
+        for path in paths:
+            root = max((r for r in roots if path.startswith(r + os.sep)), key=len, default=None)
+            if root is None:
+                continue
+            if os.path.isfile(path):
+                # 和完整扫描使用同一个过滤条件，否则两者会来回添加、删除同一个文件
+                if root not in indexes:
+                    indexes[root] = FileIndex(root)
+                if is_indexable_path(path, indexes[root]):
+                    self._index_file(conn, root, path, os.stat(path))
+                else:
+                    self._remove_file(conn, path)
+            elif os.path.isdir(path):
+                self.refresh_root(root)
+            else:
+                # 删除的可能是整个目录
+                prefix = path + os.sep
+                under = [p for (p,) in conn.execute("SELECT path FROM files WHERE root = ? AND substr(path, 1, ?) = ?",
+                                                    (root, len(prefix), prefix))]
+                for removed in [path] + under:
+                    self._remove_file(conn, removed)
+        conn.commit()
+
+    def _index_file(self, conn, root: str, path: str, stat: os.stat_result):
+        body = ""
+        if stat.st_size <= MAX_INDEXED_FILE_BYTES:
+            try:
+                if not is_binary_file(path):
+                    with open(path, "r", encoding="utf-8", errors="replace") as f:
+                        body = f.read()
+            except OSError:
+                return
+        with self._write_lock:
+            conn.execute("DELETE FROM contents WHERE path = ?", (path,))
+            conn.execute("DELETE FROM symbols WHERE path = ?", (path,))
+            conn.execute("INSERT OR REPLACE INTO files (path, root, mtime_ns, size) VALUES (?, ?, ?, ?)",
+                         (path, root, stat.st_mtime_ns, stat.st_size))
+            if body:
+                conn.execute("INSERT INTO contents (path, body) VALUES (?, ?)", (path, body))
+                conn.executemany(
+                    "INSERT INTO symbols (name, kind, path, line, root) VALUES (?, ?, ?, ?, ?)",
+                    [(name, kind, path, line, root) for name, kind, line in extract_definitions(body)]
+                )
+
+    def _remove_file(self, conn, path: str):
+        with self._write_lock:
+            conn.execute("DELETE FROM contents WHERE path = ?", (path,))
+            conn.execute("DELETE FROM symbols WHERE path = ?", (path,))
+            conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _drop_stale_roots(self, roots: List[str]):
+        conn = self._conn()
+        stale = [r for (r,) in conn.execute("SELECT DISTINCT root FROM files") if r not in roots]
+        for root in stale:
+            paths = [p for (p,) in conn.execute("SELECT path FROM files WHERE root = ?", (root,))]
+            for path in paths:
+                self._remove_file(conn, path)
+        conn.commit()
+
+    # ---- queries ----
+
+    def search_symbols(self, query: str, root: str = None, limit: int = 50) -> List[dict]:
+        sql = "SELECT name, kind, path, line FROM symbols WHERE name LIKE ? ESCAPE '\\'"
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params = [f"%{escaped}%"]
+        if root:
+            # 和 search_text 一样按路径前缀过滤，root 可以是已索引根目录下的子目录
+            sql += " AND path LIKE ? ESCAPE '\\'"
+            params.append(like_prefix(os.path.abspath(root).rstrip(os.sep) + os.sep))
+        # 完全匹配排在前面，其次是前缀匹配
+        sql += " ORDER BY (name = ?) DESC, (name LIKE ? ESCAPE '\\') DESC, length(name) LIMIT ?"
+        params += [query, f"{escaped}%", limit]
+        return [{"name": n, "kind": k, "path": p, "line": l} for n, k, p, l in self._conn().execute(sql, params)]
+
+    def search_text(self, query: str, root: str = None, limit: int = 50) -> List[dict]:
+        """Substring search; trigram FTS narrows candidate files, then matching lines are extracted."""
+        if len(query) >= 3:
+            phrase = '"' + query.replace('"', '""') + '"'
+            sql = "SELECT path, body FROM contents WHERE contents MATCH ?"
+            params = [phrase]
+        else:
+            # trigram 索引无法处理少于3个字符的查询，退化为 LIKE 扫描
+            sql = "SELECT path, body FROM contents WHERE body LIKE ? ESCAPE '\\'"
+            params = ["%" + like_prefix(query)]
+        if root:
+            sql += " AND path LIKE ? ESCAPE '\\'"
+            params.append(like_prefix(os.path.abspath(root).rstrip(os.sep) + os.sep))
+        sql += " LIMIT ?"
+        params.append(limit)
+
+        results = []
+        needle = query.lower()
+        for path, body in self._conn().execute(sql, params):
+            matches = []
+            for line_no, line in enumerate(body.splitlines(), 1):
+                if needle in line.lower():
+                    matches.append({"line": line_no, "text": line.strip()[:200]})
+                    if len(matches) >= MAX_LINES_PER_FILE:
+                        break
+            if matches:
+                results.append({"path": path, "matches": matches})
+        return results
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        files = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        symbols = conn.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+        roots = [r for (r,) in conn.execute("SELECT DISTINCT root FROM files")]
+        return {"files": files, "symbols": symbols, "roots": roots,
+                "indexing": self.indexing, "last_refresh": self.last_refresh}
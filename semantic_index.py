@@ -0,0 +1,410 @@
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Iterable, List
+
+import numpy as np
+
+from chunking import split_code
+from file_content import is_binary_file
+from search_index import is_sidecar, iter_indexable_files
+from shared_state import connect_shared
+
+logger = logging.getLogger(__name__)
+
+# 语义检索的切块大小比分析时小得多，检索结果能定位到具体函数
+EMBED_CHUNK_TOKENS = 400
+MAX_EMBEDDED_FILE_BYTES = 512 * 1024
+EMBED_BATCH_SIZE = 64
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9]*|[\u4e00-\u9fff]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_STOPWORDS = {
+    "the", "a", "an", "is", "are", "was", "of", "to", "in", "and", "or", "for", "on", "at", "by",
+    "where", "what", "how", "which", "who", "does", "do", "it", "this", "that", "with", "be",
+    "self", "return", "def", "import", "from", "if", "else", "none", "true", "false",
+}
+
+
+def _words(text: str) -> List[str]:
+    words = []
+    for token in _WORD_RE.findall(text):
+        if token[0] >= "\u4e00":
+            # 中文按双字切分
+            words.extend(token[i:i + 2] for i in range(max(1, len(token) - 1)))
+            continue
+        for part in _CAMEL_RE.findall(token):
+            part = part.lower()
+            if len(part) > 1 and part not in _STOPWORDS:
+                words.append(part)
+    return words
+
+
+class HashingEmbedder:
+    """纯CPU的本地向量化：标识符拆词 + 字符三元组的特征哈希，不需要下载模型
+
+    It captures lexical and sub-word overlap (retry ~ retries ~ max_retries), not deep semantics;
+    configure a provider embedder for model-based vectors.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _add(self, vector: np.ndarray, feature: str, weight: float):
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % self.dim] += weight if (h >> 31) & 1 else -weight
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        counts = {}
+        for word in _words(text):
+            counts[word] = counts.get(word, 0) + 1
+        for word, count in counts.items():
+            weight = 1.0 + math.log(count)
+            self._add(vector, "w:" + word, weight)
+            padded = f"^{word}$"
+            for i in range(len(padded) - 2):
+                self._add(vector, "t:" + padded[i:i + 3], 0.3 * weight)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.embed_one(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+
+class OpenAIEmbedder:
+    """通过OpenAI兼容的 /embeddings 接口向量化（使用同步客户端，在索引线程中调用）"""
+
+    def __init__(self, client, model: str, dim: int):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = f"openai-{model}-{dim}".replace("/", "_")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), np.float32)
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorStore:
+    """内存映射的float32向量矩阵，按行追加，容量不够时翻倍扩展"""
+
+    def __init__(self, path: Path, dim: int, initial_capacity: int = 4096):
+        self.path = Path(path)
+        self.dim = dim
+        if not self.path.exists():
+            with open(self.path, "wb") as f:
+                f.truncate(initial_capacity * dim * 4)
+        self._open()
+
+    def _open(self):
+        capacity = os.path.getsize(self.path) // (self.dim * 4)
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    @property
+    def capacity(self) -> int:
+        return self.vectors.shape[0]
+
+    def ensure_capacity(self, rows: int):
+        if rows <= self.capacity:
+            return
+        new_capacity = self.capacity
+        while new_capacity < rows:
+            new_capacity *= 2
+        self.vectors.flush()
+        del self.vectors
+        with open(self.path, "r+b") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._open()
+
+    def write(self, start: int, vectors: np.ndarray):
+        self.ensure_capacity(start + len(vectors))
+        self.vectors[start:start + len(vectors)] = vectors
+
+    def flush(self):
+        self.vectors.flush()
+
+
+class SemanticIndex:
+    """代码块和 .ai 分析的向量索引：SQLite记录元数据，向量存在 memmap 中，暴力 top-k 检索"""
+
+    def __init__(self, index_dir: Path, embedder, roots_provider: Callable[[], List[str]],
+                 refresh_interval: float = 120.0):
+        self.embedder = embedder
+        self.index_dir = Path(index_dir) / embedder.name
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.roots_provider = roots_provider
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._pending_paths = set()
+        self._thread = None
+        self.indexing = False
+        self.last_refresh = None
+
+        self._conn = connect_shared(self.index_dir / "meta.db")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                root TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                file TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                start_line INTEGER NOT NULL,
+                end_line INTEGER NOT NULL,
+                preview TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source);
+            """
+        )
+        self._conn.commit()
+        self.store = VectorStore(self.index_dir / "vectors.f32", embedder.dim)
+        self._load_rows()
+
+    def _load_rows(self):
+        rows = [r for (r,) in self._conn.execute("SELECT row FROM chunks")]
+        self._next_row = max(rows) + 1 if rows else 0
+        self._active = np.zeros(self.store.capacity, dtype=bool)
+        self._active[rows] = True
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync(self):
+        """Reload row metadata if another process (the worker running the indexer) changed the index."""
+        if self._conn.execute("PRAGMA data_version").fetchone()[0] == self._data_version:
+            return
+        if os.path.getsize(self.store.path) != self.store.capacity * self.store.dim * 4:
+            self.store._open()
+        self._load_rows()
+
+    # ---- indexing ----
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="semantic-indexer", daemon=True)
+            self._thread.start()
+
+    def request_refresh(self, paths: Iterable[str] = None):
+        if paths is not None:
+            with self._lock:
+                self._pending_paths.update(os.path.abspath(p) for p in paths)
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                pending, self._pending_paths = self._pending_paths, set()
+            try:
+                if pending:
+                    self.update_paths(pending)
+                else:
+                    self.refresh_all()
+            except Exception as e:
+                logger.error(f"Semantic indexer error: {e}", exc_info=True)
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+    def refresh_all(self):
+        self.indexing = True
+        try:
+            for root in self.roots_provider():
+                if os.path.isdir(root):
+                    self.refresh_root(os.path.abspath(root))
+            self.last_refresh = time.time()
+        finally:
+            self.indexing = False
+
+    def _sources_for(self, path: str) -> List[str]:
+        """A code file is indexed together with its .ai sidecar, if any."""
+        sources = [path]
+        if os.path.exists(path + ".ai"):
+            sources.append(path + ".ai")
+        return sources
+
+    def refresh_root(self, root: str):
+        with self._lock:
+            known = {p: (m, s) for p, m, s in
+                     self._conn.execute("SELECT path, mtime_ns, size FROM sources WHERE root = ?", (root,))}
+        seen = set()
+        updated = 0
+        for path in iter_indexable_files(root):
+            for source in self._sources_for(path):
+                seen.add(source)
+                try:
+                    stat = os.stat(source)
+                except OSError:
+                    continue
+                if known.get(source) != (stat.st_mtime_ns, stat.st_size):
+                    self._index_source(root, source, path, stat)
+                    updated += 1
+        removed = [p for p in known if p not in seen]
+        with self._lock:
+            for source in removed:
+                self._remove_source(source)
+            self._conn.commit()
+            self.store.flush()
+        if updated or removed:
+            logger.info(f"Semantic index for {root}: {updated} updated, {len(removed)} removed")
+        # 删除的行超过三成时压缩向量文件
+        if self._next_row and self._active[:self._next_row].sum() < 0.7 * self._next_row:
+            self.compact()
+
+    def update_paths(self, paths: Iterable[str]):
+        roots = [os.path.abspath(r) for r in self.roots_provider()]
+        for path in paths:
+            if is_sidecar(path) and not path.endswith(".ai"):
+                # .ai.json 是增量分析的记录，不是代码
+                continue
+            file_path = path[:-3] if path.endswith(".ai") else path
+            root = max((r for r in roots if file_path.startswith(r + os.sep)), key=len, default=None)
+            if root is None:
+                continue
+            if os.path.isdir(path):
+                self.refresh_root(root)
+                continue
+            for source in {file_path, file_path + ".ai"}:
+                if os.path.isfile(source):
+                    self._index_source(root, source, file_path, os.stat(source))
+                else:
+                    self._remove_source(source)
+            if not os.path.exists(path):
+                # 删除的可能是整个目录
+                for source in self._sources_under(path):
+                    self._remove_source(source)
+        with self._lock:
+            self._conn.commit()
+            self.store.flush()
+
+    def _chunk_source(self, source: str, file_path: str):
+        if os.path.getsize(source) > MAX_EMBEDDED_FILE_BYTES or is_binary_file(source):
+            return []
+        with open(source, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        kind = "analysis" if source.endswith(".ai") else "code"
+        # 分析文档按Markdown处理，走行窗口切分
+        chunks = split_code(text, EMBED_CHUNK_TOKENS, source if kind == "analysis" else file_path)
+        return [(kind, c) for c in chunks if c.text.strip()]
+
+    def _index_source(self, root: str, source: str, file_path: str, stat: os.stat_result):
+        try:
+            chunks = self._chunk_source(source, file_path)
+        except OSError:
+            return
+        # 向量化可能较慢（远程provider），放在锁外
+        vectors = []
+        for i in range(0, len(chunks), EMBED_BATCH_SIZE):
+            batch = chunks[i:i + EMBED_BATCH_SIZE]
+            vectors.append(self.embedder.embed([f"{file_path}\n{c.text}" for _, c in batch]))
+        with self._lock:
+            self._remove_source(source)
+            if chunks:
+                start = self._next_row
+                self.store.write(start, np.concatenate(vectors))
+                self._next_row += len(chunks)
+                if self._active.shape[0] < self.store.capacity:
+                    self._active = np.concatenate([self._active, np.zeros(self.store.capacity - self._active.shape[0], bool)])
+                self._active[start:start + len(chunks)] = True
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, source, file, kind, start_line, end_line, preview) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(start + i, source, file_path, kind, c.start_line, c.end_line, c.text.strip()[:300])
+                     for i, (kind, c) in enumerate(chunks)]
+                )
+            self._conn.execute("INSERT OR REPLACE INTO sources (path, root, mtime_ns, size) VALUES (?, ?, ?, ?)",
+                               (source, root, stat.st_mtime_ns, stat.st_size))
+
+    def _sources_under(self, directory: str) -> List[str]:
+        prefix = directory + os.sep
+        with self._lock:
+            return [p for (p,) in self._conn.execute("SELECT path FROM sources WHERE substr(path, 1, ?) = ?",
+                                                     (len(prefix), prefix))]
+
+    def _remove_source(self, source: str):
+        with self._lock:
+            rows = [r for (r,) in self._conn.execute("SELECT row FROM chunks WHERE source = ?", (source,))]
+            if rows:
+                self._active[rows] = False
+                self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM sources WHERE path = ?", (source,))
+
+    def compact(self):
+        """Rewrite the vector file without rows of deleted chunks."""
+        with self._lock:
+            rows = [r for (r,) in self._conn.execute("SELECT row FROM chunks ORDER BY row")]
+            vectors = np.array(self.store.vectors[rows]) if rows else np.zeros((0, self.embedder.dim), np.float32)
+            self._conn.executemany("UPDATE chunks SET row = ? WHERE row = ?",
+                                   [(-(i + 1), r) for i, r in enumerate(rows)])
+            self._conn.execute("UPDATE chunks SET row = -row - 1")
+            self._conn.commit()
+            self.store.write(0, vectors)
+            self.store.flush()
+            self._next_row = len(rows)
+            self._active[:] = False
+            self._active[:len(rows)] = True
+
+    # ---- queries ----
+
+    def search(self, query: str, k: int = 10, root: str = None, kind: str = None) -> List[dict]:
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            self._sync()
+            n = self._next_row
+            if n == 0:
+                return []
+            scores = np.asarray(self.store.vectors[:n]) @ query_vector
+            if root or kind:
+                # 先按root/kind选出行，再在其中取top-k
+                allowed = np.zeros(n, dtype=bool)
+                allowed[self._rows_matching(root, kind, n)] = True
+                scores[~(allowed & self._active[:n])] = -np.inf
+            else:
+                scores[~self._active[:n]] = -np.inf
+            candidates = min(n, k)
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+            top = top[np.argsort(-scores[top])]
+            results = []
+            for row in top:
+                if not np.isfinite(scores[row]):
+                    break
+                meta = self._conn.execute(
+                    "SELECT file, kind, start_line, end_line, preview FROM chunks WHERE row = ?", (int(row),)
+                ).fetchone()
+                if meta is None:
+                    continue
+                results.append({"path": meta[0], "kind": meta[1], "start_line": meta[2], "end_line": meta[3],
+                                "preview": meta[4], "score": round(float(scores[row]), 4)})
+                if len(results) >= k:
+                    break
+            return results
+
+    def _rows_matching(self, root: str, kind: str, n: int) -> List[int]:
+        conditions, params = ["row < ?"], [n]
+        if root:
+            prefix = os.path.abspath(root) + os.sep
+            conditions.append("substr(file, 1, ?) = ?")
+            params += [len(prefix), prefix]
+        if kind:
+            conditions.append("kind = ?")
+            params.append(kind)
+        return [r for (r,) in self._conn.execute(f"SELECT row FROM chunks WHERE {' AND '.join(conditions)}", params)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._sync()
+            chunks = int(self._active[:self._next_row].sum())
+            return {"embedder": self.embedder.name, "chunks": chunks, "rows": self._next_row,
+                    "capacity": self.store.capacity, "indexing": self.indexing, "last_refresh": self.last_refresh}
@@ -1,24 +1,56 @@
 import os
 import json
+import asyncio
+import inspect
 import logging
-import subprocess
+import math
+import mimetypes
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.parse import urlparse
 from pathlib import Path
-from typing import List
-from openai import OpenAI
-from fastapi import FastAPI, HTTPException
+from typing import List, Optional
+from openai import AsyncOpenAI, OpenAI
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from pydantic import BaseModel
 from zhipuai import ZhipuAI
 import sys
 import threading
-from utools_model import do_request
+from utools_model import AsyncUToolsClient, SYSTEM_PROMPT as UTOOLS_SYSTEM_PROMPT
+from analysis_cache import AnalysisCache, make_cache_key
+from single_flight import SingleFlight
+from analysis_jobs import AnalysisJobManager, acquire_rate_limit
+from chunking import CHUNK_TARGET_TOKENS, chunk_budget, estimate_tokens, needs_chunking, reduce_until_fits, split_code
+from incremental_analysis import analyze_incrementally, has_symbol_record
+from file_content import (read_content_window, parse_range_header, iter_file_range, is_binary_file,
+                          LARGE_FILE_BYTES, DEFAULT_PAGE_LINES)
+from file_index import FileIndexManager
+from search_index import SearchIndex, is_sidecar
+from git_clone import DEFAULT_DEPTH, GitCloneManager
+from history_store import HistoryStore, SharedHistoryStore
+from shared_state import ChangeFeed, ProcessLock, RefreshQueue, WorkerSnapshots
+from provider_router import ProviderRouter, error_status
+from prompt_reduction import reduce_prompt, REDUCTION_LEVELS
+from metrics import Metrics, report_usage, unpriced_models
+from tracing import Tracer, TracingMiddleware, TracedJSONResponse, instrument_logging, span, traced_iter
+from semantic_index import SemanticIndex, HashingEmbedder, OpenAIEmbedder
+from fs_watcher import FileWatcher
+from repo_summary import RepoSummarizer, SummaryStore
+from render_cache import (RenderCache, RENDER_VERSION, render_file, render_markdown, can_render_markdown, has_lexer,
+                          init_render_worker)
+from http_cache import (CompressionMiddleware, is_fresh, json_response, not_modified, stat_etag, stat_version,
+                        validator_headers)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# 开启请求追踪时统计每个请求花在日志输出上的时间
+instrument_logging()
 
 # Read API keys from JSON file
 def load_api_keys():
@@ -66,7 +98,7 @@ except Exception as e:
     PPINFRA_API_KEY = ""
     MODELSCOPE_API_KEY = ""
 
-app = FastAPI()
+app = FastAPI(default_response_class=TracedJSONResponse)
 
 # Get the application's base directory
 if getattr(sys, 'frozen', False):
@@ -89,12 +121,90 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 大的JSON/文本响应按 Accept-Encoding 用 brotli（已安装时）或 gzip 压缩
+app.add_middleware(CompressionMiddleware)
+
+# worker进程数（start_app.py --workers 或 CODE_VIEW_WORKERS），多进程时各进程平分下面的服务商配额
+WORKER_COUNT = max(1, int(os.environ.get("CODE_VIEW_WORKERS", "1")))
+
+# 请求追踪，默认关闭：CODE_VIEW_TRACING=1 或 POST /api/debug/tracing 开启
+# 慢请求和profile只保存在处理请求的进程里，所以只在单进程模式下可用
+tracer = Tracer(
+    enabled=os.environ.get("CODE_VIEW_TRACING", "0") == "1" and WORKER_COUNT == 1,
+    slow_ms=float(os.environ.get("CODE_VIEW_SLOW_MS", "500"))
+)
+if WORKER_COUNT > 1 and os.environ.get("CODE_VIEW_TRACING", "0") == "1":
+    logger.warning("CODE_VIEW_TRACING is ignored with multiple workers, run a single worker to trace requests")
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
+# 每个provider同时进行的分析请求上限，可通过环境变量 CODE_VIEW_<PROVIDER>_CONCURRENCY 覆盖
+PROVIDER_CONCURRENCY = {
+    "zhipu": 4,
+    "novita": 8,
+    "ppinfra": 8,
+    "modelscope": 4,
+    "utools": 4,
+}
+for _provider in PROVIDER_CONCURRENCY:
+    _env_value = os.environ.get(f"CODE_VIEW_{_provider.upper()}_CONCURRENCY")
+    if _env_value:
+        PROVIDER_CONCURRENCY[_provider] = max(1, int(_env_value))
+    PROVIDER_CONCURRENCY[_provider] = math.ceil(PROVIDER_CONCURRENCY[_provider] / WORKER_COUNT)
+
+_provider_semaphores = {}
+
+def get_provider_semaphore(provider: str) -> asyncio.Semaphore:
+    """Get the semaphore limiting concurrent calls to a provider."""
+    if provider not in _provider_semaphores:
+        _provider_semaphores[provider] = asyncio.Semaphore(PROVIDER_CONCURRENCY.get(provider, 4))
+    return _provider_semaphores[provider]
+
+# 同步SDK（智谱）的调用放到有界线程池里执行，避免阻塞事件循环
+llm_executor = ThreadPoolExecutor(
+    max_workers=PROVIDER_CONCURRENCY["zhipu"],
+    thread_name_prefix="llm"
+)
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking provider call in the LLM thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(llm_executor, lambda: func(*args, **kwargs))
+
+# 被替换的客户端等这么久（覆盖请求超时）再关闭，让仍在使用它的请求先完成
+CLIENT_CLOSE_DELAY_SECONDS = 200
+closing_clients = set()
+
+async def close_client_later(client):
+    await asyncio.sleep(CLIENT_CLOSE_DELAY_SECONDS)
+    try:
+        # AsyncUToolsClient.aclose / AsyncOpenAI.close 是协程，ZhipuAI.close 是普通方法
+        close = getattr(client, "aclose", None) or getattr(client, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+    except Exception as e:
+        logger.warning(f"Error closing replaced client {type(client).__name__}: {e}")
+
+def close_replaced_client(client):
+    """Close a client dropped by AIClientSingleton once in-flight requests had time to finish."""
+    if client is None:
+        return
+    try:
+        task = asyncio.get_running_loop().create_task(close_client_later(client))
+    except RuntimeError:
+        # 不在事件循环中（如关闭时）：交给垃圾回收
+        return
+    closing_clients.add(task)
+    task.add_done_callback(closing_clients.discard)
+
 class AIClientSingleton:
     """AI客户端单例模式管理类"""
     _zhipu_instance = None
     _novita_instance = None
     _ppinfra_instance = None
     _modelscope_instance = None
+    _utools_instance = None
     _lock = threading.Lock()
 
     @classmethod
@@ -108,123 +218,281 @@ class AIClientSingleton:
         return cls._zhipu_instance
 
     @classmethod
-    def get_novita_client(cls) -> OpenAI:
-        """获取Novita客户端单例"""
+    def get_novita_client(cls) -> AsyncOpenAI:
+        """获取Novita异步客户端单例"""
         if cls._novita_instance is None:
             with cls._lock:
                 if cls._novita_instance is None:
                     logger.info("Creating new Novita client instance")
-                    cls._novita_instance = OpenAI(
+                    cls._novita_instance = AsyncOpenAI(
                         base_url="https://api.novita.ai/v3/openai",
                         api_key=NOVITA_API_KEY
                     )
         return cls._novita_instance
 
     @classmethod
-    def get_ppinfra_client(cls) -> OpenAI:
-        """获取PPInfra客户端单例"""
+    def get_ppinfra_client(cls) -> AsyncOpenAI:
+        """获取PPInfra异步客户端单例"""
         if cls._ppinfra_instance is None:
             with cls._lock:
                 if cls._ppinfra_instance is None:
                     logger.info("Creating new PPInfra client instance")
-                    cls._ppinfra_instance = OpenAI(
+                    cls._ppinfra_instance = AsyncOpenAI(
                         base_url="https://api.ppinfra.com/v3/openai",
                         api_key=PPINFRA_API_KEY
                     )
         return cls._ppinfra_instance
 
     @classmethod
-    def get_modelscope_client(cls) -> OpenAI:
-        """获取ModelScope客户端单例"""
+    def get_modelscope_client(cls) -> AsyncOpenAI:
+        """获取ModelScope异步客户端单例"""
         if cls._modelscope_instance is None:
             with cls._lock:
                 if cls._modelscope_instance is None:
                     logger.info("Creating new ModelScope client instance")
-                    cls._modelscope_instance = OpenAI(
+                    cls._modelscope_instance = AsyncOpenAI(
                         api_key=MODELSCOPE_API_KEY,
                         base_url="https://api-inference.modelscope.cn/v1/"
                     )
         return cls._modelscope_instance
 
+    @classmethod
+    def get_utools_client(cls) -> AsyncUToolsClient:
+        """获取uTools异步客户端单例（keep-alive连接池）"""
+        if cls._utools_instance is None:
+            with cls._lock:
+                if cls._utools_instance is None:
+                    logger.info("Creating new uTools client instance")
+                    cls._utools_instance = AsyncUToolsClient(pool_size=PROVIDER_CONCURRENCY["utools"])
+        return cls._utools_instance
+
+    @classmethod
+    def reset_client(cls, provider: str):
+        """只重置出错的那个服务商的客户端"""
+        attribute = f"_{provider}_instance"
+        if hasattr(cls, attribute):
+            with cls._lock:
+                old = getattr(cls, attribute)
+                setattr(cls, attribute, None)
+            close_replaced_client(old)
+            logger.info(f"Reset {provider} client instance")
+
     @classmethod
     def reset_clients(cls):
         """重置客户端实例（在需要重新创建时使用）"""
         with cls._lock:
+            old = [cls._zhipu_instance, cls._novita_instance, cls._ppinfra_instance,
+                   cls._modelscope_instance, cls._utools_instance]
             cls._zhipu_instance = None
             cls._novita_instance = None
             cls._ppinfra_instance = None
             cls._modelscope_instance = None
+            cls._utools_instance = None
             cls._mota_instance = None
             logger.info("Reset all AI client instances")
+        for client in old:
+            close_replaced_client(client)
+
+DETAIL_SYSTEM_PROMPT = "You are a benevolent programming expert, adept at deciphering code from the perspective of a beginner. The emphasis is on elucidating the functionality and operational mechanisms of the code in accessible and understandable language. Please start by summarizing the overall function of the code, then provide functional annotations for the provided code to help beginners quickly grasp the project and get started. For each function, it is imperative to elucidate its purpose, detailing what it takes as input, what it outputs, and the specific functionality it accomplishes.The explanations should be given in Chinese."
+SIMPLE_SYSTEM_PROMPT = "请简要分析代码的主要功能和结构，用中文给出简洁的解释，仅给出代码的功能解释。"
+
+def get_system_content(analytype: str) -> str:
+    """根据分析类型选择不同的 system_content"""
+    if analytype == "simple":
+        logger.info("使用简单分析模式")
+        return SIMPLE_SYSTEM_PROMPT
+    logger.info("使用详细分析模式")
+    return DETAIL_SYSTEM_PROMPT
+
+def get_openai_compatible_client(client_type: str) -> AsyncOpenAI:
+    """Get the async client for an OpenAI compatible provider."""
+    if client_type == "novita":
+        return AIClientSingleton.get_novita_client()
+    elif client_type == "ppinfra":
+        return AIClientSingleton.get_ppinfra_client()
+    elif client_type == "modelscope":
+        return AIClientSingleton.get_modelscope_client()
+    raise ValueError(f"Unknown client type: {client_type}")
 
-async def analyze_with_zhipu(code: str) -> str:
+async def iterate_blocking(gen_func, *args, **kwargs):
+    """Consume a blocking generator in the LLM thread pool as an async generator."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def worker():
+        try:
+            for item in gen_func(*args, **kwargs):
+                loop.call_soon_threadsafe(queue.put_nowait, (None, item))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (e, None))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, (None, done))
+
+    loop.run_in_executor(llm_executor, worker)
+    while True:
+        error, item = await queue.get()
+        if error is not None:
+            raise error
+        if item is done:
+            break
+        yield item
+
+async def analyze_with_zhipu(code: str, system_content: str = None) -> str:
     """使用智谱AI分析代码"""
     try:
+        client = AIClientSingleton.get_zhipu_client()
+        async with get_provider_semaphore("zhipu"):
+            response = await run_blocking(
+                client.chat.completions.create,
+                timeout=200,
+                model="GLM-4-Flash",  # free
+                # model="glm-4-plus",  # 0.05 元 / 千tokens
+                messages=[
+                    {"role": "system", "content": system_content or DETAIL_SYSTEM_PROMPT},
+                    {"role": "user", "content": code}
+                ]
+            )
+        report_usage(response.usage)
+        return response.choices[0].message.content
+    except Exception as e:
+        logger.error(f"Error with Zhipu AI: {str(e)}")
+        raise
+
+async def stream_with_zhipu(code: str, system_content: str = None):
+    """使用智谱AI流式分析代码，逐段返回增量文本"""
+    usage = []
+
+    def zhipu_deltas():
         client = AIClientSingleton.get_zhipu_client()
         response = client.chat.completions.create(
             timeout=200,
-            model="GLM-4-Flash",  # free
-            # model="glm-4-plus",  # 0.05 元 / 千tokens
+            model="GLM-4-Flash",
             messages=[
-                {"role": "system", "content": "You are a benevolent programming expert, adept at deciphering code from the perspective of a beginner. The emphasis is on elucidating the functionality and operational mechanisms of the code in accessible and understandable language. Please start by summarizing the overall function of the code, then provide functional annotations for the provided code to help beginners quickly grasp the project and get started. For each function, it is imperative to elucidate its purpose, detailing what it takes as input, what it outputs, and the specific functionality it accomplishes.The explanations should be given in Chinese."},
+                {"role": "system", "content": system_content or DETAIL_SYSTEM_PROMPT},
                 {"role": "user", "content": code}
-            ]
+            ],
+            stream=True
         )
-        return response.choices[0].message.content
+        for chunk in response:
+            if getattr(chunk, "usage", None) is not None:
+                usage.append(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    try:
+        async with get_provider_semaphore("zhipu"):
+            async for delta in iterate_blocking(zhipu_deltas):
+                yield delta
+        # 生成器在线程中运行，用量在这里（调用记录所在的上下文中）上报
+        if usage:
+            report_usage(usage[-1])
     except Exception as e:
-        logger.error(f"Error with Zhipu AI: {str(e)}")
-        # 如果发生错误，重置客户端实例
-        AIClientSingleton.reset_clients()
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Error with Zhipu AI stream: {str(e)}")
+        raise
 
-async def analyze_with_openai_compatible(code: str, model: str, client_type: str, analytype: str = "detail") -> str:
+async def analyze_with_openai_compatible(code: str, model: str, client_type: str, analytype: str = "detail", system_content: str = None) -> str:
     """使用OpenAI兼容接口的服务分析代码"""
     try:
-        if client_type == "novita":
-            client = AIClientSingleton.get_novita_client()
-        elif client_type == "ppinfra":
-            client = AIClientSingleton.get_ppinfra_client()
-        elif client_type == "modelscope":
-            client = AIClientSingleton.get_modelscope_client()
-
-        # 根据分析类型选择不同的 system_content
-        if analytype == "simple":
-            logger.info("使用简单分析模式")
-            system_content = "请简要分析代码的主要功能和结构，用中文给出简洁的解释，仅给出代码的功能解释。"
-        else:
-            logger.info("使用详细分析模式")
-            system_content = "You are a benevolent programming expert, adept at deciphering code from the perspective of a beginner. The emphasis is on elucidating the functionality and operational mechanisms of the code in accessible and understandable language. Please start by summarizing the overall function of the code, then provide functional annotations for the provided code to help beginners quickly grasp the project and get started. For each function, it is imperative to elucidate its purpose, detailing what it takes as input, what it outputs, and the specific functionality it accomplishes.The explanations should be given in Chinese."
-        
-        completion_res = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": code}
-            ],
-            temperature=0.8,
-            stream=False,
-            max_tokens=8192,
-            timeout=60
-        )
+        client = get_openai_compatible_client(client_type)
+        system_content = system_content or get_system_content(analytype)
+
+        async with get_provider_semaphore(client_type):
+            completion_res = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": code}
+                ],
+                temperature=0.8,
+                stream=False,
+                max_tokens=8192,
+                timeout=60
+            )
+        report_usage(completion_res.usage)
         return completion_res.choices[0].message.content
     except Exception as e:
         logger.error(f"Error with {client_type} AI: {str(e)}")
-        AIClientSingleton.reset_clients()
-        raise HTTPException(status_code=500, detail=str(e))
+        raise
+
+# 支持 stream_options.include_usage 的服务商，流的最后一个片段带有 tokens 用量（openai 1.3.5 没有该参数，经 extra_body 传递）
+STREAM_USAGE_PROVIDERS = {"novita", "ppinfra"}
+
+async def stream_with_openai_compatible(code: str, model: str, client_type: str, analytype: str = "detail", system_content: str = None):
+    """使用OpenAI兼容接口的服务流式分析代码，逐段返回增量文本"""
+    try:
+        client = get_openai_compatible_client(client_type)
+        system_content = system_content or get_system_content(analytype)
+
+        async with get_provider_semaphore(client_type):
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": code}
+                ],
+                temperature=0.8,
+                stream=True,
+                max_tokens=8192,
+                timeout=60,
+                extra_body={"stream_options": {"include_usage": True}} if client_type in STREAM_USAGE_PROVIDERS else None
+            )
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    report_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    except Exception as e:
+        logger.error(f"Error with {client_type} AI stream: {str(e)}")
+        raise
 
 class AnalyzeRequest(BaseModel):
     code: str
     model: str = "qwen/qwen-2-72b-instruct"
     stream: bool = False
     analytype: str = "detail"  # 新增字段，默认为详细分析
+    use_cache: bool = True  # False时跳过缓存查找，强制重新分析（结果仍会写回缓存）
+    path: str = ""  # 文件路径，用于大文件按语言拆分
+    reduction: Optional[str] = None  # 发送前的代码压缩级别 none/light/outline，默认按 analytype 选择
+
+class AnalyzeRepoJobRequest(BaseModel):
+    path: str
+    model: str = "qwen/qwen-2-72b-instruct"
+    analytype: str = "detail"
+    include: List[str] = []
+    exclude: Optional[List[str]] = None  # 为空时使用默认排除规则
+    concurrency: int = 4
+    max_file_bytes: int = 1024 * 1024
+
+class RepoSummaryRequest(BaseModel):
+    path: str
+    model: str = "qwen/qwen-2-72b-instruct"
+    concurrency: int = 4  # 同一层目录同时进行的模型调用数
+
+class IncrementalAnalyzeRequest(BaseModel):
+    path: str
+    model: str = "qwen/qwen-2-72b-instruct"
+    analytype: str = "detail"
 
 class GitRepoRequest(BaseModel):
     url: str
+    depth: Optional[int] = None  # 不传时新克隆深度为1、已有仓库保持原深度；传 null 表示完整历史
+    filter_blobs: bool = False  # --filter=blob:none，文件内容在检出时才下载
+    sparse_paths: Optional[List[str]] = None
+    branch: Optional[str] = None
+    update: bool = True  # 已存在的仓库执行 git fetch
 
 class SaveAnalysisRequest(BaseModel):
     path: str
     content: str
 
+class BundleRequest(BaseModel):
+    paths: List[str]
+    analysis: bool = True  # 同时返回 .ai 分析
+    render: bool = True  # 可能时返回服务端高亮的行和渲染好的分析HTML
+    versions: dict = {}  # 客户端已缓存的 path -> version，未变化的文件只返回 unchanged
+    max_bytes: Optional[int] = None
+
 class HistoryRequest(BaseModel):
     path: str
 
@@ -235,123 +503,386 @@ class DeleteHistoryRequest(BaseModel):
 GITCODE_DIR = Path("data/gitcode")
 GITCODE_DIR.mkdir(parents=True, exist_ok=True)
 
-# History log file path
+# History log file path（旧格式，首次启动时导入）
 HISTORY_FILE = Path("history.log")
 
+def load_single_process_history() -> List[dict]:
+    store = HistoryStore(Path("data/history.json"), Path("data/history.journal"), legacy_path=HISTORY_FILE)
+    entries = store.entries()
+    store.close()
+    return entries
+
+if WORKER_COUNT > 1:
+    # 多个worker进程共享SQLite中的历史记录，首次以多进程模式启动时导入单进程模式的记录
+    history_store = SharedHistoryStore(Path("data/history.db"), seed=load_single_process_history)
+else:
+    # 打开过的目录和仓库，内存中维护，追加日志持久化
+    history_store = HistoryStore(Path("data/history.json"), Path("data/history.journal"), legacy_path=HISTORY_FILE)
+
+# 每个已打开根目录的目录树索引
+file_indexes = FileIndexManager()
+
+# AI分析结果缓存，按代码内容寻址
+ANALYSIS_CACHE_FILE = Path("data/analysis_cache.db")
+analysis_cache = AnalysisCache(
+    ANALYSIS_CACHE_FILE,
+    max_bytes=int(os.environ.get("CODE_VIEW_CACHE_MAX_MB", "200")) * 1024 * 1024,
+    max_age_seconds=float(os.environ.get("CODE_VIEW_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600
+)
+
+# 相同(代码, 模型, 分析类型)的并发分析只请求一次上游
+analysis_flight = SingleFlight()
+
+# 服务端语法高亮和Markdown渲染：在进程池中生成，按 (path, mtime, size) 缓存；CODE_VIEW_SERVER_RENDER=0 关闭
+SERVER_RENDER = os.environ.get("CODE_VIEW_SERVER_RENDER", "1") != "0"
+RENDER_MAX_BYTES = int(os.environ.get("CODE_VIEW_RENDER_MAX_MB", "32")) * 1024 * 1024
+RENDER_WORKERS = int(os.environ.get("CODE_VIEW_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 进程池在第一次渲染时才创建；CODE_VIEW_RENDER_WORKERS=0 时在线程中渲染（不启动子进程）
+render_pool = None
+# 后台渲染任务，保留引用以免任务在完成前被回收
+render_tasks = set()
+
+def get_render_pool() -> Optional[ProcessPoolExecutor]:
+    global render_pool, RENDER_WORKERS
+    if render_pool is None and RENDER_WORKERS > 0:
+        main_file = getattr(sys.modules["__main__"], "__file__", None) or ""
+        if multiprocessing.get_start_method() != "fork" and os.path.basename(main_file) == "server.py":
+            # spawn方式的子进程会重新导入 __main__，直接运行 server.py 时每个渲染进程都要重建全部状态
+            logger.info("Rendering in threads, start the server with start_app.py to render in processes")
+            RENDER_WORKERS = 0
+            return None
+        render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=init_render_worker)
+    return render_pool
+render_cache = RenderCache(
+    Path("data/render_cache.db"),
+    max_bytes=int(os.environ.get("CODE_VIEW_RENDER_CACHE_MB", "500")) * 1024 * 1024
+)
+render_flight = SingleFlight()
+
+async def run_render(func, path: str):
+    """Run a render function in the render process pool."""
+    pool = get_render_pool()
+    if pool is None:
+        return await asyncio.to_thread(func, path)
+    return await asyncio.get_running_loop().run_in_executor(pool, func, path)
+
+async def render_file_to_cache(path: str):
+    """Highlight path once (concurrent callers share the work); returns (version, rendered)."""
+    async def render():
+        version, language, lines = await run_render(render_file, path)
+        if lines is not None:
+            await asyncio.to_thread(render_cache.put_lines, path, version, language, lines)
+        return version, lines is not None
+    return await render_flight.do(f"file:{path}", render)
+
+async def rendered_window(path: str, stat: os.stat_result, offset: int = 0, limit: Optional[int] = None) -> dict:
+    """Highlighted lines of a renderable file from the render cache, rendering it first if needed.
+
+    {"rendered": false, "pending": true} while a large file renders in the background.
+    """
+    if limit is None:
+        limit = 0 if stat.st_size <= LARGE_FILE_BYTES else DEFAULT_PAGE_LINES
+    with span("render"):
+        window = await asyncio.to_thread(render_cache.get_lines, path, (stat.st_mtime_ns, stat.st_size),
+                                         offset, limit)
+        if window is None:
+            if await asyncio.to_thread(is_binary_file, path):
+                return {"rendered": False}
+            task = asyncio.ensure_future(render_file_to_cache(path))
+            if stat.st_size > LARGE_FILE_BYTES:
+                # 大文件第一次渲染需要几秒，在后台进行，这次先由浏览器高亮
+                render_tasks.add(task)
+                task.add_done_callback(render_tasks.discard)
+                task.add_done_callback(log_render_failure)
+                return {"rendered": False, "pending": True}
+            version, rendered = await task
+            if rendered:
+                window = await asyncio.to_thread(render_cache.get_lines, path, version, offset, limit)
+        if window is None:
+            return {"rendered": False}
+    return {"rendered": True, "offset": offset, **window}
+
+def can_render_file(path: str, size: int) -> bool:
+    return SERVER_RENDER and size <= RENDER_MAX_BYTES and has_lexer(path)
+
+def read_text(path: str) -> str:
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def analysis_stat(analysis_path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(analysis_path)
+    except FileNotFoundError:
+        return None
+
+async def analysis_view(analysis_path: str, stat: Optional[os.stat_result], render_html: bool) -> dict:
+    """{"content": Markdown, "html": cached server rendering or None} of a saved analysis."""
+    if stat is None:
+        return {"content": "", "html": None}
+    content = await asyncio.to_thread(read_text, analysis_path)
+    html = None
+    if render_html:
+        with span("render"):
+            html = await asyncio.to_thread(render_cache.get_html, analysis_path, (stat.st_mtime_ns, stat.st_size))
+            if html is None:
+                async def render():
+                    version, rendered = await run_render(render_markdown, analysis_path)
+                    await asyncio.to_thread(render_cache.put_html, analysis_path, version, rendered)
+                    return rendered
+                html = await render_flight.do(f"markdown:{analysis_path}", render)
+    return {"content": content, "html": html}
+
+def log_render_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background render failed: {task.exception()}")
+
 def get_repo_name(url: str) -> str:
     """Extract repository name from Git URL."""
     parsed = urlparse(url)
     path = parsed.path.strip('/')
     return path.split('/')[-1].replace('.git', '')
 
-def get_existing_repo(url: str) -> str:
-    """Check if repository already exists locally."""
-    repo_name = get_repo_name(url)
-    repo_path = GITCODE_DIR / repo_name
-    if repo_path.exists():
-        return str(repo_path)
-    return None
-
-def load_history() -> List[str]:
-    """Load history from file."""
-    try:
-        if HISTORY_FILE.exists():
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
-    except Exception as e:
-        logger.error(f"Error loading history: {e}")
-        return []
-
 def save_history(path: str, is_git: bool = False):
-    """Save path to history if not exists."""
+    """Record an access to path in history."""
     try:
-        history = load_history()
         # 如果是Git URL，直接保存URL
-        path_to_save = path if is_git else str(Path(path).resolve())
-        if path_to_save not in history:
-            history.append(path_to_save)
-            with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
+        history_store.touch(path if is_git else str(Path(path).resolve()))
     except Exception as e:
         logger.error(f"Error saving history: {e}")
 
-def delete_history(path: str):
-    """Delete path from history."""
-    try:
-        history = load_history()
-        if path in history:
-            history.remove(path)
-            with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
-            return True
-        return False
-    except Exception as e:
-        logger.error(f"Error deleting history: {e}")
-        return False
+def get_index_roots() -> List[str]:
+    """Local roots from history plus cloned repositories, without roots nested in other roots."""
+    candidates = [p for p in history_store.paths() if not p.startswith(("http://", "https://", "git://"))]
+    candidates += [str(p) for p in GITCODE_DIR.iterdir()]
+    roots = sorted({os.path.abspath(p) for p in candidates if os.path.isdir(p)}, key=len)
+    outermost = []
+    for root in roots:
+        if not any(root.startswith(parent + os.sep) for parent in outermost):
+            outermost.append(root)
+    return outermost
+
+# 全文和符号搜索索引，由后台线程增量维护
+search_index = SearchIndex(Path("data/search_index.db"), get_index_roots)
+
+def build_embedder():
+    """本地特征哈希向量化（默认），或通过已配置的OpenAI兼容服务商的 /embeddings 接口"""
+    provider = os.environ.get("CODE_VIEW_EMBEDDING_PROVIDER", "local").lower()
+    if provider != "local":
+        try:
+            # 索引在后台线程中运行，使用同一服务商配置的同步客户端
+            client = get_openai_compatible_client(provider)
+            sync_client = OpenAI(base_url=str(client.base_url), api_key=client.api_key)
+            return OpenAIEmbedder(sync_client, os.environ["CODE_VIEW_EMBEDDING_MODEL"],
+                                  int(os.environ.get("CODE_VIEW_EMBEDDING_DIM", "1024")))
+        except Exception as e:
+            # 不支持的服务商（如 zhipu）或缺少配置时退回本地向量化，不影响服务启动
+            logger.warning(f"Embedding provider {provider} unavailable ({e!r}), using local hashing embeddings")
+    return HashingEmbedder(int(os.environ.get("CODE_VIEW_EMBEDDING_DIM", "256")))
+
+# 代码块和 .ai 分析的语义索引
+semantic_index = SemanticIndex(Path("data/semantic"), build_embedder(), get_index_roots)
+
+# 只有持有这个锁的worker（单进程模式下就是唯一的进程）运行后台索引和批量任务，
+# 其他worker把索引刷新请求写入共享队列
+primary_lock = ProcessLock(Path("data/primary.lock"))
+refresh_queue = RefreshQueue(Path("data/shared.db"))
+is_primary_worker = False
+
+def request_index_refresh(target: str, paths: Optional[List[str]] = None):
+    """Ask the "search" or "semantic" indexer to refresh paths (every root when None), or the "watch"er to re-read its roots."""
+    if is_primary_worker:
+        {"search": search_index, "semantic": semantic_index, "watch": file_watcher}[target].request_refresh(paths)
+    else:
+        refresh_queue.put(target, paths)
+
+async def forward_refresh_requests():
+    """Pass refresh requests queued by other workers to this worker's indexers."""
+    while True:
+        try:
+            for target, paths in await asyncio.to_thread(refresh_queue.take):
+                request_index_refresh(target, paths)
+        except Exception as e:
+            logger.error(f"Error reading refresh requests: {e}")
+        await asyncio.sleep(1.0)
+
+@app.on_event("startup")
+async def start_search_indexer():
+    """Start the background search and semantic indexers in the primary worker."""
+    global is_primary_worker
+    is_primary_worker = primary_lock.acquire()
+    if not is_primary_worker:
+        logger.info("Background indexers run in another worker process")
+        return
+    search_index.start()
+    semantic_index.start()
+    asyncio.ensure_future(forward_refresh_requests())
+
+# 文件变化监视（CODE_VIEW_WATCH=0 关闭）：在主worker中运行，驱动索引和缓存的增量更新，并推送给浏览器
+WATCH_ENABLED = os.environ.get("CODE_VIEW_WATCH", "1") != "0"
+# 没有 inotify 或 ReadDirectoryChangesW 时轮询的间隔
+WATCH_POLL_SECONDS = float(os.environ.get("CODE_VIEW_WATCH_POLL_SECONDS", "5"))
+# 有监视时索引只需偶尔做一次完整扫描，以防漏掉事件
+WATCHED_INDEX_REFRESH_SECONDS = 3600.0
+WATCH_QUEUE_SIZE = 100
+STATE_DIR = os.path.abspath("data")
+
+def is_state_path(path: str) -> bool:
+    """Files the server itself writes under data/ (cloned repositories excepted)."""
+    gitcode = os.path.abspath(GITCODE_DIR)
+    return path.startswith(STATE_DIR + os.sep) and path != gitcode and not path.startswith(gitcode + os.sep)
+
+# 每个 /api/watch/events 连接一个队列
+watch_subscribers = set()
+main_loop = None
+# 多进程时文件变化经共享数据库转给其他worker
+change_feed = ChangeFeed(Path("data/shared.db")) if WORKER_COUNT > 1 else None
+
+def broadcast_file_changes(batch: dict):
+    for queue in list(watch_subscribers):
+        if queue.full():
+            # 浏览器跟不上时丢掉积压的变化，让它整体刷新
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"root": batch["root"], "changes": [], "dirs": [], "rescan": True})
+        else:
+            queue.put_nowait(batch)
+
+def apply_file_changes(batch: dict):
+    """Invalidate caches, update indexes and notify browsers for a batch of file changes (watcher thread)."""
+    if batch["rescan"]:
+        file_indexes.invalidate(batch["root"])
+        request_index_refresh("search")
+        request_index_refresh("semantic")
+    for directory in batch["dirs"]:
+        file_indexes.invalidate(directory, recursive=False)
+    paths = []
+    for change in batch["changes"]:
+        if change["isDirectory"]:
+            # 新目录中的文件会单独报告
+            if change["type"] == "deleted":
+                file_indexes.invalidate(change["path"])
+                paths.append(change["path"])
+            continue
+        paths.append(change["path"])
+        if change["type"] != "created":
+            render_cache.invalidate(change["path"])
+    if paths:
+        request_index_refresh("search", paths)
+        request_index_refresh("semantic", paths)
+    if change_feed is not None:
+        change_feed.append(batch)
+    if main_loop is not None:
+        main_loop.call_soon_threadsafe(broadcast_file_changes, batch)
+
+def is_server_written(path: str) -> bool:
+    """State under data/ and the .ai / .ai.json sidecars; writers refresh what they affect themselves."""
+    return is_state_path(path) or is_sidecar(path)
+
+file_watcher = FileWatcher(get_index_roots, apply_file_changes, exclude=is_server_written,
+                           poll_interval=WATCH_POLL_SECONDS)
+
+async def forward_file_changes():
+    """Pass file changes seen by the watching worker to this worker's browser connections."""
+    last_id = await asyncio.to_thread(change_feed.last_id)
+    while True:
+        try:
+            for last_id, batch in await asyncio.to_thread(change_feed.read_since, last_id):
+                broadcast_file_changes(batch)
+        except Exception as e:
+            logger.error(f"Error reading file changes: {e}")
+        await asyncio.sleep(0.5)
+
+@app.on_event("startup")
+async def start_file_watcher():
+    """Start watching opened folders in the primary worker; other workers follow its change feed."""
+    global main_loop
+    main_loop = asyncio.get_running_loop()
+    if not WATCH_ENABLED:
+        return
+    if is_primary_worker:
+        file_watcher.start()
+        search_index.refresh_interval = WATCHED_INDEX_REFRESH_SECONDS
+        semantic_index.refresh_interval = WATCHED_INDEX_REFRESH_SECONDS
+    elif change_feed is not None:
+        asyncio.ensure_future(forward_file_changes())
+
+def on_repo_updated(path: str):
+    """Refresh indexes after a clone or fetch changed a repository."""
+    file_indexes.invalidate(path)
+    request_index_refresh("search")
+    request_index_refresh("semantic")
+    request_index_refresh("watch")
+
+# 后台 git clone / fetch；任务状态写入文件，其他worker进程也能查询
+git_clones = GitCloneManager(on_complete=on_repo_updated, state_dir=Path("data/clone_jobs"))
 
 @app.post("/api/clone-repo")
 async def clone_repo(request: GitRepoRequest):
-    """Clone a Git repository if it doesn't exist locally."""
+    """Start cloning a Git repository, or fetching it if it already exists locally.
+
+    Returns immediately; "ready" tells whether the path can be browsed now
+    (an existing repository stays browsable while it is being updated).
+    """
     try:
         # Save Git URL to history
         save_history(request.url, is_git=True)
-        
-        # Check if repo already exists
-        existing_path = get_existing_repo(request.url)
-        if existing_path:
-            logger.info(f"Repository already exists at {existing_path}")
-            return {"path": existing_path}
-
-        # Clone the repository
-        repo_name = get_repo_name(request.url)
-        repo_path = GITCODE_DIR / repo_name
-        
-        # Remove directory if it exists but is empty or incomplete
-        if repo_path.exists():
-            import shutil
-            shutil.rmtree(repo_path)
-            
-        logger.info(f"Cloning repository: {request.url} to {repo_path}")
-        result = subprocess.run(
-            ["git", "clone", request.url, str(repo_path)],
-            capture_output=True,
-            text=True,
-            check=False  # Don't raise exception immediately
-        )
-        
-        if result.returncode != 0:
-            logger.error(f"Git clone failed with error: {result.stderr}")
-            raise HTTPException(status_code=400, detail=f"Git clone failed: {result.stderr}")
-            
-        if repo_path.exists():
-            logger.info(f"Repository successfully cloned to {repo_path}")
-            return {"path": str(repo_path)}
-        else:
-            logger.error("Repository path does not exist after clone")
-            raise HTTPException(status_code=500, detail="Failed to clone repository: path does not exist after clone")
-            
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Git clone process error: {e.stderr}")
-        raise HTTPException(status_code=400, detail=f"Git clone failed: {e.stderr}")
+
+        repo_path = GITCODE_DIR / get_repo_name(request.url)
+        if (repo_path / ".git").exists() and not request.update:
+            return {"path": str(repo_path.resolve()), "ready": True, "job": None}
+
+        depth = request.depth if "depth" in request.model_fields_set else DEFAULT_DEPTH
+        job = git_clones.start(request.url, repo_path, depth=depth, filter_blobs=request.filter_blobs,
+                               sparse_paths=request.sparse_paths, branch=request.branch)
+        logger.info(f"git {job['action']} {request.url} -> {job['path']} (job {job['id']})")
+        return {"path": job["path"], "ready": job["action"] == "fetch", "job": git_clones.public(job)}
     except Exception as e:
         logger.error(f"Unexpected error during clone: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/clone-repo/{job_id}")
+async def get_clone_job(job_id: str):
+    """Get the state of a clone or fetch job."""
+    job = git_clones.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return git_clones.public(job)
+
+@app.get("/api/clone-repo/{job_id}/events")
+async def clone_job_events(job_id: str):
+    """Stream clone progress as server-sent events until the job finishes."""
+    if git_clones.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        async for snapshot in git_clones.events(job_id):
+            yield sse_event(snapshot)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def serve_file(request: Request, path: str):
+    """FileResponse that answers 304 when the client's copy is current."""
+    stat = os.stat(path)
+    etag = stat_etag(stat)
+    if is_fresh(request, etag, stat.st_mtime):
+        return not_modified(etag, stat.st_mtime)
+    return FileResponse(path, stat_result=stat, headers=validator_headers(etag, stat.st_mtime))
+
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Serve the root HTML file."""
     logger.info("Serving root HTML file")
-    return FileResponse("code_viewer.html")
+    return serve_file(request, "code_viewer.html")
 
 @app.get("/code_viewer.js")
-async def serve_js():
+async def serve_js(request: Request):
     """Serve the JavaScript file."""
     logger.info("Serving code_viewer.js")
-    return FileResponse("code_viewer.js")
+    return serve_file(request, "code_viewer.js")
 
 @app.get("/api/files")
-async def get_files(path: str, should_save_history: bool = False):
+async def get_files(path: str, request: Request, should_save_history: bool = False):
     """Get directory contents."""
     try:
         # Only save path to history if explicitly requested
@@ -359,49 +890,231 @@ async def get_files(path: str, should_save_history: bool = False):
             save_history(path, is_git=False)
         
         logger.info(f"Getting files from path: {path}")
-        files = []
-        for item in os.listdir(path):
-            item_path = os.path.join(path, item)
-            is_dir = os.path.isdir(item_path)
-            files.append({
-                "name": item,
-                "path": item_path,
-                "isDirectory": is_dir
-            })
-        return files
+        index = file_indexes.index_for(path, root=path if should_save_history else None)
+        with span("fs"):
+            entries = await asyncio.to_thread(index.list_dir, path)
+        return json_response(request, entries)
     except Exception as e:
         logger.error(f"Error getting files: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/tree")
+async def get_tree(path: str, request: Request, depth: int = 2, limit: int = 5000, include_ignored: bool = False,
+                   should_save_history: bool = False):
+    """Get a recursive directory listing from the file index, honoring .gitignore."""
+    try:
+        if should_save_history:
+            save_history(path, is_git=False)
+            request_index_refresh("search")
+            request_index_refresh("semantic")
+            request_index_refresh("watch")
+
+        logger.info(f"Getting tree from path: {path} (depth={depth}, limit={limit})")
+        index = file_indexes.index_for(path, root=path if should_save_history else None)
+        with span("fs"):
+            tree = await asyncio.to_thread(index.tree, path, depth, limit, include_ignored)
+        return json_response(request, tree)
+    except Exception as e:
+        logger.error(f"Error getting tree: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/content")
-async def get_content(path: str):
-    """Get file contents."""
+async def get_content(path: str, request: Request, offset: int = 0, limit: Optional[int] = None,
+                      byte_offset: Optional[int] = None):
+    """Get file contents, or a window of `limit` lines starting at line `offset`.
+
+    `byte_offset` (the previous page's `next_byte_offset`) continues reading at that byte.
+
+    Validated by the file's mtime and size: an unchanged file is answered with 304 without reading it.
+    """
     try:
-        logger.info(f"Getting content from file: {path}")
-        with open(path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return {"content": content}
+        logger.info(f"Getting content from file: {path} (offset={offset}, limit={limit}, byte_offset={byte_offset})")
+        with span("fs"):
+            stat = await asyncio.to_thread(os.stat, path)
+            etag = stat_etag(stat, offset, limit, byte_offset)
+            if is_fresh(request, etag, stat.st_mtime):
+                return not_modified(etag, stat.st_mtime)
+            window = await asyncio.to_thread(read_content_window, path, offset, limit, byte_offset)
+        return json_response(request, window, etag, stat.st_mtime)
     except Exception as e:
         logger.error(f"Error getting file content: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/render")
+async def get_rendered(path: str, request: Request, offset: int = 0, limit: Optional[int] = None):
+    """Syntax-highlighted HTML lines of a file, rendered once per file version and then served from cache.
+
+    Paged like /api/content. Returns {"rendered": false} when the browser should highlight
+    /api/content itself: server rendering off, binary or unknown file types, files over
+    CODE_VIEW_RENDER_MAX_MB, or a large file whose first render is still running.
+    """
+    try:
+        if not SERVER_RENDER or not has_lexer(path):
+            return {"rendered": False}
+        stat = await asyncio.to_thread(os.stat, path)
+        if stat.st_size > RENDER_MAX_BYTES:
+            return {"rendered": False}
+        # 只有渲染成功的响应带 ETag，所以匹配时客户端缓存的一定是这个版本的渲染结果
+        etag = stat_etag(stat, "render", RENDER_VERSION, offset, limit)
+        if is_fresh(request, etag, stat.st_mtime):
+            return not_modified(etag, stat.st_mtime)
+        window = await rendered_window(path, stat, offset, limit)
+        if not window["rendered"]:
+            return window
+        return json_response(request, window, etag, stat.st_mtime)
+    except Exception as e:
+        logger.error(f"Error rendering file: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/render_analysis")
+async def get_rendered_analysis(path: str, request: Request):
+    """The saved analysis of a file as Markdown plus cached server-rendered HTML (null when unavailable)."""
+    try:
+        analysis_path = path + '.ai'
+        stat = analysis_stat(analysis_path)
+        render_html = SERVER_RENDER and can_render_markdown()
+        etag = stat_etag(stat, "render", RENDER_VERSION, int(render_html))
+        if is_fresh(request, etag):
+            return not_modified(etag)
+        return json_response(request, await analysis_view(analysis_path, stat, render_html), etag)
+    except Exception as e:
+        logger.error(f"Error rendering analysis: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/render-cache/stats")
+async def get_render_cache_stats():
+    """Get render cache size and hit/miss counters."""
+    stats = await asyncio.to_thread(render_cache.stats)
+    stats.update({"enabled": SERVER_RENDER, "workers": RENDER_WORKERS, "single_flight": render_flight.stats()})
+    return stats
+
+@app.get("/api/raw")
+async def get_raw(path: str, request: Request):
+    """Stream a file as-is, honoring single byte-range requests."""
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File not found")
+    size = os.path.getsize(path)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    range_header = request.headers.get("range")
+    if not range_header:
+        return FileResponse(path, media_type=media_type, headers={"Accept-Ranges": "bytes"})
+    byte_range = parse_range_header(range_header, size)
+    if byte_range is None:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range
+    return StreamingResponse(
+        iterate_in_threadpool(iter_file_range(path, start, end)),
+        status_code=206,
+        media_type=media_type,
+        headers={
+            "Accept-Ranges": "bytes",
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1),
+        }
+    )
+
 @app.get("/api/load_analysis")
-async def load_analysis(path: str):
+async def load_analysis(path: str, request: Request):
     """Load AI analysis from file if it exists."""
     try:
         analysis_path = path + '.ai'
-        print(analysis_path)
-        if os.path.exists(analysis_path):
-            logger.info(f"Loading analysis from: {analysis_path}")
-            with open(analysis_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return {"content": content}
-        else:
-            return {"content": ""}
+        stat = analysis_stat(analysis_path)
+        # 没有分析文件也有 ETag，文件出现后就不再匹配
+        etag = stat_etag(stat)
+        if is_fresh(request, etag):
+            return not_modified(etag)
+        if stat is None:
+            return json_response(request, {"content": ""}, etag)
+        logger.debug(f"Loading analysis from: {analysis_path}")
+        with open(analysis_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return json_response(request, {"content": content}, etag, stat.st_mtime)
     except Exception as e:
         logger.error(f"Error loading analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# POST /api/bundle：一次请求读取多个文件的内容和分析
+BUNDLE_MAX_PATHS = 200
+BUNDLE_CONCURRENCY = 8
+BUNDLE_DEFAULT_BYTES = 8 * 1024 * 1024
+BUNDLE_MAX_BYTES = 64 * 1024 * 1024
+
+async def bundle_record(path: str, request: BundleRequest) -> dict:
+    """Content (or highlighted lines), analysis and metadata of one file for /api/bundle."""
+    record = {"path": path}
+    try:
+        stat = await asyncio.to_thread(os.stat, path)
+        analysis_path = path + '.ai'
+        a_stat = await asyncio.to_thread(analysis_stat, analysis_path) if request.analysis else None
+        render = request.render and can_render_file(path, stat.st_size)
+        # 版本由文件和分析的 (mtime, size) 以及返回的形式决定
+        version = stat_etag(stat, stat_version(a_stat), int(request.analysis), int(render), RENDER_VERSION)
+        record.update({"size": stat.st_size, "mtime": stat.st_mtime})
+        if request.versions.get(path) == version:
+            record.update({"version": version, "unchanged": True})
+            return record
+        window = await rendered_window(path, stat) if render else {"rendered": False}
+        if window["rendered"]:
+            record["rendered"] = window
+        else:
+            with span("fs"):
+                record["content"] = await asyncio.to_thread(read_content_window, path)
+        if request.analysis:
+            record["analysis"] = await analysis_view(analysis_path, a_stat,
+                                                     request.render and SERVER_RENDER and can_render_markdown())
+        # 大文件还在后台渲染时不给版本，下次请求会拿到渲染结果
+        if not window.get("pending"):
+            record["version"] = version
+    except Exception as e:
+        record["error"] = str(e)
+    return record
+
+@app.post("/api/bundle")
+async def bundle(request: BundleRequest):
+    """Stream content, analysis and metadata of several files as NDJSON, one record per line as each is read.
+
+    Files are read concurrently. Once `max_bytes` of records have been sent the remaining files
+    are skipped; the last line is {"done": true, "skipped": [...], "bytes": n}.
+    """
+    paths = list(dict.fromkeys(request.paths))
+    if len(paths) > BUNDLE_MAX_PATHS:
+        raise HTTPException(status_code=400, detail=f"At most {BUNDLE_MAX_PATHS} paths per bundle")
+    budget = min(request.max_bytes or BUNDLE_DEFAULT_BYTES, BUNDLE_MAX_BYTES)
+    logger.info(f"Bundling {len(paths)} files")
+    semaphore = asyncio.Semaphore(BUNDLE_CONCURRENCY)
+
+    async def load(path: str) -> dict:
+        async with semaphore:
+            return await bundle_record(path, request)
+
+    async def records():
+        tasks = [asyncio.ensure_future(load(path)) for path in paths]
+        sent_bytes = 0
+        sent = set()
+        try:
+            for next_record in asyncio.as_completed(tasks):
+                record = await next_record
+                with span("serialize"):
+                    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                # 第一条总是发送，单个大文件也能取到
+                if sent and sent_bytes + len(line) > budget:
+                    break
+                sent_bytes += len(line)
+                sent.add(record["path"])
+                yield line
+        finally:
+            for task in tasks:
+                task.cancel()
+        summary = {"done": True, "skipped": [path for path in paths if path not in sent], "bytes": sent_bytes}
+        yield (json.dumps(summary, ensure_ascii=False) + "\n").encode("utf-8")
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+def on_analysis_saved(analysis_path: str):
+    """The file watcher ignores .ai sidecars, so whoever writes one refreshes what depends on it."""
+    render_cache.invalidate(analysis_path)
+    request_index_refresh("semantic", [analysis_path])
+
 @app.post("/api/save_analysis")
 async def save_analysis(request: SaveAnalysisRequest):
     """Save AI analysis to file."""
@@ -410,17 +1123,112 @@ async def save_analysis(request: SaveAnalysisRequest):
         logger.info(f"Saving analysis to: {analysis_path}")
         with open(analysis_path, 'w', encoding='utf-8') as f:
             f.write(request.content)
+        on_analysis_saved(analysis_path)
         return {"message": "Analysis saved successfully"}
     except Exception as e:
         logger.error(f"Error saving analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/search")
+async def search(q: str, root: Optional[str] = None, kind: str = "all", limit: int = 50):
+    """Search text and symbol definitions in indexed repositories."""
+    if not q:
+        raise HTTPException(status_code=400, detail="Empty query")
+    start = time.perf_counter()
+    results = {}
+    try:
+        with span("search"):
+            if kind in ("all", "symbol"):
+                results["symbols"] = await asyncio.to_thread(search_index.search_symbols, q, root, limit)
+            if kind in ("all", "text"):
+                results["text"] = await asyncio.to_thread(search_index.search_text, q, root, limit)
+    except Exception as e:
+        logger.error(f"Error searching: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    results["took_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return results
+
+@app.get("/api/search/status")
+async def search_status():
+    """Get search index size and indexing state."""
+    return await asyncio.to_thread(search_index.stats)
+
+@app.get("/api/semantic-search")
+async def semantic_search(q: str, k: int = 10, root: Optional[str] = None, kind: Optional[str] = None):
+    """Find code chunks and analyses related to a natural-language query."""
+    if not q:
+        raise HTTPException(status_code=400, detail="Empty query")
+    if kind not in (None, "code", "analysis"):
+        raise HTTPException(status_code=400, detail="kind must be code or analysis")
+    start = time.perf_counter()
+    try:
+        with span("search"):
+            results = await asyncio.to_thread(semantic_index.search, q, k, root, kind)
+    except Exception as e:
+        logger.error(f"Error in semantic search: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": results, "took_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+@app.get("/api/semantic-search/status")
+async def semantic_search_status():
+    """Get semantic index size and indexing state."""
+    return await asyncio.to_thread(semantic_index.stats)
+
+def changes_under(batch: dict, root: Optional[str]) -> Optional[dict]:
+    """The part of a change batch inside root, or None when nothing there changed."""
+    if root is None or batch["root"] == root or batch["root"].startswith(root + os.sep):
+        return batch
+    if not root.startswith(batch["root"] + os.sep):
+        return None
+    prefix = root + os.sep
+    changes = [c for c in batch["changes"] if c["path"].startswith(prefix)]
+    dirs = [d for d in batch["dirs"] if d == root or d.startswith(prefix)]
+    if not changes and not dirs and not batch["rescan"]:
+        return None
+    return {**batch, "changes": changes, "dirs": dirs}
+
+@app.get("/api/watch/events")
+async def watch_events(root: Optional[str] = None):
+    """Stream file changes under root (every watched folder when omitted) as server-sent events.
+
+    The first event is {"watching": bool}; each later one is a batch of changes from FileWatcher.
+    """
+    root = os.path.normpath(os.path.abspath(root)) if root else None
+    queue = asyncio.Queue(maxsize=WATCH_QUEUE_SIZE)
+    watch_subscribers.add(queue)
+
+    async def event_stream():
+        try:
+            yield sse_event({"watching": WATCH_ENABLED})
+            while True:
+                try:
+                    batch = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # 注释行，只为保持连接
+                    yield ": keep-alive\n\n"
+                    continue
+                batch = changes_under(batch, root)
+                if batch is not None:
+                    yield sse_event(batch)
+        finally:
+            watch_subscribers.discard(queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/watch/status")
+async def watch_status():
+    """Get the file watcher's backend, watched roots and event counters."""
+    status = {"enabled": WATCH_ENABLED, "primary": is_primary_worker, "subscribers": len(watch_subscribers)}
+    if is_primary_worker:
+        status.update(file_watcher.stats())
+    return status
+
 @app.get("/api/history")
 async def get_history():
-    """Get path history."""
+    """Get path history, most recently used first."""
     try:
-        history = load_history()
-        return {"history": history}
+        return {"history": history_store.paths(), "entries": history_store.entries()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -428,39 +1236,479 @@ async def get_history():
 async def remove_history(request: DeleteHistoryRequest):
     """Remove path from history."""
     try:
-        if delete_history(request.path):
+        if history_store.remove(request.path):
             return {"success": True}
         raise HTTPException(status_code=404, detail="Path not found in history")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def resolve_model(model: str):
+    """Map the model selected in the viewer to (provider, upstream model name)."""
+    if model == "glm-4-plus":
+        return "zhipu", "GLM-4-Flash"
+    elif model.startswith("ppinfra"):
+        return "ppinfra", model.split("|")[1]
+    elif model.startswith("modelscope"):
+        return "modelscope", "Qwen/Qwen2.5-Coder-32B-Instruct"
+    elif model == "qwen/qwen-2-72b-instruct":
+        return "novita", model
+    return "utools", model
+
+# 能力相近、可以互相替代的模型（前端的模型值），主模型失败时按健康状况切换
+MODEL_FAILOVER_GROUPS = [
+    ["qwen/qwen-2-72b-instruct", "modelscope", "qwen"],
+    ["ppinfra|deepseek/deepseek-v3", "deepseek"],
+    ["ppinfra|deepseek/deepseek-r1", "deepseekr1"],
+    ["glm-4-plus", "glm4"],
+]
+
+def analysis_targets(model: str) -> List[tuple]:
+    """The (provider, upstream model) to use for model, followed by its failover equivalents."""
+    targets = [resolve_model(model)]
+    if os.environ.get("CODE_VIEW_FAILOVER", "1") != "0":
+        for group in MODEL_FAILOVER_GROUPS:
+            if model in group:
+                targets += [resolve_model(m) for m in group if m != model]
+    return targets
+
+def on_provider_failure(provider: str, exc: BaseException):
+    """Recreate a provider's client after connection-level failures (HTTP errors keep the client)."""
+    if error_status(exc) is None:
+        AIClientSingleton.reset_client(provider)
+
+# 每个模型的调用次数、tokens、费用和延迟，见 /metrics 和 /api/stats
+metrics = Metrics()
+# 多进程时各worker定期把自己的统计写入共享数据库，/metrics 和 /api/stats 返回所有worker的合计
+worker_snapshots = WorkerSnapshots(Path("data/shared.db")) if WORKER_COUNT > 1 else None
+METRICS_PUBLISH_SECONDS = 5.0
+metrics_publisher = None
+
+async def publish_metrics():
+    while True:
+        await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+        try:
+            await asyncio.to_thread(worker_snapshots.put, "metrics", metrics.export())
+        except Exception as e:
+            logger.error(f"Error publishing metrics: {e}")
+
+# 前端模型下拉框中的模型值，与 code_viewer.html 保持一致
+VIEWER_MODELS = [
+    "ppinfra|deepseek/deepseek-v3", "ppinfra|deepseek/deepseek-r1",
+    "ppinfra|deepseek/deepseek-r1-distill-llama-70b", "ppinfra|deepseek/deepseek-r1-distill-qwen-32b",
+    "doubao", "glm4", "qwen", "wenxinspeed", "wenxin35",
+    "qwen/qwen-2-72b-instruct", "glm-4-plus", "modelscope",
+]
+
+@app.on_event("startup")
+async def warn_unpriced_models():
+    """Log a warning for each configured model without a price, since its cost is reported as unknown."""
+    models = [target[1] for model in VIEWER_MODELS for target in analysis_targets(model)]
+    for model in unpriced_models(models):
+        logger.warning(f"No price for model {model}, its cost is reported as null; set it in CODE_VIEW_MODEL_PRICES")
+
+@app.on_event("startup")
+async def start_metrics_publisher():
+    global metrics_publisher
+    if worker_snapshots is not None:
+        metrics_publisher = asyncio.ensure_future(publish_metrics())
+
+async def all_metrics() -> Metrics:
+    """This worker's metrics, or the sum over all workers (the others up to METRICS_PUBLISH_SECONDS old)."""
+    if worker_snapshots is None:
+        return metrics
+
+    def collect():
+        worker_snapshots.put("metrics", metrics.export())
+        return worker_snapshots.all("metrics")
+
+    return Metrics.merged(await asyncio.to_thread(collect))
+
+provider_router = ProviderRouter(
+    max_retries=int(os.environ.get("CODE_VIEW_MAX_RETRIES", "1")),
+    hedge=os.environ.get("CODE_VIEW_HEDGING", "0") == "1",
+    on_failure=on_provider_failure
+)
+
+async def analyze_with_utools(code: str, model: str, system_content: str = None) -> str:
+    """使用uTools模型分析代码"""
+    client = AIClientSingleton.get_utools_client()
+    async with get_provider_semaphore("utools"):
+        return await client.chat(modelname=model, prompt=code, system_prompt=system_content or UTOOLS_SYSTEM_PROMPT)
+
+async def stream_with_utools(code: str, model: str, system_content: str = None):
+    """使用uTools模型流式分析代码，逐段返回增量文本"""
+    client = AIClientSingleton.get_utools_client()
+    async with get_provider_semaphore("utools"):
+        async for delta in client.stream(modelname=model, prompt=code,
+                                         system_prompt=system_content or UTOOLS_SYSTEM_PROMPT):
+            yield delta
+
+async def run_analysis(code: str, model: str, analytype: str = "detail", system_content: str = None) -> str:
+    """Run an analysis on the selected model, retrying and failing over to equivalent models."""
+    async def invoke(provider: str, model_name: str) -> str:
+        logger.info(f"Using {provider} model {model_name} for code analysis")
+        with span("provider"), metrics.track(provider, model_name, analytype, (system_content or "") + code) as call:
+            if provider == "zhipu":
+                result = await analyze_with_zhipu(code, system_content)
+            elif provider == "utools":
+                result = await analyze_with_utools(code, model_name, system_content)
+            else:
+                result = await analyze_with_openai_compatible(code, model_name, provider, analytype, system_content)
+            call.set_result(result)
+        return result
+
+    # 批量任务按每次上游调用限流
+    await acquire_rate_limit()
+    try:
+        result, _ = await provider_router.call(analysis_targets(model), invoke)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def stream_analysis(code: str, model: str, analytype: str = "detail", system_content: str = None):
+    """Stream an analysis, yielding text deltas; failover happens only before the first delta."""
+    def open_stream(provider: str, model_name: str):
+        logger.info(f"Streaming {provider} model {model_name} for code analysis")
+        if provider == "zhipu":
+            deltas = stream_with_zhipu(code, system_content)
+        elif provider == "utools":
+            deltas = stream_with_utools(code, model_name, system_content)
+        else:
+            deltas = stream_with_openai_compatible(code, model_name, provider, analytype, system_content)
+        return traced_iter("provider", metrics.track_stream(provider, model_name, analytype,
+                                                            (system_content or "") + code, deltas))
+
+    async for delta in provider_router.stream(analysis_targets(model), open_stream):
+        yield delta
+
+CHUNK_PROMPT_TEMPLATE = "以下是文件 {path} 的第 {index}/{total} 部分（第 {start}-{end} 行{symbols}），文件的其余部分会单独分析，请只分析这一部分：\n\n{code}"
+REDUCE_SYSTEM_PROMPT = "你会收到同一个代码文件各个部分的分析结果。请把它们合并成一份完整、连贯的中文文档：先总结整个文件的功能，再按原文顺序给出各个类和函数的说明，去掉重复内容，不要提及“部分”或“分段”。"
+
+async def map_chunks(code: str, model: str, analytype: str, path: str = "") -> List[str]:
+    """Split a large file along symbol boundaries and analyze the chunks in parallel."""
+    model_name = resolve_model(model)[1]
+    chunks = split_code(code, min(chunk_budget(model_name), CHUNK_TARGET_TOKENS), path)
+    logger.info(f"Analyzing {path or 'code'} in {len(chunks)} chunks")
+    prompts = [
+        CHUNK_PROMPT_TEMPLATE.format(
+            path=path or "(未命名)", index=i + 1, total=len(chunks), start=chunk.start_line, end=chunk.end_line,
+            symbols="，包含 " + ", ".join(chunk.symbols) if chunk.symbols else "", code=chunk.text
+        )
+        for i, chunk in enumerate(chunks)
+    ]
+    summaries = await asyncio.gather(*(run_analysis(prompt, model, analytype) for prompt in prompts))
+    return [f"### 第 {i + 1} 部分（第 {c.start_line}-{c.end_line} 行）\n{summary}"
+            for i, (c, summary) in enumerate(zip(chunks, summaries))]
+
+async def reduce_summaries(summaries: List[str], model: str, analytype: str) -> str:
+    """Merge chunk summaries level by level until they fit into one reduce prompt of model."""
+    return await reduce_until_fits(summaries, chunk_budget(resolve_model(model)[1]),
+                                   lambda text: run_analysis(text, model, analytype, REDUCE_SYSTEM_PROMPT))
+
+async def analyze_code_text(code: str, model: str, analytype: str, path: str = "") -> str:
+    """Analyze code directly, or with map-reduce over chunks when it is too large for one call."""
+    if not needs_chunking(code, resolve_model(model)[1]):
+        return await run_analysis(code, model, analytype)
+    summaries = await map_chunks(code, model, analytype, path)
+    merged = await reduce_summaries(summaries, model, analytype)
+    return await run_analysis(merged, model, analytype, REDUCE_SYSTEM_PROMPT)
+
+async def stream_code_text(code: str, model: str, analytype: str, path: str = ""):
+    """Streaming counterpart of analyze_code_text; for large files only the final reduce step streams."""
+    if not needs_chunking(code, resolve_model(model)[1]):
+        deltas = stream_analysis(code, model, analytype)
+    else:
+        summaries = await map_chunks(code, model, analytype, path)
+        merged = await reduce_summaries(summaries, model, analytype)
+        deltas = stream_analysis(merged, model, analytype, REDUCE_SYSTEM_PROMPT)
+    async for delta in deltas:
+        yield delta
+
+def sse_event(data: dict) -> str:
+    """Format one Server-Sent Events message."""
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def lookup_cached_analysis(request: AnalyzeRequest):
+    """Return (cache key, cached content or None), honoring the use_cache flag."""
+    key = make_cache_key(request.code, request.model, request.analytype)
+    if not request.use_cache:
+        analysis_cache.record_bypass()
+        metrics.record_cache("bypass")
+        return key, None
+    cached = await asyncio.to_thread(analysis_cache.get, key)
+    metrics.record_cache("miss" if cached is None else "hit")
+    return key, cached
+
+async def store_analysis(key: str, request: AnalyzeRequest, content: str):
+    """Cache a finished analysis (empty replies are not cached)."""
+    if content:
+        await asyncio.to_thread(analysis_cache.put, key, request.model, request.analytype, content)
+
+async def analyze_with_cache(request: AnalyzeRequest):
+    """Non-streaming analysis through the cache and single-flight layers; returns (content, cached)."""
+    key, cached = await lookup_cached_analysis(request)
+    if cached is not None:
+        return cached, True
+
+    async def upstream():
+        content = await analyze_code_text(request.code, request.model, request.analytype, request.path)
+        await store_analysis(key, request, content)
+        return content
+
+    return await analysis_flight.do(key, upstream), False
+
+async def analysis_event_stream(request: AnalyzeRequest, prompt_report: dict):
+    """Relay analysis deltas as SSE messages, ending with a done or error event."""
+    try:
+        key, cached = await lookup_cached_analysis(request)
+        if cached is not None:
+            yield sse_event({"delta": cached})
+            yield sse_event({"done": True, "cached": True, "prompt": prompt_report})
+            return
+
+        async def upstream():
+            parts = []
+            async for delta in stream_code_text(request.code, request.model, request.analytype, request.path):
+                parts.append(delta)
+                yield delta
+            await store_analysis(key, request, "".join(parts))
+
+        async for delta in analysis_flight.stream(key, upstream):
+            yield sse_event({"delta": delta})
+        yield sse_event({"done": True, "cached": False, "prompt": prompt_report})
+    except Exception as e:
+        logger.error(f"Error in streaming code analysis: {str(e)}", exc_info=True)
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        yield sse_event({"error": detail})
+
 @app.post("/api/analyze")
 async def analyze_code(request: AnalyzeRequest):
     """Analyze code using selected AI model."""
+    if request.reduction is not None and request.reduction not in REDUCTION_LEVELS:
+        raise HTTPException(status_code=400, detail=f"reduction must be one of {', '.join(REDUCTION_LEVELS)}")
+    # 去掉许可证头、大段数据等低价值内容后再发送，缓存也按压缩后的代码寻址
+    code, prompt_report = reduce_prompt(request.code, request.path, request.analytype, request.reduction)
+    request = request.model_copy(update={"code": code})
+    if request.stream:
+        return StreamingResponse(
+            analysis_event_stream(request, prompt_report),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
     try:
-        print(request.model)
-        if request.model == "glm-4-plus":
-            logger.info("Using Zhipu AI for code analysis")
-            content = await analyze_with_zhipu(request.code)
-        elif request.model.startswith("ppinfra"):
-            logger.info("Using PPInfra for code analysis")
-            content = await analyze_with_openai_compatible(request.code, request.model.split("|")[1], "ppinfra", request.analytype)
-        elif request.model.startswith("modelscope"):
-            logger.info("Using ModelScope for code analysis")
-            content = await analyze_with_openai_compatible(request.code, "Qwen/Qwen2.5-Coder-32B-Instruct", "modelscope", request.analytype)
-        elif request.model == "qwen/qwen-2-72b-instruct":
-            logger.info(f"Using Novita AI model {request.model} for code analysis")
-            content = await analyze_with_openai_compatible(request.code, request.model, "novita", request.analytype)
-        else:
-            logger.info(f"Using utools's model {request.model} for code analysis")
-            content = do_request(modelname=request.model,prompt=request.code)
-
-        return {"content": content}
+        content, cached = await analyze_with_cache(request)
+        return {"content": content, "cached": cached, "prompt": prompt_report}
     except Exception as e:
         logger.error(f"Error in code analysis: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics for model calls and the analysis cache."""
+    return PlainTextResponse((await all_metrics()).prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/stats")
+async def get_stats():
+    """Per model/provider/analytype request counts, tokens, cost and latency percentiles."""
+    return (await all_metrics()).summary()
+
+def require_single_worker():
+    if WORKER_COUNT > 1:
+        raise HTTPException(status_code=409, detail="Request tracing is only available with a single worker")
+
+@app.get("/api/debug/slow")
+async def get_slow_requests(limit: int = 50):
+    """Recent requests slower than the tracing threshold, newest first, with per-span timings."""
+    require_single_worker()
+    return {"enabled": tracer.enabled, "slow_ms": tracer.slow_ms, "requests": tracer.slow(limit)}
+
+@app.get("/api/debug/profile/{profile_id}")
+async def get_profile(profile_id: int):
+    """Sampling profile of a request sent with the X-Profile: 1 header."""
+    require_single_worker()
+    report = tracer.profiles.get(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(report)
+
+@app.post("/api/debug/tracing")
+async def set_tracing(enabled: bool, slow_ms: Optional[float] = None):
+    """Turn request tracing on or off at runtime."""
+    require_single_worker()
+    tracer.enabled = enabled
+    if slow_ms is not None:
+        tracer.slow_ms = slow_ms
+    return {"enabled": tracer.enabled, "slow_ms": tracer.slow_ms}
+
+@app.get("/api/providers")
+async def get_providers():
+    """Get per-provider latency percentiles, error rates and concurrency limits."""
+    return {"providers": provider_router.snapshot(), "concurrency": PROVIDER_CONCURRENCY,
+            "hedging": provider_router.hedge}
+
+@app.get("/api/analysis-cache/stats")
+async def get_analysis_cache_stats():
+    """Get analysis cache size, hit/miss and request coalescing counters."""
+    stats = await asyncio.to_thread(analysis_cache.stats)
+    stats["single_flight"] = analysis_flight.stats()
+    return stats
+
+@app.delete("/api/analysis-cache")
+async def clear_analysis_cache():
+    """Remove all cached analyses."""
+    await asyncio.to_thread(analysis_cache.clear)
+    return {"success": True}
+
+SYMBOL_PROMPT_TEMPLATE = "以下是文件 {path} 中的 `{symbol}`（第 {start}-{end} 行），文件的其余部分会单独分析，请只分析这一部分：\n\n{code}"
+
+async def analyze_file_incrementally(path: str, code: str, model: str, analytype: str):
+    """Per-symbol analysis of a file that only sends changed symbols to the model; returns (content, stats)."""
+    async def analyze_symbols(chunks):
+        requests_ = [
+            AnalyzeRequest(
+                code=SYMBOL_PROMPT_TEMPLATE.format(path=path, symbol=chunk.symbols[0], start=chunk.start_line,
+                                                   end=chunk.end_line, code=chunk.text),
+                model=model, analytype=analytype
+            )
+            for chunk in chunks
+        ]
+        results = await asyncio.gather(*(analyze_with_cache(r) for r in requests_))
+        return [content for content, _ in results]
+
+    async def merge(parts):
+        if len(parts) == 1:
+            return parts[0][1]
+        summaries = [f"### {name}\n{analysis}" for name, analysis in parts]
+        merged = await reduce_summaries(summaries, model, analytype)
+        return await run_analysis(merged, model, analytype, REDUCE_SYSTEM_PROMPT)
+
+    return await analyze_incrementally(path, code, model, analytype, analyze_symbols, merge)
+
+@app.post("/api/analyze-incremental")
+async def analyze_file_incremental(request: IncrementalAnalyzeRequest):
+    """Re-analyze a file on disk, sending only changed functions/classes to the model, and save its .ai sidecar."""
+    try:
+        code = await asyncio.to_thread(Path(request.path).read_text, encoding="utf-8")
+        content, stats = await analyze_file_incrementally(request.path, code, request.model, request.analytype)
+        await asyncio.to_thread(Path(request.path + ".ai").write_text, content, encoding="utf-8")
+        on_analysis_saved(request.path + ".ai")
+        return {"content": content, **stats}
+    except Exception as e:
+        logger.error(f"Error in incremental analysis: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def analyze_for_job(code: str, model: str, analytype: str, path: str = "") -> str:
+    """Analysis entry point for batch jobs; returns the content to write as the file's .ai sidecar.
+
+    Per-symbol analysis only pays off for a changed file that already has a symbol record; a file
+    analyzed for the first time costs one call instead of one per symbol plus a merge.
+    """
+    if path and await asyncio.to_thread(has_symbol_record, path, model, analytype):
+        content, _ = await analyze_file_incrementally(path, code, model, analytype)
+    else:
+        content, _ = await analyze_with_cache(AnalyzeRequest(code=code, model=model, analytype=analytype, path=path))
+    return content
+
+# 批量分析任务：每个provider每分钟请求数上限，可通过 CODE_VIEW_<PROVIDER>_RPM 设置（0表示不限）
+PROVIDER_RPM = {
+    provider: float(os.environ.get(f"CODE_VIEW_{provider.upper()}_RPM", "0")) / WORKER_COUNT
+    for provider in PROVIDER_CONCURRENCY
+}
+JOBS_DIR = Path("data/jobs")
+job_manager = AnalysisJobManager(
+    JOBS_DIR,
+    analyze=analyze_for_job,
+    resolve_provider=lambda model: resolve_model(model)[0],
+    provider_rpm=PROVIDER_RPM,
+    on_saved=on_analysis_saved
+)
+
+@app.on_event("startup")
+async def resume_analysis_jobs():
+    """Restart batch jobs that were still running when the server stopped."""
+    if is_primary_worker:
+        job_manager.resume_jobs()
+
+@app.post("/api/jobs/analyze-repo")
+async def create_analyze_repo_job(request: AnalyzeRepoJobRequest):
+    """Start a batch analysis job over a directory tree."""
+    try:
+        job = job_manager.create_job(
+            request.path, request.model, request.analytype, request.include,
+            request.exclude, request.concurrency, request.max_file_bytes
+        )
+        return job_manager.progress(job)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/jobs")
+async def list_jobs():
+    """List batch analysis jobs."""
+    return {"jobs": [job_manager.progress(job) for job in job_manager.all_jobs()]}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get progress and ETA of a batch analysis job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_manager.progress(job)
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a running batch analysis job."""
+    if job_manager.cancel_job(job_id):
+        return {"success": True}
+    raise HTTPException(status_code=404, detail="No running job with this id")
+
+DIRECTORY_SUMMARY_PROMPT = "你会收到代码仓库中一个目录下各个文件的分析摘要和各个子目录的总结（以 / 结尾）。请用中文写出这个目录的简洁总结：先用一两句话说明目录的整体作用，再列出主要文件和子目录的职责以及它们之间的关系。只依据给出的内容，不要编造，不超过300字。"
+REPO_SUMMARY_PROMPT = "你会收到一个代码仓库根目录下各个文件的分析摘要和各个子目录的总结（以 / 结尾）。请用中文写出整个项目的概览：项目做什么，由哪些主要部分组成、各自的职责，关键流程和入口在哪里，以及建议的代码阅读顺序。只依据给出的内容，不要编造。"
+
+async def summarize_directory(text: str, model: str, is_root: bool) -> str:
+    return await run_analysis(text, model, "summary", REPO_SUMMARY_PROMPT if is_root else DIRECTORY_SUMMARY_PROMPT)
+
+repo_summaries = RepoSummarizer(
+    SummaryStore(Path("data/repo_summary.db")),
+    summarize=summarize_directory,
+    budget=lambda model: chunk_budget(resolve_model(model)[1])
+)
+repo_summary_flight = SingleFlight()
+
+@app.post("/api/repo-summary")
+async def build_repo_summary(request: RepoSummaryRequest):
+    """Roll the .ai analyses under a directory up the tree into a project overview.
+
+    Directory summaries are cached; only directories whose files or subdirectories changed
+    since the last build are summarized again.
+    """
+    root = os.path.abspath(request.path)
+    if not os.path.isdir(root):
+        raise HTTPException(status_code=404, detail="Directory not found")
+    try:
+        return await repo_summary_flight.do(
+            f"{root}:{request.model}",
+            lambda: repo_summaries.build(root, request.model, request.concurrency)
+        )
+    except Exception as e:
+        logger.error(f"Error building repo summary: {str(e)}", exc_info=True)
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        raise HTTPException(status_code=500, detail=detail)
+
+@app.get("/api/repo-summary")
+async def get_repo_summary(request: Request, path: str, model: Optional[str] = None):
+    """Cached summary of a directory and its subdirectories, without calling a model."""
+    summary = await asyncio.to_thread(repo_summaries.store.get, os.path.abspath(path), model)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No summary for this directory yet")
+    return json_response(request, summary)
+
 if __name__ == "__main__":
     logger.info("Starting server...")
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    if WORKER_COUNT > 1:
+        # 多进程模式需要以导入字符串启动，每个worker进程各自导入本模块
+        uvicorn.run("server:app", host="127.0.0.1", port=8000, workers=WORKER_COUNT)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,154 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+
+class ProcessLock:
+    """跨进程的文件锁，进程退出时由操作系统自动释放
+
+    Used to pick the one worker process that runs background indexers and batch jobs.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = None
+
+    def acquire(self) -> bool:
+        """Try to take the lock without blocking; True if this process holds it."""
+        if self._file is not None:
+            return True
+        f = open(self.path, "a+b")
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if sys.platform == "win32":
+            import msvcrt
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+def connect_shared(db_path: Path) -> sqlite3.Connection:
+    """SQLite connection for state shared by worker processes (WAL, waits for other writers)."""
+    conn = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class RefreshQueue:
+    """其他worker请求的索引刷新，由运行索引线程的worker取走执行"""
+
+    def __init__(self, db_path: Path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = connect_shared(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS refresh_requests (id INTEGER PRIMARY KEY, target TEXT NOT NULL, paths TEXT)"
+        )
+        self._conn.commit()
+
+    def put(self, target: str, paths: Optional[List[str]] = None):
+        with self._lock:
+            self._conn.execute("INSERT INTO refresh_requests (target, paths) VALUES (?, ?)",
+                               (target, json.dumps(paths) if paths is not None else None))
+            self._conn.commit()
+
+    def take(self) -> List[Tuple[str, Optional[List[str]]]]:
+        """Remove and return all queued (target, paths) requests."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, target, paths FROM refresh_requests ORDER BY id").fetchall()
+            if rows:
+                self._conn.execute("DELETE FROM refresh_requests WHERE id <= ?", (rows[-1][0],))
+                self._conn.commit()
+        return [(target, json.loads(paths) if paths is not None else None) for _, target, paths in rows]
+
+
+class ChangeFeed:
+    """运行文件监视的worker写入的文件变化，其他worker读出后推送给各自的浏览器连接"""
+
+    def __init__(self, db_path: Path, max_age: float = 300.0):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self._conn = connect_shared(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_changes (id INTEGER PRIMARY KEY, created REAL NOT NULL, batch TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def append(self, batch: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT INTO file_changes (created, batch) VALUES (?, ?)", (now, json.dumps(batch)))
+            self._conn.execute("DELETE FROM file_changes WHERE created < ?", (now - self.max_age,))
+            self._conn.commit()
+
+    def last_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM file_changes").fetchone()[0]
+
+    def read_since(self, last_id: int) -> List[Tuple[int, dict]]:
+        """(id, batch) of every batch appended after last_id."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, batch FROM file_changes WHERE id > ? ORDER BY id",
+                                      (last_id,)).fetchall()
+        return [(row_id, json.loads(batch)) for row_id, batch in rows]
+
+
+class WorkerSnapshots:
+    """每个worker进程定期写入自己的状态快照（如调用统计），任一worker读出全部后合并"""
+
+    def __init__(self, db_path: Path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = connect_shared(db_path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS worker_state (
+                kind TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (kind, pid)
+            )"""
+        )
+        self._conn.commit()
+
+    def put(self, kind: str, data: dict):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO worker_state (kind, pid, updated_at, data) VALUES (?, ?, ?, ?)",
+                               (kind, os.getpid(), time.time(), json.dumps(data)))
+            self._conn.commit()
+
+    def all(self, kind: str, max_age: float = 3600.0) -> List[dict]:
+        """Snapshots of every worker, dropping those not updated within max_age (exited workers)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM worker_state WHERE kind = ? AND updated_at < ?",
+                               (kind, time.time() - max_age))
+            self._conn.commit()
+            rows = self._conn.execute("SELECT data FROM worker_state WHERE kind = ? ORDER BY pid", (kind,)).fetchall()
+        return [json.loads(data) for data, in rows]
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStream:
+    """把一个上游流广播给多个订阅者，后加入的订阅者会先补发已收到的片段
+
+    The upstream is cancelled once every subscriber has gone away before it finished.
+    """
+
+    def __init__(self, source):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.abandoned = False
+        self._cond = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                async with self._cond:
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            async with self._cond:
+                self._cond.notify_all()
+
+    async def subscribe(self):
+        """Yield every chunk from the start, then follow the live stream until it ends."""
+        index = 0
+        self.subscribers += 1
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: index < len(self.chunks) or self.done)
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done and index >= len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                # 所有订阅者都已断开，不再等待上游
+                self.abandoned = True
+                self.task.cancel()
+
+
+async def _single_chunk(factory):
+    yield await factory()
+
+
+class SingleFlight:
+    """相同key的并发调用只发起一次上游请求，其余调用等待并共享结果或流
+
+    Streaming and non-streaming callers of a key share one flight: a non-streaming call is a
+    stream of a single chunk holding its result, and a stream is joined by concatenating it.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.upstream_calls = 0
+        self.deduplicated = 0
+
+    def _join(self, key: str, source_factory) -> SharedStream:
+        shared = self._flights.get(key)
+        if shared is not None and not shared.abandoned:
+            self.deduplicated += 1
+            logger.info(f"Joining in-flight call for {key[:16]}")
+            return shared
+        self.upstream_calls += 1
+        shared = SharedStream(source_factory())
+        self._flights[key] = shared
+
+        def finished(_):
+            if self._flights.get(key) is shared:
+                del self._flights[key]
+
+        shared.task.add_done_callback(finished)
+        return shared
+
+    async def do(self, key: str, factory):
+        """Await factory() once per key; concurrent callers share the same result."""
+        shared = self._join(key, lambda: _single_chunk(factory))
+        chunks = [chunk async for chunk in shared.subscribe()]
+        # 单次调用的结果可以是任意对象，流则拼接成文本
+        return chunks[0] if len(chunks) == 1 else "".join(chunks)
+
+    def stream(self, key: str, factory):
+        """Subscribe to the shared flight for key, starting the stream factory() if none is in flight."""
+        return self._join(key, factory).subscribe()
+
+    def stats(self) -> dict:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._flights),
+        }
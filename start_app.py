@@ -4,10 +4,11 @@ import webbrowser
 import uvicorn
 import threading
 import time
-from server import app
 import logging
 import socket
 import ctypes
+import argparse
+import multiprocessing
 
 def is_port_available(port):
     """检查端口是否可用"""
@@ -46,9 +47,19 @@ def setup_console():
             ctypes.windll.user32.ShowWindow(
                 ctypes.windll.kernel32.GetConsoleWindow(), 1)
 
+def get_worker_count():
+    """worker进程数：命令行 --workers 优先，其次环境变量 CODE_VIEW_WORKERS，默认1"""
+    parser = argparse.ArgumentParser(description="Code Viewer Server")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("CODE_VIEW_WORKERS", "1")))
+    args, _ = parser.parse_known_args()
+    return max(1, args.workers)
+
 def main():
     # 设置控制台
     setup_console()
+    workers = get_worker_count()
+    # server 模块在导入时按 CODE_VIEW_WORKERS 建立共享状态，必须在导入之前设置
+    os.environ["CODE_VIEW_WORKERS"] = str(workers)
     
     print("\n--- 正在初始化程序...")
     
@@ -77,6 +88,20 @@ def main():
     threading.Thread(target=open_browser, args=(port,), daemon=True).start()
     
     try:
+        if workers > 1:
+            print(f"--- 多进程模式: {workers} 个worker\n")
+            # 由各worker进程导入server模块，主进程只负责管理worker
+            uvicorn.run(
+                "server:app",
+                host="127.0.0.1",
+                port=port,
+                log_config=None,
+                access_log=False,
+                log_level="error",
+                workers=workers
+            )
+            return
+        from server import app
         # 使用自定义的日志配置启动服务器
         config = uvicorn.Config(
             app=app,
@@ -85,7 +110,7 @@ def main():
             log_config=None,  # 禁用默认的日志配置
             access_log=False,  # 禁用访问日志
             log_level="error",  # 只显示错误日志
-            workers=1  # 限制worker数量
+            workers=1
         )
         server = uvicorn.Server(config)
         server.run()
@@ -96,4 +121,6 @@ def main():
         input("\n按回车键退出...")
 
 if __name__ == "__main__":
+    # 打包后的exe启动worker子进程时需要
+    multiprocessing.freeze_support()
     main()
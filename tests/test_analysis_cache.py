@@ -0,0 +1,70 @@
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis_cache
+from analysis_cache import AnalysisCache, make_cache_key
+
+
+def fake_clock(monkeypatch, start=1_000_000.0):
+    """Every call to time.time() in analysis_cache returns one second later, so access order is exact."""
+    ticks = itertools.count(start)
+    monkeypatch.setattr(analysis_cache.time, "time", lambda: next(ticks))
+
+
+def total_in_db(cache) -> int:
+    return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+
+
+def test_evicts_least_recently_used_over_max_bytes(tmp_path, monkeypatch):
+    fake_clock(monkeypatch)
+    cache = AnalysisCache(tmp_path / "cache.db", max_bytes=250)
+    cache.put("a", "m", "simple", "a" * 100)
+    cache.put("b", "m", "simple", "b" * 100)
+    # a 写入得更早，但最近被读过，所以先淘汰 b
+    assert cache.get("a") == "a" * 100
+    cache.put("c", "m", "simple", "c" * 100)
+    assert cache.get("b") is None
+    assert cache.get("c") == "c" * 100
+
+    cache.put("d", "m", "simple", "d" * 100)
+    assert cache.get("a") is None
+    assert cache.get("c") == "c" * 100
+    assert cache.get("d") == "d" * 100
+    stats = cache.stats()
+    assert stats["bytes"] == total_in_db(cache) == 200
+    assert stats["evictions"] == 2
+
+
+def test_running_total_follows_overwrites_and_clear(tmp_path, monkeypatch):
+    fake_clock(monkeypatch)
+    cache = AnalysisCache(tmp_path / "cache.db")
+    key = make_cache_key("print(1)\r\n", "m", "simple")
+    assert key == make_cache_key("print(1)  \n", "m", "simple")
+    cache.put(key, "m", "simple", "short")
+    cache.put(key, "m", "simple", "a much longer analysis")
+    cache.put("other", "m", "detail", "中文")
+    assert cache.stats()["bytes"] == total_in_db(cache) == len("a much longer analysis") + 6
+    assert cache.stats()["entries"] == 2
+
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
+
+    # 重新打开时沿用已有的合计
+    cache.put(key, "m", "simple", "again")
+    reopened = AnalysisCache(tmp_path / "cache.db")
+    assert reopened.stats()["bytes"] == 5
+
+
+def test_expired_entries_miss_and_are_evicted(tmp_path, monkeypatch):
+    fake_clock(monkeypatch)
+    cache = AnalysisCache(tmp_path / "cache.db", max_age_seconds=10)
+    cache.put("old", "m", "simple", "x")
+    assert cache.get("old") == "x"
+    fake_clock(monkeypatch, start=2_000_000.0)
+    assert cache.get("old") is None
+    cache.put("new", "m", "simple", "y")
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == 1
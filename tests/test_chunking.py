@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import estimate_tokens, reduce_until_fits, split_code, split_content_defined, split_lines
+
+# 压缩后的 JS 只有一行，单行就超过预算
+MINIFIED_LINES = [
+    "a = 1\n",
+    "var x=0;" + ";".join(f"function f{i}(x){{return x*{i}}}" for i in range(5000)) + "\n",
+    "中" * 3000 + "\n",
+    "b = 2\n",
+]
+
+
+def test_split_lines_cuts_oversized_line():
+    for split in (split_lines, split_content_defined):
+        chunks = split(MINIFIED_LINES, 1, 500)
+        assert all(chunk.tokens <= 500 for chunk in chunks)
+        assert "".join(chunk.text for chunk in chunks) == "".join(MINIFIED_LINES)
+        assert chunks[-1].end_line == 4
+
+
+def test_pieces_of_a_line_keep_its_line_number():
+    chunks = split_lines(MINIFIED_LINES, 10, 500)
+    middle = [chunk for chunk in chunks if chunk.start_line == chunk.end_line == 11]
+    assert len(middle) > 1
+
+
+def test_split_code_minified_file_fits_budget():
+    code = "".join(MINIFIED_LINES)
+    chunks = split_code(code, 500, "app.min.js")
+    assert all(chunk.tokens <= 500 for chunk in chunks)
+    assert "".join(chunk.text for chunk in chunks) == code
+
+
+def test_reduce_merges_groups_until_they_fit():
+    calls = []
+
+    async def merge(text):
+        calls.append(text)
+        return "merged"
+
+    summaries = ["x" * 400] * 10  # 每个100 tokens，合计超过预算
+    result = asyncio.run(reduce_until_fits(summaries, 300, merge))
+    assert calls and estimate_tokens(result) <= 300
+
+
+def test_reduce_truncates_summaries_each_over_half_the_budget():
+    async def merge(text):
+        raise AssertionError("grouping cannot make progress, nothing to merge")
+
+    summaries = ["word " * 200, "data " * 200, "more " * 200]  # 每个约250 tokens，预算300
+    result = asyncio.run(reduce_until_fits(summaries, 300, merge))
+    assert estimate_tokens(result) <= 300
+    assert result.count("已截断") == 3
+    single = asyncio.run(reduce_until_fits(["word " * 1000], 300, merge))
+    assert estimate_tokens(single) <= 300
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fs_watcher import FileWatcher
+
+
+def make_watcher(root, batches) -> FileWatcher:
+    """A polling watcher driven by hand: poll() scans once and delivers the debounced batches."""
+    watcher = FileWatcher(lambda: [str(root)], batches.append, poll_interval=0, native=False)
+    watcher._backend = watcher._create_backend()
+    watcher._sync_roots()
+    return watcher
+
+
+def poll(watcher):
+    watcher._backend.read(0)
+    watcher._flush()
+
+
+def changes(batch) -> dict:
+    return {os.path.basename(c["path"]): (c["type"], c["isDirectory"]) for c in batch["changes"]}
+
+
+def test_polling_reports_created_modified_and_deleted(tmp_path):
+    (tmp_path / "keep.py").write_text("a = 1\n")
+    (tmp_path / "old.py").write_text("b = 2\n")
+    batches = []
+    watcher = make_watcher(tmp_path, batches)
+    assert watcher.backend == "polling"
+    poll(watcher)
+    assert batches == []
+
+    (tmp_path / "keep.py").write_text("a = 1000\n")
+    (tmp_path / "old.py").unlink()
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "new.py").write_text("c = 3\n")
+    poll(watcher)
+    assert len(batches) == 1
+    batch = batches[0]
+    assert batch["root"] == str(tmp_path) and not batch["rescan"]
+    assert changes(batch) == {
+        "keep.py": ("modified", False),
+        "old.py": ("deleted", False),
+        "pkg": ("created", True),
+        "new.py": ("created", False),
+    }
+    # 列表变化的目录：删除/新建文件的父目录和新目录本身
+    assert batch["dirs"] == [str(tmp_path), str(tmp_path / "pkg")]
+
+    poll(watcher)
+    assert len(batches) == 1
+
+
+def test_polling_skips_gitignored_and_excluded_paths(tmp_path):
+    (tmp_path / ".gitignore").write_text("build/\n*.log\n")
+    (tmp_path / "build").mkdir()
+    batches = []
+    watcher = make_watcher(tmp_path, batches)
+    watcher.exclude = lambda path: os.path.basename(path) == "skip.py"
+
+    (tmp_path / "build" / "out.js").write_text("x")
+    (tmp_path / "debug.log").write_text("x")
+    (tmp_path / "skip.py").write_text("x")
+    (tmp_path / "main.py").write_text("x")
+    poll(watcher)
+    assert [changes(batch) for batch in batches] == [{"main.py": ("created", False)}]
+
+
+def test_polling_watcher_thread_delivers_batches(tmp_path):
+    (tmp_path / "existing.py").write_text("x")
+    batches = []
+    watcher = FileWatcher(lambda: [str(tmp_path)], batches.append, debounce=0.05, poll_interval=0.05,
+                          native=False)
+    watcher.start()
+    try:
+        deadline = time.monotonic() + 5
+        # 初始快照建好之后再改文件
+        while watcher.stats()["watches"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        (tmp_path / "a.py").write_text("x")
+        while not batches and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+    assert [changes(batch) for batch in batches] == [{"a.py": ("created", False)}]
+    assert watcher.stats()["backend"] == "polling"
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from git_clone import GitCloneManager
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@example.com",
+               GIT_COMMITTER_NAME="t", GIT_COMMITTER_EMAIL="t@example.com")
+
+
+def git(*args, cwd=None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, env=GIT_ENV, check=True, capture_output=True, text=True).stdout
+
+
+def commit(work, name: str, content: str):
+    with open(os.path.join(work, name), "w") as f:
+        f.write(content)
+    git("add", name, cwd=work)
+    git("commit", "-q", "-m", name, cwd=work)
+
+
+def make_remote(tmp_path):
+    """A bare repository with two commits, and a working clone used to push more."""
+    remote, work = str(tmp_path / "remote.git"), str(tmp_path / "work")
+    git("init", "-q", "--bare", "-b", "main", remote)
+    git("clone", "-q", remote, work)
+    git("checkout", "-q", "-b", "main", cwd=work)
+    commit(work, "a.txt", "1\n")
+    commit(work, "b.txt", "2\n")
+    git("push", "-q", "origin", "main", cwd=work)
+    return "file://" + remote, work
+
+
+def run_job(manager, url, path, **options) -> dict:
+    async def run():
+        job = manager.start(url, path, **options)
+        await manager._tasks[job["id"]]
+        return job
+    return asyncio.run(run())
+
+
+def test_clone_is_shallow_and_fetch_keeps_depth(tmp_path):
+    url, work = make_remote(tmp_path)
+    repo = tmp_path / "repo"
+    manager = GitCloneManager()
+    job = run_job(manager, url, repo)
+    assert (job["action"], job["status"]) == ("clone", "completed")
+    assert (repo / ".git" / "shallow").exists()
+
+    commit(work, "c.txt", "3\n")
+    git("push", "-q", "origin", "main", cwd=work)
+    job = run_job(manager, url, repo)
+    assert (job["action"], job["status"]) == ("fetch", "completed")
+    assert (repo / "c.txt").exists()
+    assert (repo / ".git" / "shallow").exists()
+
+    job = run_job(manager, url, repo, depth=None)
+    assert job["status"] == "completed"
+    assert not (repo / ".git" / "shallow").exists()
+    assert git("rev-list", "--count", "HEAD", cwd=repo).strip() == "3"
+
+
+def test_full_clone_stays_full(tmp_path):
+    url, _ = make_remote(tmp_path)
+    repo = tmp_path / "repo"
+    manager = GitCloneManager()
+    run_job(manager, url, repo, depth=None)
+    job = run_job(manager, url, repo)
+    assert job["status"] == "completed"
+    assert git("rev-list", "--count", "HEAD", cwd=repo).strip() == "2"
+
+
+def test_fetch_keeps_diverged_local_commits(tmp_path):
+    url, work = make_remote(tmp_path)
+    repo = tmp_path / "repo"
+    manager = GitCloneManager()
+    run_job(manager, url, repo, depth=None)
+    commit(str(repo), "local.txt", "mine\n")
+    local_head = git("rev-parse", "HEAD", cwd=repo)
+    commit(work, "c.txt", "3\n")
+    git("push", "-q", "origin", "main", cwd=work)
+
+    job = run_job(manager, url, repo)
+    assert job["status"] == "failed"
+    assert "fast-forward" in job["error"]
+    assert git("rev-parse", "HEAD", cwd=repo) == local_head
+    assert (repo / "local.txt").exists()
@@ -0,0 +1,78 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import HistoryStore, SharedHistoryStore
+
+
+def open_store(tmp_path, **options) -> HistoryStore:
+    return HistoryStore(tmp_path / "history.json", tmp_path / "history.journal", **options)
+
+
+def test_journal_replay_restores_order_and_counts(tmp_path):
+    store = open_store(tmp_path)
+    for path in ["/a", "/b", "/a", "/c"]:
+        store.touch(path)
+    store.remove("/c")
+    store.close()
+
+    reopened = open_store(tmp_path)
+    assert reopened.paths() == ["/a", "/b"]
+    assert [entry["count"] for entry in reopened.entries()] == [2, 1]
+    assert not (tmp_path / "history.json").exists()
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    store = open_store(tmp_path)
+    store.touch("/a")
+    store.touch("/b")
+    store.close()
+    # 崩溃时最后一行只写了一半
+    with open(tmp_path / "history.journal", "a", encoding="utf-8") as f:
+        f.write('{"op": "touch", "pa')
+
+    reopened = open_store(tmp_path)
+    assert reopened.paths() == ["/b", "/a"]
+
+
+def test_compaction_writes_snapshot_and_empties_journal(tmp_path):
+    store = open_store(tmp_path, compact_after=3)
+    store.touch("/a")
+    store.touch("/b")
+    store.touch("/a")  # 第3行触发压缩
+    assert (tmp_path / "history.journal").read_text(encoding="utf-8") == ""
+    snapshot = json.loads((tmp_path / "history.json").read_text(encoding="utf-8"))
+    assert [(entry["path"], entry["count"]) for entry in snapshot] == [("/b", 1), ("/a", 2)]
+
+    store.touch("/c")
+    store.close()
+    reopened = open_store(tmp_path, compact_after=3)
+    assert reopened.paths() == ["/c", "/a", "/b"]
+    assert reopened.entries()[1]["count"] == 2
+
+
+def test_legacy_history_is_imported_once(tmp_path):
+    legacy = tmp_path / "history.log"
+    legacy.write_text(json.dumps(["/old1", "/old2"]), encoding="utf-8")
+    store = open_store(tmp_path, legacy_path=legacy)
+    assert store.paths() == ["/old2", "/old1"]
+    store.touch("/new")
+    store.compact()
+    store.close()
+
+    legacy.write_text(json.dumps(["/ignored"]), encoding="utf-8")
+    reopened = open_store(tmp_path, legacy_path=legacy)
+    assert reopened.paths() == ["/new", "/old2", "/old1"]
+
+
+def test_shared_store_is_seeded_once(tmp_path):
+    seed = [{"path": "/a", "count": 3, "last_access": 2.0}, {"path": "/b", "count": 1, "last_access": 1.0}]
+    store = SharedHistoryStore(tmp_path / "shared.db", seed=lambda: seed)
+    assert store.paths() == ["/a", "/b"]
+    store.touch("/b")
+    again = SharedHistoryStore(tmp_path / "shared.db", seed=lambda: [{"path": "/x", "count": 1, "last_access": 9.0}])
+    assert again.paths() == ["/b", "/a"]
+    assert again.entries()[0]["count"] == 2
+    assert again.remove("/a") and not again.remove("/a")
@@ -0,0 +1,109 @@
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+import http_cache
+from http_cache import CompressionMiddleware, json_response
+
+ITEMS = [{"name": f"file{i}.py", "size": i} for i in range(200)]
+MTIME = 1_700_000_000.0
+
+
+def make_client() -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+
+    @app.get("/items")
+    async def items(request: Request):
+        return json_response(request, ITEMS)
+
+    @app.get("/versioned")
+    async def versioned(request: Request):
+        return json_response(request, ITEMS[:3], etag='W/"1-abc"', last_modified=MTIME)
+
+    @app.get("/small")
+    async def small():
+        return PlainTextResponse("tiny")
+
+    @app.get("/events")
+    async def events():
+        async def lines():
+            for item in ITEMS:
+                yield f'{{"name":"{item["name"]}"}}\n'
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return TestClient(app)
+
+
+def test_etag_round_trip_returns_304():
+    client = make_client()
+    first = client.get("/items")
+    assert first.status_code == 200
+    assert first.json() == ITEMS
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+    assert first.headers["cache-control"] == "no-cache"
+
+    again = client.get("/items", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == etag
+    # 压缩时代理可能去掉 W/，弱比较仍然匹配
+    assert client.get("/items", headers={"If-None-Match": etag[2:]}).status_code == 304
+    assert client.get("/items", headers={"If-None-Match": 'W/"1-other"'}).status_code == 200
+
+
+def test_if_modified_since_is_used_without_if_none_match():
+    client = make_client()
+    first = client.get("/versioned")
+    last_modified = first.headers["last-modified"]
+    assert client.get("/versioned", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get("/versioned", headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"}).status_code == 200
+    # If-None-Match 优先
+    headers = {"If-Modified-Since": last_modified, "If-None-Match": 'W/"1-other"'}
+    assert client.get("/versioned", headers=headers).status_code == 200
+
+
+def test_gzip_negotiation():
+    client = make_client()
+    compressed = client.get("/items", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.json() == ITEMS
+    assert int(compressed.headers["content-length"]) < len(http_cache.render_json(ITEMS))
+
+    for accept in ("identity", "gzip;q=0"):
+        plain = client.get("/items", headers={"Accept-Encoding": accept})
+        assert "content-encoding" not in plain.headers
+        assert plain.json() == ITEMS
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_brotli_preferred_only_when_installed():
+    expected = "br" if http_cache.brotli is not None else "gzip"
+    assert http_cache._accepted_encoding("gzip, br") == expected
+    assert http_cache._accepted_encoding("br;q=0, gzip;q=0.5") == "gzip"
+    assert http_cache._accepted_encoding("deflate") is None
+
+
+def test_ndjson_stream_is_gzipped_per_chunk():
+    client = make_client()
+    response = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    lines = response.text.splitlines()
+    assert len(lines) == len(ITEMS) and lines[-1] == '{"name":"file199.py"}'
+
+
+def test_stream_compressor_output_decodes_after_each_flush():
+    compressor = http_cache._StreamCompressor("gzip")
+    data = compressor.compress(b"first line\n", False)
+    data += compressor.compress(b"second line\n", True)
+    assert gzip.decompress(data) == b"first line\nsecond line\n"
@@ -0,0 +1,52 @@
+import ast
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import extract_symbols, split_code
+from prompt_reduction import is_python, reduce_prompt
+
+# 函数定义前的换页符：str.splitlines 会把它当成换行，ast 不会
+FORM_FEED_CODE = (
+    'import os\n\x0c\ndef f(a):\n    """Doc."""\n    return a + 1\n\n'
+    "DATA = [\n" + "".join(f"    {i},\n" for i in range(30)) + "]\n"
+)
+
+
+def test_detail_collapses_literal_after_form_feed():
+    reduced, report = reduce_prompt(FORM_FEED_CODE, "m.py", "detail")
+    assert "DATA = [...]" in reduced
+    assert "    29,\n" not in reduced
+    assert "return a + 1" in reduced
+    ast.parse(reduced)
+
+
+def test_outline_keeps_docstring_after_form_feed():
+    reduced, _ = reduce_prompt(FORM_FEED_CODE, "m.py", "simple")
+    assert '"""Doc."""' in reduced
+    assert "return a + 1" not in reduced
+    ast.parse(reduced)
+
+
+def test_unknown_path_is_not_python():
+    assert not is_python("")
+    assert is_python("m.py")
+    _, report = reduce_prompt(FORM_FEED_CODE, "", "simple")
+    assert not any(step.startswith("outline") for step in report["steps"])
+
+
+def test_chunks_follow_ast_lines_after_form_feed():
+    chunks = extract_symbols(FORM_FEED_CODE, "m.py")
+    f = next(c for c in chunks if c.symbols == ["f"])
+    assert f.text.startswith("def f(a):")
+    assert "".join(c.text for c in split_code(FORM_FEED_CODE, 20, "m.py")) == FORM_FEED_CODE
+
+
+def test_collapsed_literal_keeps_closing_brackets():
+    code = "x = foo([\n" + "".join(f"    {i},\n" for i in range(42)) + "])\ny = {'k': bar((\n" + \
+        "".join(f"    'item{i}',\n" for i in range(42)) + "))}\n"
+    reduced, _ = reduce_prompt(code, "m.py", "detail")
+    assert "x = foo([...])  # 省略了" in reduced
+    assert "    41,\n" not in reduced
+    ast.parse(reduced)
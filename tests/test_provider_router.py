@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from provider_router import ProviderRouter
+
+TARGETS = [("a", "model-a"), ("b", "model-b")]
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_retries_then_fails_over_to_next_provider():
+    calls, failures = [], []
+    router = ProviderRouter(max_retries=1, base_backoff=0.001, on_failure=lambda p, e: failures.append(p))
+
+    async def invoke(provider, model):
+        calls.append(provider)
+        if provider == "a":
+            raise StatusError(503)
+        return f"{model} ok"
+
+    result, target = asyncio.run(router.call(TARGETS, invoke))
+    assert (result, target) == ("model-b ok", ("b", "model-b"))
+    assert calls == ["a", "a", "b"]
+    assert failures == ["a", "a"]
+    assert router.snapshot()["a"]["failures"] == 2
+
+
+def test_non_retryable_error_fails_over_without_retry():
+    calls = []
+    router = ProviderRouter(max_retries=3, base_backoff=0.001)
+
+    async def invoke(provider, model):
+        calls.append(provider)
+        raise StatusError(400)
+
+    try:
+        asyncio.run(router.call(TARGETS, invoke))
+        assert False, "every provider failed"
+    except StatusError as e:
+        assert e.status_code == 400
+    assert calls == ["a", "b"]
+
+
+def test_cooling_down_primary_goes_last():
+    router = ProviderRouter()
+    router.stats_for("a").record_failure(StatusError(429))
+    assert router.order(TARGETS) == [("b", "model-b"), ("a", "model-a")]
+    assert router.snapshot()["a"]["cooling_down"]
+
+
+def test_slow_primary_is_hedged():
+    router = ProviderRouter(hedge=True, hedge_min_delay=0.02, hedge_min_samples=3)
+    for _ in range(3):
+        router.stats_for("a").record_success(latency=0.01)
+    cancelled = []
+
+    async def invoke(provider, model):
+        if provider == "a":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(provider)
+                raise
+        return provider
+
+    result, target = asyncio.run(router.call(TARGETS, invoke))
+    assert (result, target) == ("b", ("b", "model-b"))
+    assert cancelled == ["a"]
+    assert router.snapshot()["a"]["hedges"] == 1
+
+
+def test_no_hedge_without_enough_samples():
+    router = ProviderRouter(hedge=True, hedge_min_delay=0.01, hedge_min_samples=3)
+
+    async def invoke(provider, model):
+        await asyncio.sleep(0.05)
+        return provider
+
+    result, _ = asyncio.run(router.call(TARGETS, invoke))
+    assert result == "a"
+    assert router.snapshot()["a"]["hedges"] == 0
+
+
+def test_stream_fails_over_only_before_first_delta():
+    def open_stream(fail_after):
+        async def source(provider, model):
+            for i in range(3):
+                if provider == "a" and i == fail_after:
+                    raise StatusError(502)
+                yield f"{provider}{i}"
+        return source
+
+    async def collect(fail_after):
+        router = ProviderRouter(max_retries=0)
+        return [delta async for delta in router.stream(TARGETS, open_stream(fail_after))]
+
+    assert asyncio.run(collect(0)) == ["b0", "b1", "b2"]
+    chunks = []
+
+    async def partial():
+        router = ProviderRouter(max_retries=0)
+        async for delta in router.stream(TARGETS, open_stream(2)):
+            chunks.append(delta)
+
+    try:
+        asyncio.run(partial())
+        assert False, "the stream was already committed to provider a"
+    except StatusError:
+        pass
+    assert chunks == ["a0", "a1"]
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"content": "result"}
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", factory) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result == {"content": "result"} for result in results)
+    assert flight.stats() == {"upstream_calls": 1, "deduplicated": 4, "in_flight": 0}
+
+
+def test_late_stream_subscriber_gets_chunks_from_the_start():
+    flight = SingleFlight()
+    started = []
+
+    async def source():
+        started.append(1)
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.02)
+            yield chunk
+
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return [chunk async for chunk in flight.stream("key", source)]
+
+    async def join(delay):
+        await asyncio.sleep(delay)
+        return await flight.do("key", lambda: None)
+
+    async def run():
+        # 非流式调用加入同一个流时得到拼接后的文本
+        return await asyncio.gather(collect(0), collect(0.03), join(0.01))
+
+    first, late, joined = asyncio.run(run())
+    assert len(started) == 1
+    assert first == late == ["a", "b", "c"]
+    assert joined == "abc"
+
+
+def test_upstream_cancelled_when_every_subscriber_leaves():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def source():
+        try:
+            for i in range(20):
+                await asyncio.sleep(0.01)
+                yield str(i)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def read_two():
+        stream = flight.stream("key", source)
+        chunks = [await stream.__anext__(), await stream.__anext__()]
+        await stream.aclose()
+        return chunks
+
+    async def run():
+        chunks = await asyncio.gather(read_two(), read_two())
+        await asyncio.sleep(0.05)
+        # 被放弃的flight不再被复用，新的调用重新请求上游
+        again = [chunk async for chunk in flight.stream("key", source)]
+        return chunks, again
+
+    chunks, again = asyncio.run(run())
+    assert chunks == [["0", "1"], ["0", "1"]]
+    assert cancelled == [1]
+    assert len(again) == 20
+    assert flight.stats()["upstream_calls"] == 2
@@ -0,0 +1,242 @@
+import contextvars
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+
+from fastapi.responses import JSONResponse
+
+PROFILE_HEADER = "x-profile"
+PROFILE_INTERVAL = 0.005
+MAX_PROFILES = 20
+# 采样时忽略这些空闲等待的栈顶函数，只保留真正在干活的线程
+_IDLE_LEAVES = {("threading.py", "wait"), ("selectors.py", "select"), ("queue.py", "get"),
+                ("threading.py", "_wait_for_tstate_lock")}
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    """一次请求中各类操作（文件系统、模型调用、序列化、日志）累计的耗时"""
+
+    def __init__(self, trace_id: int, method: str, path: str):
+        self.id = trace_id
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.bytes = 0
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.spans = {}
+        self.profile_id = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        # 线程池中的操作也会写入，所以加锁
+        with self._lock:
+            total, count = self.spans.get(name, (0.0, 0))
+            self.spans[name] = (total + seconds, count + 1)
+
+    def to_dict(self) -> dict:
+        spans = {name: {"ms": round(total * 1000, 2), "count": count} for name, (total, count) in self.spans.items()}
+        accounted = sum(total for total, _ in self.spans.values())
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "bytes": self.bytes,
+            "spans": spans,
+            "other_ms": round(max(0.0, self.duration - accounted) * 1000, 2),
+            "profile_id": self.profile_id,
+        }
+
+
+@contextmanager
+def span(name: str):
+    """Add the time spent in the block to the current request's trace (no-op when tracing is off)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+async def traced_iter(name: str, iterator):
+    """Re-yield an async iterator, counting only the time spent waiting for its items."""
+    iterator = iterator.__aiter__()
+    try:
+        while True:
+            with span(name):
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield item
+    finally:
+        # 调用方提前关闭时也要关闭被包装的迭代器（释放HTTP连接）
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+class TracedJSONResponse(JSONResponse):
+    """JSONResponse whose rendering time is recorded as the "serialize" span."""
+
+    def render(self, content) -> bytes:
+        with span("serialize"):
+            return super().render(content)
+
+
+def instrument_logging(target: logging.Logger = None):
+    """Record time spent in the handlers of a logger (the root logger by default) as the "logging" span."""
+    target = target or logging.getLogger()
+    for handler in target.handlers:
+        if getattr(handler, "_traced", False):
+            continue
+        original = handler.handle
+
+        def handle(record, _original=original):
+            with span("logging"):
+                return _original(record)
+
+        handler.handle = handle
+        handler._traced = True
+
+
+class SamplingProfiler:
+    """采样式profiler：后台线程定期抓取所有线程的调用栈，统计各调用栈出现的次数"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self, top: int = 40) -> str:
+        """Text report: functions by own samples and by inclusive samples, then folded stacks."""
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                inclusive[name] += count
+        total = sum(self.stacks.values()) or 1
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f}ms", "", "Own time:"]
+        lines += [f"{100 * c / total:6.1f}%  {name}" for name, c in own.most_common(top)]
+        lines += ["", "Inclusive time:"]
+        lines += [f"{100 * c / total:6.1f}%  {name}" for name, c in inclusive.most_common(top)]
+        lines += ["", "Folded stacks (flamegraph.pl / speedscope input):"]
+        lines += [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """按需开启的请求追踪的状态：开关、慢请求环形缓冲和profile结果"""
+
+    def __init__(self, enabled: bool = False, slow_ms: float = 500, buffer_size: int = 100):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.slow_requests = deque(maxlen=buffer_size)
+        self.profiles = OrderedDict()
+        self.ids = itertools.count(1)
+        self.profile_lock = threading.Lock()
+
+    def slow(self, limit: int = 50) -> list:
+        return [trace.to_dict() for trace in reversed(self.slow_requests)][:limit]
+
+    def finish(self, trace: RequestTrace, profiler=None):
+        if profiler is not None:
+            self.profiles[trace.id] = profiler.report()
+            while len(self.profiles) > MAX_PROFILES:
+                self.profiles.popitem(last=False)
+        if trace.duration * 1000 >= self.slow_ms or profiler is not None:
+            self.slow_requests.append(trace)
+
+
+class TracingMiddleware:
+    """ASGI middleware recording a RequestTrace per request while the tracer is enabled.
+
+    Profiling one request: send the header "X-Profile: 1" while tracing is enabled; the response
+    carries X-Profile-Id, and the report is kept in tracer.profiles.
+    """
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        tracer = self.tracer
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(next(tracer.ids), scope["method"], scope["path"])
+        profiler = None
+        headers = dict(scope.get("headers") or [])
+        # 同一时间只profile一个请求
+        if headers.get(PROFILE_HEADER.encode()) == b"1" and tracer.profile_lock.acquire(blocking=False):
+            profiler = SamplingProfiler()
+            profiler.start()
+            trace.profile_id = trace.id
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                if profiler is not None:
+                    message["headers"] = list(message.get("headers", [])) + \
+                        [(b"x-profile-id", str(trace.id).encode())]
+            elif message["type"] == "http.response.body":
+                trace.bytes += len(message.get("body", b""))
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            _current_trace.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            trace.route = getattr(scope.get("route"), "path", None)
+            if profiler is not None:
+                profiler.stop()
+                tracer.profile_lock.release()
+            tracer.finish(trace, profiler)
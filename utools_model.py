@@ -1,6 +1,10 @@
 import base64
-import requests
 import json
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
 
 headers = {
     'Host': 'ai.u-tools.cn',
@@ -30,41 +34,99 @@ model_key_map={
 }
 
 
-def do_request(modelname="deepseek",prompt=""):
+SYSTEM_PROMPT = "You are a benevolent programming expert, adept at deciphering code from the perspective of a beginner. The emphasis is on elucidating the functionality and operational mechanisms of the code in accessible and understandable language. Please start by summarizing the overall function of the code, then provide functional annotations for the provided code to help beginners quickly grasp the project and get started. For each function, it is imperative to elucidate its purpose, detailing what it takes as input, what it outputs, and the specific functionality it accomplishes.The explanations should be given in Chinese."
+
+
+UTOOLS_BASE_URL = "https://ai.u-tools.cn/v1/chat/completions"
+# 连接超时短一些，读超时要容纳模型生成一整段回答
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 180
+
+
+def build_request(modelname="deepseek",prompt="",stream=False,system_prompt=SYSTEM_PROMPT):
     access_token=''
-    url = f"https://ai.u-tools.cn/v1/chat/completions?access_token={access_token}&avatar=https%3A%2F%2Fres.u-tools.cn%2Fassets%2Favatars%2Favatar.png"
+    url = f"{UTOOLS_BASE_URL}?access_token={access_token}&avatar=https%3A%2F%2Fres.u-tools.cn%2Fassets%2Favatars%2Favatar.png"
     payload = json.dumps({
     "model": model_key_map.get(modelname),
     "messages": [
         {
         "role": "system",
-        "content": "You are a benevolent programming expert, adept at deciphering code from the perspective of a beginner. The emphasis is on elucidating the functionality and operational mechanisms of the code in accessible and understandable language. Please start by summarizing the overall function of the code, then provide functional annotations for the provided code to help beginners quickly grasp the project and get started. For each function, it is imperative to elucidate its purpose, detailing what it takes as input, what it outputs, and the specific functionality it accomplishes.The explanations should be given in Chinese."
+        "content": system_prompt
         },
         {
         "role": "user",
         "content": prompt
         }
     ],
-    "stream": False
+    "stream": stream
     })
-    try:
-        response = requests.request("POST", url, headers=headers, data=payload)
-        res=json.loads(response.text)
-        print(res)
-        return res.get("choices")[0].get("message").get("content")
-    except Exception as e:
-        print(e)
-        return "error:"+str(e)
+    return url, payload
+
+
+def parse_content(data: dict) -> str:
+    return data.get("choices")[0].get("message").get("content")
+
+
+def parse_stream_line(line: str):
+    """Return the text delta in one SSE line, None to skip it, or StopIteration at [DONE]."""
+    if not line or not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return StopIteration
+    choices = json.loads(data).get("choices") or []
+    if choices:
+        return choices[0].get("delta", {}).get("content") or None
+    return None
+
+
+class AsyncUToolsClient:
+    """uTools异步客户端（httpx），和 AsyncOpenAI 一样在事件循环中直接调用，不占用线程"""
+
+    def __init__(self, pool_size=8, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def chat(self, modelname="deepseek", prompt="", system_prompt=SYSTEM_PROMPT) -> str:
+        url, payload = build_request(modelname, prompt, stream=False, system_prompt=system_prompt)
+        response = await self.client.post(url, content=payload)
+        response.raise_for_status()
+        return parse_content(response.json())
 
+    async def stream(self, modelname="deepseek", prompt="", system_prompt=SYSTEM_PROMPT):
+        """流式请求，逐段yield增量文本"""
+        url, payload = build_request(modelname, prompt, stream=True, system_prompt=system_prompt)
+        async with self.client.stream("POST", url, content=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                delta = parse_stream_line(line)
+                if delta is StopIteration:
+                    break
+                if delta:
+                    yield delta
 
+    async def aclose(self):
+        await self.client.aclose()
 
 
+if __name__ == "__main__":
+    import asyncio
 
+    async def main():
+        print(model_key_map.keys())
+        model_list = ["deepseek", "doubao", "wenxinspeed", "glm4", "deepseekr1", "qwen", "wenxin35"]
+        client = AsyncUToolsClient()
+        try:
+            for model in model_list:
+                print(f"model:{model}")
+                try:
+                    print(await client.chat(modelname=model, prompt="hi"))
+                except Exception as e:
+                    print(f"error: {e}")
+        finally:
+            await client.aclose()
 
-if __name__ == "__main__":  
-    print(model_key_map.keys())
-    model_list=["deepseek","doubao","wenxinspeed","glm4","deepseekr1","qwen","wenxin35"]
-    for model in model_list:
-        print(f"model:{model}")
-        do_request(modelname=model,prompt="hi")
-        # break
+    asyncio.run(main())